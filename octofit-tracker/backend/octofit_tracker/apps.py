@@ -0,0 +1,15 @@
+from django.apps import AppConfig
+
+
+class OctofitTrackerConfig(AppConfig):
+    name = 'octofit_tracker'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+        from django.conf import settings
+        from . import cache
+        cache.check_backend()
+        if getattr(settings, 'PROFILING_ENABLED', False):
+            # Before any MongoClient exists, so djongo's client reports too
+            from . import profiling
+            profiling.install()
@@ -0,0 +1,159 @@
+"""ASGI-native team and leaderboard endpoints.
+
+Plain Django async views backed by a shared Motor client, so a worker
+waiting on MongoDB yields its event loop instead of holding a thread.
+They mirror the TeamViewSet routes and ``LeaderboardViewSet.top`` under
+``/api/async/`` and are meant to be served by an ASGI server (uvicorn,
+daphne); under WSGI Django still runs them, one event loop per request.
+"""
+import json
+
+from asgiref.sync import sync_to_async
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import JsonResponse
+from rest_framework.exceptions import ParseError
+
+from . import membership, metrics, projection
+from .mongo import get_async_db
+from .pagination import KeysetPagination, bounded_int
+from .ranking import MAX_TOP, get_rank_index, ranked_rows
+from .serializers import LeaderboardSerializer, row_serializer
+
+
+def _json(data, status=200):
+    return JsonResponse(data, status=status, safe=False, encoder=DjangoJSONEncoder)
+
+
+def _method_not_allowed(allowed):
+    response = _json({'detail': 'Method not allowed.'}, status=405)
+    response['Allow'] = ', '.join(allowed)
+    return response
+
+
+def _csrf_exempt(view):
+    # django.views.decorators.csrf.csrf_exempt wraps the view in a sync
+    # function on Django 4.1, which would hide that the view is async
+    view.csrf_exempt = True
+    return view
+
+
+def _format_team(team):
+    team['_id'] = str(team['_id'])
+    if 'members' not in team:
+        team['members'] = []
+    team['member_count'] = len(team['members'])
+    return team
+
+
+def _team_key(pk):
+    return int(pk)
+
+
+def _request_user_id(request):
+    try:
+        return json.loads(request.body or b'{}').get('user_id')
+    except (ValueError, AttributeError):
+        return None
+
+
+class _TeamListView:
+    cursor_ordering = ('_id',)
+
+
+@_csrf_exempt
+async def team_list(request):
+    if request.method != 'GET':
+        return _method_not_allowed(['GET'])
+    try:
+        db = get_async_db()
+        paginator = KeysetPagination()
+        query, sort = paginator.collection_query(request, _TeamListView)
+        rows = await db.teams.find(query).sort(sort).limit(paginator.limit + 1).to_list(None)
+        teams = [_format_team(team) for team in paginator.finish_collection_page(rows)]
+        return _json({'next': paginator.get_next_link(), 'results': teams})
+    except Exception as e:
+        metrics.record_view_error('async_views', 'team_list', e)
+        return _json({'error': f'Failed to fetch teams: {str(e)}'}, status=500)
+
+
+@_csrf_exempt
+async def team_detail(request, pk):
+    if request.method != 'GET':
+        return _method_not_allowed(['GET'])
+    try:
+        db = get_async_db()
+        team = await db.teams.find_one({'_id': _team_key(pk)})
+        if not team:
+            return _json({'error': 'Team not found'}, status=404)
+        return _json(_format_team(team))
+    except Exception as e:
+        metrics.record_view_error('async_views', 'team_detail', e)
+        return _json({'error': f'Failed to fetch team: {str(e)}'}, status=500)
+
+
+_MEMBERSHIP_ERRORS = {
+    membership.TEAM_NOT_FOUND: ('Team not found', 404),
+    membership.USER_NOT_FOUND: ('User not found', 404),
+    membership.ALREADY_MEMBER: ('User already in team', 400),
+    membership.NOT_MEMBER: ('User not in team', 400),
+}
+
+
+async def _change_membership(request, change, pk, success, failure):
+    if request.method != 'POST':
+        return _method_not_allowed(['POST'])
+    try:
+        user_id = _request_user_id(request)
+        if not user_id:
+            return _json({'error': 'user_id required'}, status=400)
+        # The membership writes span users, teams and leaderboard rows and
+        # are shared with the WSGI views, so run them on the thread pool
+        result = await sync_to_async(change)(_team_key(pk), user_id)
+        if result in _MEMBERSHIP_ERRORS:
+            message, code = _MEMBERSHIP_ERRORS[result]
+            return _json({'error': message}, status=code)
+        return _json({'status': success})
+    except Exception as e:
+        metrics.record_view_error('async_views', change.__name__, e)
+        return _json({'error': f'{failure}: {str(e)}'}, status=500)
+
+
+@_csrf_exempt
+async def team_add_member(request, pk):
+    return await _change_membership(request, membership.add_member, pk, 'member added', 'Failed to add member')
+
+
+@_csrf_exempt
+async def team_remove_member(request, pk):
+    return await _change_membership(request, membership.remove_member, pk, 'member removed', 'Failed to remove member')
+
+
+def _top_entries(limit):
+    # Run on the thread pool: building the rank index reads the whole leaderboard
+    return get_rank_index().top(limit)
+
+
+@_csrf_exempt
+async def leaderboard_top(request):
+    """Top users by calories: the rows, fields and order of ``LeaderboardViewSet.top``"""
+    if request.method != 'GET':
+        return _method_not_allowed(['GET'])
+    try:
+        limit = bounded_int(request.GET, 'limit', 10, 1, MAX_TOP)
+    except ValueError:
+        return _json({'error': 'limit must be an integer'}, status=400)
+    rows = row_serializer(LeaderboardSerializer)
+    try:
+        fields = projection.requested_fields(request, rows.fields) or rows.fields
+    except ParseError as e:
+        return _json({'detail': e.detail}, status=400)
+    try:
+        entries = await sync_to_async(_top_entries)(limit)
+        documents = await get_async_db().leaderboard.find(
+            {'user_id': {'$in': [user_id for _, user_id, _ in entries]}},
+            projection.mongo_projection(fields, 'user_id'),
+        ).to_list(None)
+        return _json(rows.serialize(ranked_rows(entries, documents), fields))
+    except Exception as e:
+        metrics.record_view_error('async_views', 'leaderboard_top', e)
+        return _json({'error': f'Failed to fetch leaderboard: {str(e)}'}, status=500)
@@ -0,0 +1,141 @@
+"""Batched reads: ``?ids=`` on list endpoints and ``POST /api/batch/``.
+
+``GET /api/users/?ids=a,b,c`` (also activities and workouts) fetches the
+rows with one ``$in`` query and returns them in the order asked for, with
+unknown ids listed under ``missing``.
+
+``POST /api/batch/`` takes ``{"requests": [{"path": "/api/users/a/"}, ...]}``
+and answers every GET sub-request under ``/api/`` in one round trip, in
+request order. A sub-request that fails gets its own 500 entry, and one
+for an ``/api/async/`` route gets a 400 entry.
+Detail reads (``<resource>-detail`` routes) of the same resource with the
+same query string are folded into a single ``?ids=`` read. Any other path runs through the normal URL
+resolver and view, without the middleware.
+"""
+import json
+import logging
+import re
+from urllib.parse import urlencode, urlsplit
+
+from asgiref.sync import iscoroutinefunction
+from django.http import HttpRequest, QueryDict
+from django.urls import Resolver404, resolve
+
+logger = logging.getLogger(__name__)
+
+MAX_IDS = 100
+MAX_REQUESTS = 50
+
+# Paths that may be detail reads foldable into one ?ids= list read; list
+# actions such as /api/users/by_username/ have the same shape and are told
+# apart by their route name
+_DETAIL_PATH = re.compile(r'^/api/(users|activities|workouts)/([^/]+)/$')
+
+# Parent request headers a sub-request must not inherit
+_DROPPED_HEADERS = {'CONTENT_TYPE', 'CONTENT_LENGTH', 'HTTP_IF_NONE_MATCH', 'HTTP_IF_MODIFIED_SINCE'}
+
+
+def requested_ids(request):
+    """The ``?ids=`` list without duplicates, in order; None if not given
+
+    Raises ValueError when more than MAX_IDS ids are asked for.
+    """
+    value = request.query_params.get('ids')
+    if value is None:
+        return None
+    ids = list(dict.fromkeys(id_ for id_ in (part.strip() for part in value.split(',')) if id_))
+    if len(ids) > MAX_IDS:
+        raise ValueError(f'At most {MAX_IDS} ids per request')
+    return ids
+
+
+def dispatch(request, path):
+    """Run a GET sub-request for ``path``; returns (status code, body)"""
+    parts = urlsplit(path)
+    try:
+        match = resolve(parts.path)
+    except Resolver404:
+        return 404, {'error': 'Not found'}
+    if match.url_name == 'batch':
+        return 400, {'error': 'Batches cannot be nested'}
+    if iscoroutinefunction(match.func):
+        # The /api/async/ views mirror sync routes that can be batched instead
+        return 400, {'error': 'Async endpoints cannot be batched'}
+    sub = HttpRequest()
+    sub.method = 'GET'
+    sub.path = sub.path_info = parts.path
+    sub.GET = QueryDict(parts.query)
+    sub.META = {key: value for key, value in request.META.items() if key not in _DROPPED_HEADERS}
+    sub.META.update(REQUEST_METHOD='GET', PATH_INFO=parts.path, QUERY_STRING=parts.query)
+    sub.COOKIES = request.COOKIES
+    sub.resolver_match = match
+    try:
+        response = match.func(sub, *match.args, **match.kwargs)
+        if response.streaming:
+            return 400, {'error': 'Streaming exports are not supported in batches'}
+        if hasattr(response, 'render'):
+            response.render()
+    except Exception:
+        # One failing sub-request must not fail the whole batch
+        logger.exception('Batched request for %s failed', path)
+        return 500, {'error': 'Internal server error'}
+    try:
+        body = json.loads(response.content)
+    except ValueError:
+        body = response.content.decode(response.charset or 'utf-8', 'replace')
+    return response.status_code, body
+
+
+def _is_detail(path):
+    try:
+        return resolve(path).url_name.endswith('-detail')
+    except Resolver404:
+        return False
+
+
+def plan(paths):
+    """Group detail paths by (resource, query string)
+
+    Returns ``{(resource, query): [(position, id), ...]}`` and the positions
+    of the paths to dispatch one by one.
+    """
+    groups = {}
+    single = []
+    for position, path in enumerate(paths):
+        parts = urlsplit(path)
+        match = _DETAIL_PATH.match(parts.path)
+        if match and _is_detail(parts.path):
+            groups.setdefault((match.group(1), parts.query), []).append((position, match.group(2)))
+        else:
+            single.append(position)
+    return groups, single
+
+
+def run(request, paths):
+    """Answer GET sub-requests for ``paths`` as ``[{path, status, body}]`` in order"""
+    responses = [None] * len(paths)
+    groups, single = plan(paths)
+    for (resource, query), items in groups.items():
+        ids = list(dict.fromkeys(id_ for _, id_ in items))
+        for start in range(0, len(ids), MAX_IDS):
+            chunk = ids[start:start + MAX_IDS]
+            path = f'/api/{resource}/?{urlencode({"ids": ",".join(chunk)})}'
+            if query:
+                path = f'{path}&{query}'
+            code, body = dispatch(request, path)
+            if code == 200:
+                # Results come back in request order; ?fields= may leave out _id
+                missing = set(body.get('missing', []))
+                found = dict(zip([id_ for id_ in chunk if id_ not in missing], body['results']))
+                answers = {id_: (200, row) for id_, row in found.items()}
+                answers.update({id_: (404, {'detail': 'Not found.'}) for id_ in missing})
+            else:
+                answers = {id_: (code, body) for id_ in chunk}
+            for position, id_ in items:
+                if id_ in answers:
+                    answer_status, answer = answers[id_]
+                    responses[position] = {'path': paths[position], 'status': answer_status, 'body': answer}
+    for position in single:
+        code, body = dispatch(request, paths[position])
+        responses[position] = {'path': paths[position], 'status': code, 'body': body}
+    return responses
@@ -0,0 +1,167 @@
+"""Read-through response cache with versioned-key invalidation.
+
+Each cached collection has a version counter in the Django cache. Cache
+keys and ETags are derived from the request path, query string, response
+format and the current versions, so a write only has to bump a counter
+(``bump``) to invalidate every cached response that depends on it. A
+matching ``If-None-Match`` is answered with 304 from the version counters
+alone, without touching the database.
+
+The version counters must be shared by every process serving requests: a
+per-process cache (local memory) would let one worker answer 304s and
+cached bodies that another worker's write has made stale. Outside DEBUG
+the app therefore refuses to start on a per-process cache backend unless
+``CACHE_SINGLE_PROCESS`` says only one process runs.
+"""
+import hashlib
+import threading
+import time
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.cache import quote_etag
+from rest_framework import status
+from rest_framework.response import Response
+
+VERSION_KEY = 'octofit:version:{}'
+RESPONSE_KEY = 'octofit:response:{}'
+
+# Backends whose contents are not visible to other processes
+PER_PROCESS_BACKENDS = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+# Appended to the ETag by CompressionMiddleware so compressed and identity
+# representations keep distinct strong validators
+ETAG_ENCODING_SUFFIXES = {'gzip': '-gzip', 'br': '-br'}
+
+
+class CacheStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def record(self, outcome):
+        with self._lock:
+            setattr(self, outcome, getattr(self, outcome) + 1)
+
+    def snapshot(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'not_modified': self.not_modified,
+                'hit_ratio': round(self.hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+stats = CacheStats()
+
+
+def check_backend():
+    """Raise ImproperlyConfigured if version counters would not be shared between workers"""
+    if settings.DEBUG or getattr(settings, 'CACHE_SINGLE_PROCESS', False):
+        return
+    backend = settings.CACHES['default']['BACKEND']
+    if backend in PER_PROCESS_BACKENDS:
+        raise ImproperlyConfigured(
+            f'{backend} keeps cache versions per process, so workers would serve stale '
+            'responses; set CACHE_REDIS_URL (or CACHE_SINGLE_PROCESS=1 for a single process)'
+        )
+
+
+def get_versions(names):
+    """Return the current version of each named collection"""
+    keys = [VERSION_KEY.format(name) for name in names]
+    found = cache.get_many(keys)
+    versions = []
+    for key in keys:
+        version = found.get(key)
+        if version is None:
+            # Seed from the clock so a restarted cache never reuses old versions
+            cache.add(key, int(time.time() * 1000), None)
+            version = cache.get(key)
+        versions.append(version)
+    return versions
+
+
+def bump(*names):
+    """Invalidate every cached response that depends on ``names``"""
+    for name in names:
+        key = VERSION_KEY.format(name)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, int(time.time() * 1000), None)
+
+
+def response_etag(request, names):
+    """Strong ETag for a request, derived from collection versions"""
+    accepted = getattr(request, 'accepted_renderer', None)
+    parts = [
+        request.path,
+        request.META.get('QUERY_STRING', ''),
+        getattr(accepted, 'format', '') or '',
+    ]
+    parts.extend(f'{name}={version}' for name, version in zip(names, get_versions(names)))
+    return hashlib.blake2b('|'.join(parts).encode('utf-8'), digest_size=16).hexdigest()
+
+
+def _strip_encoding(tag):
+    for suffix in ETAG_ENCODING_SUFFIXES.values():
+        if tag.endswith(suffix + '"'):
+            return tag[:-len(suffix) - 1] + '"'
+    return tag
+
+
+def _matches(request, etag):
+    header = request.META.get('HTTP_IF_NONE_MATCH', '')
+    tags = [tag.strip() for tag in header.split(',')]
+    tags = [_strip_encoding(tag[2:] if tag.startswith('W/') else tag) for tag in tags]
+    return quote_etag(etag) in tags or '*' in tags
+
+
+def cached_response(*names, timeout=300, store=True):
+    """Cache a ViewSet action's response data until any of ``names`` changes
+
+    With ``store=False`` only the ETag / 304 handling is applied; use that
+    for endpoints whose pages are too numerous or large to keep cached.
+    """
+    def decorator(view_method):
+        @wraps(view_method)
+        def wrapper(self, request, *args, **kwargs):
+            etag = response_etag(request, names)
+            if _matches(request, etag):
+                stats.record('not_modified')
+                response = Response(status=status.HTTP_304_NOT_MODIFIED)
+                response['ETag'] = quote_etag(etag)
+                return response
+
+            key = RESPONSE_KEY.format(etag)
+            data = cache.get(key) if store else None
+            if data is not None:
+                stats.record('hits')
+                response = Response(data)
+            else:
+                if store:
+                    stats.record('misses')
+                response = view_method(self, request, *args, **kwargs)
+                if not isinstance(response, Response) or response.status_code != status.HTTP_200_OK:
+                    return response
+                if store:
+                    cache.set(key, response.data, timeout)
+            response['ETag'] = quote_etag(etag)
+            return response
+        return wrapper
+    return decorator
+
+
+def conditional_response(*names):
+    """ETag / If-None-Match handling from version counters, without caching data"""
+    return cached_response(*names, store=False)
@@ -0,0 +1,77 @@
+"""Single-flight coalescing of identical calls made at the same time.
+
+``SingleFlight.do(key, fn)`` runs ``fn`` once for all callers that ask for
+the same key while a call is pending. A caller never joins a call that
+has already started: the call may have read the data before the caller's
+write landed. Callers that arrive while a call runs share one follow-up
+call instead, made as soon as the running one finishes. However many
+requests arrive during a call, they cost one more call, and every caller
+gets a result computed after it arrived. An optional window delays each call a little so
+more of the burst can join it.
+
+Coalescing is per process; each gunicorn worker has its own flights.
+"""
+import collections
+import threading
+import time
+
+
+class _Flight:
+    __slots__ = ('after', 'done', 'result', 'error')
+
+    def __init__(self, after):
+        # The running call this one has to wait for, if any
+        self.after = after
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+    def outcome(self):
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class SingleFlight:
+    """Runs one call per key for concurrent callers and shares its result"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._waiting = {}
+        self._running = {}
+        self.stats = collections.Counter()
+
+    def do(self, key, fn, window=0.0):
+        """Return ``fn()``, sharing the call with other callers of ``key``
+
+        Exceptions raised by ``fn`` are raised to every caller that shared it.
+        """
+        with self._lock:
+            flight = self._waiting.get(key)
+            if flight is not None:
+                self.stats['shared'] += 1
+                leader = False
+            else:
+                flight = self._waiting[key] = _Flight(self._running.get(key))
+                self.stats['calls'] += 1
+                leader = True
+        if not leader:
+            flight.done.wait()
+            return flight.outcome()
+
+        if flight.after is not None:
+            flight.after.done.wait()
+        if window:
+            time.sleep(window)
+        with self._lock:
+            del self._waiting[key]
+            self._running[key] = flight
+        try:
+            flight.result = fn()
+        except Exception as e:
+            flight.error = e
+        finally:
+            with self._lock:
+                del self._running[key]
+            flight.done.set()
+        return flight.outcome()
@@ -0,0 +1,227 @@
+"""Declared MongoDB indexes and the queries they are meant to serve.
+
+The project has no migrations, so indexes are declared here and applied
+with ``manage.py ensure_indexes`` (``populate_db`` applies them too).
+``hot_queries()`` builds the filters and sorts issued by ``views.py`` from
+the same helpers and orderings, so the command can verify each one with an
+explain plan.
+"""
+import datetime
+import re
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+
+DECLARED_INDEXES = {
+    'users': [
+        IndexModel([('email', ASCENDING)], name='email_unique', unique=True),
+        IndexModel([('username', ASCENDING)], name='username_unique', unique=True),
+    ],
+    'activities': [
+        # Keyset pages sort on (-date, -_id), so _id completes each key
+        IndexModel([('user_id', ASCENDING), ('date', DESCENDING), ('_id', DESCENDING)], name='user_id_date_id'),
+        IndexModel([('type_key', ASCENDING), ('date', DESCENDING), ('_id', DESCENDING)], name='type_key_date_id'),
+        IndexModel([('date', DESCENDING), ('_id', DESCENDING)], name='date_id'),
+    ],
+    'leaderboard': [
+        IndexModel([('user_id', ASCENDING)], name='user_id_unique', unique=True),
+        IndexModel([('total_calories', DESCENDING), ('_id', ASCENDING)], name='total_calories_id'),
+    ],
+    'team_leaderboard': [
+        IndexModel([('total_calories', DESCENDING), ('_id', ASCENDING)], name='total_calories_id'),
+    ],
+    'teams': [
+        IndexModel([('members', ASCENDING)], name='members'),
+    ],
+    'workouts': [
+        IndexModel([('difficulty_level', ASCENDING), ('activity_type', ASCENDING)], name='difficulty_activity_type'),
+    ],
+    'user_search': [
+        IndexModel([('key', ASCENDING)], name='key'),
+        IndexModel([('grams', ASCENDING)], name='grams'),
+    ],
+    'activity_rollups': [
+        IndexModel([('scope', ASCENDING), ('owner_id', ASCENDING), ('date', ASCENDING)], name='scope_owner_date'),
+    ],
+    'jobs': [
+        IndexModel([('status', ASCENDING), ('run_at', ASCENDING)], name='status_run_at'),
+    ],
+}
+
+def mongo_filter(lookups):
+    """Translate the ORM filter kwargs a view passes to ``.filter()`` into a query document"""
+    query = {}
+    for lookup, value in lookups.items():
+        field, _, operator = lookup.partition('__')
+        if not operator:
+            query[field] = value
+        elif operator == 'in':
+            query[field] = {'$in': list(value)}
+        elif operator in ('iexact', 'icontains'):
+            pattern = re.escape(value)
+            query[field] = {'$regex': f'^{pattern}$' if operator == 'iexact' else pattern, '$options': 'i'}
+        else:
+            raise ValueError(f'Unsupported lookup {lookup!r}')
+    return query
+
+
+def hot_queries():
+    """The filters and sorts views.py issues, built from the helpers it uses
+
+    ``<field>`` values are placeholders filled in by ``sample_filter``.
+    """
+    from . import leaderboard, recommendations, rollups, search
+    from .pagination import sort_spec
+    from .views import ActivityViewSet, LeaderboardViewSet, WorkoutViewSet
+
+    activity_sort = sort_spec(ActivityViewSet.cursor_ordering)
+    return [
+        {
+            'name': 'ActivityViewSet.list',
+            'collection': 'activities',
+            'filter': {},
+            'sort': activity_sort,
+        },
+        {
+            'name': 'ActivityViewSet.by_user',
+            'collection': 'activities',
+            'filter': mongo_filter({'user_id': '<user_id>'}),
+            'sort': activity_sort,
+        },
+        {
+            'name': 'ActivityViewSet.by_type',
+            'collection': 'activities',
+            'filter': mongo_filter(search.activity_type_filter('running', key_field='type_key')),
+            'sort': activity_sort,
+        },
+        {
+            'name': 'UserViewSet.by_username (prefix)',
+            'collection': search.SEARCH_COLLECTION,
+            'filter': search.prefix_filter('bat'),
+            'sort': [('key', ASCENDING)],
+        },
+        {
+            'name': 'UserViewSet.by_username (substring)',
+            'collection': search.SEARCH_COLLECTION,
+            'filter': search.substring_filter('batman'),
+            'sort': None,
+        },
+        {
+            'name': 'UserViewSet.stats',
+            'collection': rollups.ROLLUPS,
+            'filter': rollups.stats_filter('user', '<owner_id>', datetime.datetime(2024, 1, 1), datetime.datetime(2024, 12, 31)),
+            'sort': [('date', ASCENDING)],
+        },
+        {
+            'name': 'LeaderboardViewSet.list',
+            'collection': 'leaderboard',
+            'filter': {},
+            'sort': sort_spec(LeaderboardViewSet.cursor_ordering),
+        },
+        {
+            'name': 'LeaderboardViewSet.teams',
+            'collection': leaderboard.TEAMS,
+            'filter': {},
+            'sort': leaderboard.TEAM_STANDINGS_SORT,
+        },
+        {
+            'name': 'LeaderboardViewSet.update_stats',
+            'collection': 'leaderboard',
+            'filter': mongo_filter({'user_id': '<user_id>'}),
+            'sort': None,
+        },
+        {
+            'name': 'WorkoutViewSet.by_difficulty',
+            'collection': 'workouts',
+            'filter': mongo_filter({'difficulty_level__iexact': 'beginner'}),
+            'sort': sort_spec(WorkoutViewSet.cursor_ordering),
+        },
+        {
+            'name': 'WorkoutViewSet.recommend',
+            'collection': recommendations.RECOMMENDATIONS,
+            'filter': {'_id': '<_id>'},
+            'sort': None,
+        },
+        {
+            'name': 'jobs.JobQueue.sweep',
+            'collection': 'jobs',
+            'filter': {'status': 'queued', 'run_at': {'$lte': datetime.datetime(2024, 1, 1)}},
+            'sort': [('run_at', ASCENDING)],
+        },
+    ]
+
+
+def _key_spec(index_document):
+    return [(field, int(direction)) for field, direction in index_document]
+
+
+def diff_indexes(collection, declared):
+    """Return (missing IndexModels, names of existing undeclared indexes)"""
+    existing = collection.index_information()
+    existing_keys = {tuple(_key_spec(info['key'])): name for name, info in existing.items()}
+    missing = []
+    matched = set()
+    for model in declared:
+        spec = model.document
+        key = tuple(_key_spec(spec['key'].items()))
+        if key in existing_keys:
+            matched.add(existing_keys[key])
+        else:
+            missing.append(model)
+    extra = [name for name in existing if name != '_id_' and name not in matched]
+    return missing, extra
+
+
+def ensure_indexes(db, dry_run=False):
+    """Build any declared index that does not exist yet
+
+    Returns a list of ``(collection, created index names, undeclared names)``.
+    """
+    report = []
+    for collection_name, declared in DECLARED_INDEXES.items():
+        collection = db[collection_name]
+        missing, extra = diff_indexes(collection, declared)
+        created = [model.document['name'] for model in missing]
+        if missing and not dry_run:
+            collection.create_indexes(missing)
+        report.append((collection_name, created, extra))
+    return report
+
+
+def _plan_stages(plan):
+    """Flatten a winning plan into (stage, index name) pairs"""
+    stages = []
+    while plan:
+        stages.append((plan.get('stage'), plan.get('indexName')))
+        plan = plan.get('inputStage') or (plan.get('inputStages') or [None])[0]
+    return stages
+
+
+def explain_query(db, query):
+    """Explain one hot query and return its plan stages"""
+    cursor = db[query['collection']].find(query['filter']).limit(100)
+    if query['sort']:
+        cursor = cursor.sort(query['sort'])
+    plan = cursor.explain()
+    winning = plan.get('queryPlanner', {}).get('winningPlan', {})
+    return _plan_stages(winning)
+
+
+def uses_index(stages):
+    return any(stage == 'IXSCAN' for stage, _ in stages) and not any(
+        stage in ('COLLSCAN', 'SORT') for stage, _ in stages
+    )
+
+
+def describe_plan(stages):
+    return ' <- '.join(f'{stage}({name})' if name else stage for stage, name in stages)
+
+
+def sample_filter(db, query):
+    """Fill ``<field>`` placeholders with a real value so explain is realistic"""
+    resolved = {}
+    for field, value in query['filter'].items():
+        if isinstance(value, str) and re.fullmatch(r'<\w+>', value):
+            row = db[query['collection']].find_one({field: {'$exists': True}}, {field: 1})
+            value = row[field] if row else None
+        resolved[field] = value
+    return dict(query, filter=resolved)
@@ -0,0 +1,150 @@
+"""Bulk activity ingestion for wearable sync.
+
+Items are validated in a single pass without per-item serializer
+instances, inserted with unordered ``insert_many`` in batches, and the
+leaderboard deltas and recommendation profiles of every affected user are
+each updated in one bulk write.
+"""
+import datetime
+import math
+
+from bson import ObjectId
+from django.utils import timezone
+from pymongo.errors import BulkWriteError
+
+from . import cache, jobs, leaderboard, recommendations, rollups, search
+from .mongo import get_db
+
+MAX_BULK_ITEMS = 5000
+INSERT_BATCH_SIZE = 500
+
+_REQUIRED = ('user_id', 'activity_type', 'duration', 'calories_burned', 'date')
+
+# Largest integer BSON can store (int64)
+MAX_INT = 2 ** 63 - 1
+
+
+def _as_int(value):
+    if isinstance(value, bool):
+        raise ValueError
+    # int(inf) raises OverflowError
+    result = int(value)
+    if (isinstance(value, float) and result != value) or not 0 <= result <= MAX_INT:
+        raise ValueError
+    return result
+
+
+def _as_date(value):
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    return datetime.date.fromisoformat(str(value)[:10])
+
+
+def validate_item(item, now):
+    """Return (document, None) for a valid item or (None, errors)"""
+    if not isinstance(item, dict):
+        return None, {'non_field_errors': ['Expected an object.']}
+    errors = {}
+    for field in _REQUIRED:
+        if item.get(field) in (None, ''):
+            errors[field] = ['This field is required.']
+
+    user_id = str(item.get('user_id', ''))
+    if len(user_id) > 24:
+        errors['user_id'] = ['Ensure this field has no more than 24 characters.']
+    activity_type = str(item.get('activity_type', ''))
+    if len(activity_type) > 50:
+        errors['activity_type'] = ['Ensure this field has no more than 50 characters.']
+
+    values = {}
+    for field in ('duration', 'calories_burned'):
+        if field not in errors:
+            try:
+                values[field] = _as_int(item[field])
+            except (TypeError, ValueError, OverflowError):
+                errors[field] = [f'A valid integer between 0 and {MAX_INT} is required.']
+    distance = item.get('distance')
+    if distance not in (None, ''):
+        try:
+            distance = float(distance)
+            if not math.isfinite(distance):
+                raise ValueError
+        except (TypeError, ValueError, OverflowError):
+            errors['distance'] = ['A valid number is required.']
+    else:
+        distance = None
+    if 'date' not in errors:
+        try:
+            values['date'] = _as_date(item['date'])
+        except (TypeError, ValueError):
+            errors['date'] = ['Date has wrong format. Use YYYY-MM-DD.']
+
+    if errors:
+        return None, errors
+    return {
+        '_id': str(ObjectId()),
+        'user_id': user_id,
+        'activity_type': activity_type,
+        'type_key': search.activity_type_key(activity_type),
+        'duration': values['duration'],
+        'distance': distance,
+        'calories_burned': values['calories_burned'],
+        # BSON has no date type; store midnight like the ORM does
+        'date': datetime.datetime.combine(values['date'], datetime.time()),
+        'notes': str(item.get('notes') or ''),
+        'created_at': now,
+    }, None
+
+
+def ingest(items, batch_size=INSERT_BATCH_SIZE):
+    """Validate and insert ``items``; return per-item results in input order"""
+    now = timezone.now()
+    results = [None] * len(items)
+    pending = []  # (input index, document)
+    for index, item in enumerate(items):
+        document, errors = validate_item(item, now)
+        if errors:
+            results[index] = {'index': index, 'status': 'invalid', 'errors': errors}
+        else:
+            pending.append((index, document))
+
+    # Rollups charge each activity to the team its user is on now
+    team_ids = rollups.owning_teams({document['user_id'] for _, document in pending}) if pending else {}
+    for _, document in pending:
+        document['team_id'] = team_ids.get(document['user_id'], '')
+
+    db = get_db()
+    inserted = []
+    for start in range(0, len(pending), batch_size):
+        batch = pending[start:start + batch_size]
+        failed = {}
+        try:
+            db.activities.insert_many([document for _, document in batch], ordered=False)
+        except BulkWriteError as e:
+            for error in e.details.get('writeErrors', []):
+                failed[error['index']] = error.get('errmsg', 'write failed')
+        for position, (index, document) in enumerate(batch):
+            if position in failed:
+                results[index] = {'index': index, 'status': 'error', 'errors': {'non_field_errors': [failed[position]]}}
+            else:
+                results[index] = {'index': index, 'status': 'created', '_id': document['_id']}
+                inserted.append(document)
+
+    deltas = {}
+    for document in inserted:
+        delta = leaderboard.document_delta(document)
+        deltas[document['user_id']] = leaderboard.combine_deltas(deltas.get(document['user_id'], {}), delta)
+    leaderboard.apply_activity_deltas(deltas)
+    rollups.apply_activities(inserted)
+    if inserted:
+        cache.bump('activities')
+
+    # Update each affected profile now; rescoring happens once per user in
+    # the background
+    recommendations.record_activities(inserted)
+    for user_id in deltas:
+        jobs.enqueue('recommendations.refresh', user_id)
+    return results, inserted
+
@@ -0,0 +1,320 @@
+"""Background jobs for derived work that does not need to finish inside the request.
+
+A job is a task name plus arguments, recorded in the ``jobs`` collection
+under a key built from both, so at most one copy of "refresh user 42's
+recommendations" is ever queued: enqueueing it again while it waits only
+touches ``requested_at``. New jobs are due after a short debounce
+(``JOBS_COALESCE_SECONDS``, longer per task in ``TASKS``), which is what
+folds a burst of writes for one user into a single recompute. A request
+that arrives while the job runs queues it again, so the latest write is
+always picked up.
+
+Each process runs ``JOBS_WORKERS`` worker threads fed from a bounded
+in-memory queue, plus a scheduler thread that releases jobs when they are
+due. Workers claim a job by moving it from ``queued`` to ``running`` in
+Mongo, so several processes can share the collection. Failures are retried
+with exponential backoff until ``JOBS_MAX_ATTEMPTS``. Jobs that overflow
+the local queue, or were left behind by a process that died, are picked
+up by a periodic sweep; ``manage.py run_jobs`` runs only the workers and
+sweep, for deployments that set ``JOBS_WORKERS=0`` in the web processes.
+"""
+import collections
+import datetime
+import heapq
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+from .mongo import get_db
+
+logger = logging.getLogger(__name__)
+
+JOBS = 'jobs'
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+# task name: (callable, debounce seconds or None for JOBS_COALESCE_SECONDS)
+TASKS = {
+    'recommendations.refresh': ('octofit_tracker.recommendations.refresh_user', None),
+    'leaderboard.reconcile': ('octofit_tracker.leaderboard.reconcile', None),
+}
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def job_key(name, args=(), kwargs=None):
+    """Deduplication key: the task name and its JSON-encoded arguments"""
+    return f'{name}:{json.dumps([list(args), kwargs or {}], sort_keys=True, default=str)}'
+
+
+def _seconds_until(when, now):
+    if timezone.is_naive(when):
+        # pymongo returns naive UTC datetimes
+        when = when.replace(tzinfo=datetime.timezone.utc)
+    return max((when - now).total_seconds(), 0.0)
+
+
+def backoff_seconds(attempts):
+    """Delay before retry number ``attempts``: doubling, capped, with jitter"""
+    base = _setting('JOBS_RETRY_BASE_SECONDS', 5)
+    delay = min(base * 2 ** (attempts - 1), _setting('JOBS_RETRY_MAX_SECONDS', 600))
+    return delay * random.uniform(0.8, 1.2)
+
+
+class JobQueue:
+    """Durable, deduplicating job queue with in-process workers"""
+
+    def __init__(self, collection=None):
+        self._collection = collection
+        self._reset()
+
+    def _reset(self):
+        # Also run in a forked child: threads do not survive fork() and the
+        # lock may have been held by one of them
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self.stats = collections.Counter()
+        self._queue = queue.Queue(maxsize=_setting('JOBS_QUEUE_SIZE', 1000))
+        # (monotonic due time, key) of jobs waiting for their run_at
+        self._scheduled = []
+        # Keys this process has queued and not yet claimed
+        self._pending = set()
+        self._threads = []
+        self._sweep_seconds = None
+        self._sweep_grace = None
+
+    @property
+    def collection(self):
+        return self._collection if self._collection is not None else get_db()[JOBS]
+
+    def depth(self):
+        with self._lock:
+            return len(self._pending)
+
+    def enqueue(self, name, *args, **kwargs):
+        """Queue ``name(*args, **kwargs)``; returns False if an identical job was already waiting"""
+        if name not in TASKS:
+            raise ValueError(f'Unknown job: {name}')
+        key = job_key(name, args, kwargs)
+        started = self.start()
+        if started:
+            with self._lock:
+                if key in self._pending:
+                    # Queued by this process and not yet claimed
+                    self.stats['coalesced'] += 1
+                    return False
+
+        now = timezone.now()
+        jobs = self.collection
+        if jobs.update_one({'_id': key, 'status': QUEUED}, {'$set': {'requested_at': now}}).matched_count:
+            self.stats['coalesced'] += 1
+            return False
+        delay = TASKS[name][1]
+        if delay is None:
+            delay = _setting('JOBS_COALESCE_SECONDS', 2)
+        try:
+            jobs.update_one(
+                {'_id': key, 'status': {'$ne': QUEUED}},
+                {
+                    '$set': {
+                        'name': name,
+                        'args': list(args),
+                        'kwargs': kwargs,
+                        'status': QUEUED,
+                        'attempts': 0,
+                        'run_at': now + datetime.timedelta(seconds=delay),
+                        'requested_at': now,
+                        'last_error': None,
+                    },
+                    '$setOnInsert': {'created_at': now},
+                },
+                upsert=True,
+            )
+        except DuplicateKeyError:
+            # Another process queued it between the two updates
+            self.stats['coalesced'] += 1
+            return False
+        self.stats['enqueued'] += 1
+        if started:
+            self._schedule(key, delay)
+        return True
+
+    def _schedule(self, key, delay):
+        with self._wake:
+            self._pending.add(key)
+            heapq.heappush(self._scheduled, (time.monotonic() + delay, key))
+            self._wake.notify()
+
+    def start(self, workers=None, sweep_seconds=None, sweep_grace=None):
+        """Start the worker and scheduler threads once per process; False if there are none
+
+        ``sweep_grace`` is how overdue (in seconds) a queued job must be
+        before the sweep takes it over from the process that queued it.
+        """
+        if self._threads:
+            return True
+        workers = _setting('JOBS_WORKERS', 2) if workers is None else workers
+        if workers <= 0:
+            return False
+        with self._lock:
+            if self._threads:
+                return True
+            if sweep_seconds is None:
+                sweep_seconds = _setting('JOBS_SWEEP_SECONDS', 30)
+            self._sweep_seconds = sweep_seconds
+            self._sweep_grace = sweep_seconds if sweep_grace is None else sweep_grace
+            targets = [self._schedule_loop] + [self._work_loop] * workers
+            for number, target in enumerate(targets):
+                thread = threading.Thread(target=target, name=f'octofit-jobs-{number}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+        return True
+
+    def _schedule_loop(self):
+        next_sweep = time.monotonic()
+        while True:
+            with self._wake:
+                now = time.monotonic()
+                due = []
+                while self._scheduled and self._scheduled[0][0] <= now:
+                    due.append(heapq.heappop(self._scheduled)[1])
+                if not due and now < next_sweep:
+                    timeout = next_sweep - now
+                    if self._scheduled:
+                        timeout = min(timeout, self._scheduled[0][0] - now)
+                    self._wake.wait(timeout)
+                    continue
+            for key in due:
+                self._put(key)
+            if time.monotonic() >= next_sweep:
+                try:
+                    self.sweep(self._sweep_grace)
+                except PyMongoError:
+                    logger.exception('Job sweep failed')
+                next_sweep = time.monotonic() + self._sweep_seconds
+
+    def _put(self, key):
+        try:
+            self._queue.put_nowait(key)
+        except queue.Full:
+            # The record stays queued in Mongo; a later sweep retries it
+            with self._lock:
+                self._pending.discard(key)
+            self.stats['dropped'] += 1
+
+    def sweep(self, grace=0):
+        """Queue overdue jobs and requeue running jobs whose worker vanished; returns how many"""
+        now = timezone.now()
+        jobs = self.collection
+        stale = now - datetime.timedelta(seconds=_setting('JOBS_TIMEOUT_SECONDS', 600))
+        jobs.update_many({'status': RUNNING, 'started_at': {'$lt': stale}}, {'$set': {'status': QUEUED, 'run_at': now}})
+        free = self._queue.maxsize - self._queue.qsize()
+        if free <= 0:
+            return 0
+        overdue = now - datetime.timedelta(seconds=grace)
+        cursor = jobs.find({'status': QUEUED, 'run_at': {'$lte': overdue}}, {'_id': 1}).sort('run_at', 1).limit(free)
+        swept = 0
+        for job in cursor:
+            with self._lock:
+                if job['_id'] in self._pending:
+                    continue
+                self._pending.add(job['_id'])
+            self._put(job['_id'])
+            swept += 1
+        return swept
+
+    def run_due(self):
+        """Run every due job inline, oldest first; returns a count per resulting status"""
+        outcomes = collections.Counter()
+        jobs = self.collection
+        while True:
+            job = jobs.find_one({'status': QUEUED, 'run_at': {'$lte': timezone.now()}}, {'_id': 1}, sort=[('run_at', 1)])
+            if job is None:
+                return outcomes
+            outcomes[self.run(job['_id']) or 'skipped'] += 1
+
+    def _work_loop(self):
+        while True:
+            key = self._queue.get()
+            try:
+                self.run(key)
+            except PyMongoError:
+                logger.exception('Job %s could not be claimed or recorded', key)
+            finally:
+                self._queue.task_done()
+
+    def run(self, key):
+        """Claim and run one job if it is due; returns its new status or None"""
+        now = timezone.now()
+        jobs = self.collection
+        with self._lock:
+            self._pending.discard(key)
+        job = jobs.find_one_and_update(
+            {'_id': key, 'status': QUEUED, 'run_at': {'$lte': now}},
+            {'$set': {'status': RUNNING, 'started_at': now}, '$inc': {'attempts': 1}},
+            return_document=ReturnDocument.AFTER,
+        )
+        if job is None:
+            # Finished or claimed elsewhere, or its run_at moved: a retry
+            # backoff set by another process
+            pending = jobs.find_one({'_id': key, 'status': QUEUED}, {'run_at': 1})
+            if pending is not None and self._threads:
+                self._schedule(key, _seconds_until(pending['run_at'], now))
+            return None
+
+        try:
+            import_string(TASKS[job['name']][0])(*job.get('args', []), **(job.get('kwargs') or {}))
+        except Exception as e:
+            return self._failed(job, e)
+        # Only if it was not requested again while running
+        jobs.update_one(
+            {'_id': key, 'status': RUNNING, 'started_at': job['started_at']},
+            {'$set': {'status': DONE, 'finished_at': timezone.now(), 'last_error': None}},
+        )
+        self.stats['succeeded'] += 1
+        return DONE
+
+    def _failed(self, job, exc):
+        key = job['_id']
+        attempts = job['attempts']
+        error = f'{type(exc).__name__}: {exc}'
+        running = {'_id': key, 'status': RUNNING, 'started_at': job['started_at']}
+        if attempts >= _setting('JOBS_MAX_ATTEMPTS', 5):
+            logger.exception('Job %s failed after %d attempts', key, attempts)
+            self.collection.update_one(running, {'$set': {'status': FAILED, 'finished_at': timezone.now(), 'last_error': error}})
+            self.stats['failed'] += 1
+            return FAILED
+        delay = backoff_seconds(attempts)
+        logger.warning('Job %s failed (attempt %d), retrying in %.1fs: %s', key, attempts, delay, error)
+        retry_at = timezone.now() + datetime.timedelta(seconds=delay)
+        if self.collection.update_one(running, {'$set': {'status': QUEUED, 'run_at': retry_at, 'last_error': error}}).modified_count:
+            if self._threads:
+                self._schedule(key, delay)
+        self.stats['retried'] += 1
+        return QUEUED
+
+
+job_queue = JobQueue()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=job_queue._reset)
+
+
+def enqueue(name, *args, **kwargs):
+    """Queue a job on the process-wide queue"""
+    return job_queue.enqueue(name, *args, **kwargs)
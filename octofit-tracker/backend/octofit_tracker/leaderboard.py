@@ -0,0 +1,487 @@
+"""Incremental leaderboard maintenance.
+
+Activity writes apply ``$inc`` deltas to the owning user's leaderboard row so
+the cost of logging an activity does not depend on the user's history.
+``reconcile`` rebuilds totals from the activities collection with a single
+server-side aggregation and is run periodically to repair any drift.
+
+Team totals live in ``team_leaderboard`` (one row per team) and follow the
+same deltas: each member's delta is also ``$inc``ed into their team's row,
+and membership changes move the member's totals between rows.
+Team names are denormalized onto both collections and rewritten only when
+a team is renamed. The stored ``rank`` field is refreshed by a debounced
+background job (``jobs``) after totals change.
+"""
+from bson import ObjectId
+from django.utils import timezone
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from .coalesce import SingleFlight
+from .models import User
+from .mongo import get_db
+from . import cache, ranking
+
+STAT_FIELDS = ['total_activities', 'total_calories', 'total_duration', 'total_distance']
+TEAMS = 'team_leaderboard'
+TEAM_STANDINGS_SORT = [('total_calories', -1), ('_id', 1)]
+
+# Concurrent reconcile_user() calls for the same user share one aggregation
+reconcile_flights = SingleFlight()
+
+
+def activity_delta(activity, sign=1):
+    """Return the leaderboard $inc document contributed by one activity"""
+    return {
+        'total_activities': sign,
+        'total_calories': sign * (activity.calories_burned or 0),
+        'total_duration': sign * (activity.duration or 0),
+        'total_distance': sign * (activity.distance or 0),
+    }
+
+
+def document_delta(document, sign=1):
+    """Like activity_delta() but for a raw activity document"""
+    return {
+        'total_activities': sign,
+        'total_calories': sign * (document.get('calories_burned') or 0),
+        'total_duration': sign * (document.get('duration') or 0),
+        'total_distance': sign * (document.get('distance') or 0),
+    }
+
+
+def combine_deltas(*deltas):
+    """Sum several $inc documents, dropping fields that cancel out"""
+    combined = {}
+    for delta in deltas:
+        for field, value in delta.items():
+            combined[field] = combined.get(field, 0) + value
+    return {field: value for field, value in combined.items() if value}
+
+
+def get_team_name(db, team_id):
+    """Look up a team name from the raw teams collection"""
+    if not team_id:
+        return None
+    try:
+        team_key = int(team_id)
+    except (TypeError, ValueError):
+        team_key = team_id
+    team = db.teams.find_one({'_id': team_key}, {'name': 1})
+    return team.get('name') if team else None
+
+
+def _row_defaults(db, user_id):
+    """Identity fields written when a user's leaderboard row is first created"""
+    user = User.objects.filter(_id=user_id).values('username', 'team_id').first() or {}
+    team_id = user.get('team_id')
+    return {
+        '_id': str(ObjectId()),
+        'username': user.get('username', ''),
+        'team_id': team_id,
+        'team_name': get_team_name(db, team_id),
+        'rank': None,
+    }
+
+
+def apply_activity_delta(user_id, delta):
+    """Atomically add ``delta`` to a user's leaderboard totals"""
+    if not delta:
+        return
+    db = get_db()
+    update = {'$inc': delta, '$set': {'updated_at': timezone.now()}}
+    options = {
+        'projection': {'_id': 0, 'total_calories': 1, 'team_id': 1, 'team_name': 1},
+        'return_document': ReturnDocument.AFTER,
+    }
+    row = db.leaderboard.find_one_and_update({'user_id': user_id}, update, **options)
+    if row is None:
+        # First activity for this user: create the row. Only this rare path
+        # pays for the user/team lookups.
+        update['$setOnInsert'] = _row_defaults(db, user_id)
+        try:
+            row = db.leaderboard.find_one_and_update({'user_id': user_id}, update, upsert=True, **options)
+        except DuplicateKeyError:
+            # A concurrent request created the row first
+            del update['$setOnInsert']
+            row = db.leaderboard.find_one_and_update({'user_id': user_id}, update, **options)
+    ranking.record_score(user_id, row['total_calories'])
+    if row.get('team_id'):
+        apply_team_deltas(db, {row['team_id']: (row.get('team_name'), delta)})
+    cache.bump('leaderboard')
+
+
+def apply_activity_deltas(deltas):
+    """Apply ``{user_id: delta}`` for many users in one bulk write"""
+    deltas = {user_id: delta for user_id, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    db = get_db()
+    user_ids = list(deltas)
+    existing = {row['user_id'] for row in db.leaderboard.find({'user_id': {'$in': user_ids}}, {'user_id': 1})}
+    now = timezone.now()
+    operations = []
+    for user_id, delta in deltas.items():
+        update = {'$inc': delta, '$set': {'updated_at': now}}
+        if user_id in existing:
+            operations.append(UpdateOne({'user_id': user_id}, update))
+        else:
+            update['$setOnInsert'] = _row_defaults(db, user_id)
+            operations.append(UpdateOne({'user_id': user_id}, update, upsert=True))
+    db.leaderboard.bulk_write(operations, ordered=False)
+    team_deltas = {}
+    projection = {'user_id': 1, 'total_calories': 1, 'team_id': 1, 'team_name': 1}
+    for row in db.leaderboard.find({'user_id': {'$in': user_ids}}, projection):
+        ranking.record_score(row['user_id'], row.get('total_calories', 0))
+        if row.get('team_id'):
+            team_name, team_delta = team_deltas.get(row['team_id'], (row.get('team_name'), {}))
+            team_deltas[row['team_id']] = (team_name, combine_deltas(team_delta, deltas[row['user_id']]))
+    apply_team_deltas(db, team_deltas)
+    cache.bump('leaderboard')
+
+
+def totals_pipeline(user_ids=None):
+    """Aggregation stages grouping activities into per-user totals"""
+    pipeline = []
+    if user_ids is not None:
+        pipeline.append({'$match': {'user_id': {'$in': list(user_ids)}}})
+    pipeline.append({
+        '$group': {
+            '_id': '$user_id',
+            'total_activities': {'$sum': 1},
+            'total_calories': {'$sum': '$calories_burned'},
+            'total_duration': {'$sum': '$duration'},
+            'total_distance': {'$sum': {'$ifNull': ['$distance', 0]}},
+        }
+    })
+    return pipeline
+
+
+def aggregate_totals(db, user_ids=None):
+    """Compute per-user totals from activities with one $group aggregation"""
+    return db.activities.aggregate(totals_pipeline(user_ids), allowDiskUse=True)
+
+
+def team_names(db, team_ids):
+    """``{team_key: name}`` for these teams, in one query"""
+    values = [value for team_id in team_ids for value in team_id_values(team_id)]
+    if not values:
+        return {}
+    return {team_key(team['_id']): team.get('name') for team in db.teams.find({'_id': {'$in': values}}, {'name': 1})}
+
+
+def _fill_identity(db, user_ids):
+    users = {
+        user['_id']: user
+        for user in User.objects.filter(_id__in=user_ids).values('_id', 'username', 'team_id')
+    }
+    names = team_names(db, {user['team_id'] for user in users.values() if user.get('team_id')})
+    operations = []
+    for user_id in user_ids:
+        user = users.get(user_id, {})
+        team_id = user.get('team_id')
+        operations.append(UpdateOne({'user_id': user_id}, {'$set': {
+            'username': user.get('username', ''),
+            'team_id': team_id,
+            'team_name': names.get(team_key(team_id)) if team_id else None,
+        }}))
+    db.leaderboard.bulk_write(operations, ordered=False)
+
+
+def fill_missing_identity(db, batch_size=1000):
+    """Populate username/team fields on rows created by bulk upserts
+
+    Each batch of rows costs one users query, one teams query and one bulk write.
+    """
+    user_ids = []
+    for row in db.leaderboard.find({'username': {'$exists': False}}, {'user_id': 1}).batch_size(batch_size):
+        user_ids.append(row['user_id'])
+        if len(user_ids) >= batch_size:
+            _fill_identity(db, user_ids)
+            user_ids = []
+    if user_ids:
+        _fill_identity(db, user_ids)
+
+
+def _write_totals(db, operations):
+    """Bulk write reconciled rows; returns (rows written, user ids skipped)
+
+    Rows are skipped when a live delta touched them during the run: the
+    upsert's filter then excludes a row that exists, and the insert it falls
+    back to fails with a duplicate key error on ``user_id``.
+    """
+    try:
+        result = db.leaderboard.bulk_write(operations, ordered=False).bulk_api_result
+    except BulkWriteError as e:
+        result = e.details
+        if any(error.get('code') != 11000 for error in result.get('writeErrors', [])):
+            raise
+    skipped = [operations[error['index']]._filter['user_id'] for error in result.get('writeErrors', [])]
+    return result.get('nModified', 0) + result.get('nUpserted', 0), skipped
+
+
+def reconcile(user_ids=None, batch_size=1000):
+    """Rebuild leaderboard totals from activities, returning rows written
+
+    Rows are stamped with this run's id; rows of a full run left unstamped
+    belong to users with no activities and are zeroed. A row that a live
+    delta updated after the run started is left as it is: it already
+    includes that write, and the next run reconciles it.
+    """
+    db = get_db()
+    run = str(ObjectId())
+    # BSON dates have millisecond precision; truncate down so a delta
+    # stored in the same millisecond counts as newer than the run
+    started = timezone.now()
+    started = started.replace(microsecond=started.microsecond // 1000 * 1000)
+    untouched = {'updated_at': {'$not': {'$gte': started}}}
+    seen = set()
+    written = 0
+    skipped = []
+    batch = []
+    scores = []
+
+    def flush():
+        nonlocal written
+        count, skipped_now = _write_totals(db, batch)
+        written += count
+        skipped.extend(skipped_now)
+        for user_id, calories in scores:
+            if user_id not in skipped_now:
+                ranking.record_score(user_id, calories)
+
+    for totals in aggregate_totals(db, user_ids):
+        user_id = totals.pop('_id')
+        if user_ids is not None:
+            seen.add(user_id)
+        totals.update(updated_at=started, run_id=run)
+        scores.append((user_id, totals['total_calories']))
+        batch.append(UpdateOne(
+            dict(untouched, user_id=user_id),
+            {'$set': totals, '$setOnInsert': {'_id': str(ObjectId()), 'rank': None}},
+            upsert=True,
+        ))
+        if len(batch) >= batch_size:
+            flush()
+            batch, scores = [], []
+    if batch:
+        flush()
+    fill_missing_identity(db, batch_size)
+
+    # Users whose activities were all deleted keep a row with zero totals
+    zeroed = {field: 0 for field in STAT_FIELDS}
+    zeroed.update(updated_at=started, run_id=run)
+    if user_ids is None:
+        zeroed_rows = db.leaderboard.update_many(dict(untouched, run_id={'$ne': run}), {'$set': zeroed}).modified_count
+    else:
+        missing = [user_id for user_id in dict.fromkeys(user_ids) if user_id not in seen]
+        # Existing users with no activities and no row yet get a zero row,
+        # so their stats can be read back
+        existing = set(User.objects.filter(_id__in=missing).values_list('_id', flat=True)) if missing else set()
+        operations = [
+            UpdateOne(dict(untouched, user_id=user_id), {'$set': zeroed, '$setOnInsert': _row_defaults(db, user_id)}, upsert=True)
+            for user_id in missing if user_id in existing
+        ] + [
+            UpdateOne(dict(untouched, user_id=user_id), {'$set': dict(zeroed, run_id=None)})
+            for user_id in missing if user_id not in existing
+        ]
+        zeroed_rows = 0
+        if operations:
+            zeroed_rows, skipped_now = _write_totals(db, operations)
+            skipped.extend(skipped_now)
+    if zeroed_rows:
+        for row in db.leaderboard.find({'run_id': run, 'total_activities': 0}, {'user_id': 1}):
+            ranking.record_score(row['user_id'], 0)
+    # Rows skipped for a live delta keep the score that delta recorded
+    if skipped:
+        for row in db.leaderboard.find({'user_id': {'$in': skipped}}, {'user_id': 1, 'total_calories': 1}):
+            ranking.record_score(row['user_id'], row.get('total_calories', 0))
+
+    # Totals were overwritten rather than incremented, so recompute the
+    # affected team rows from their members
+    if user_ids is None:
+        rebuild_team_totals()
+    else:
+        rows = db.leaderboard.find({'user_id': {'$in': list(user_ids)}}, {'team_id': 1})
+        team_ids = {row['team_id'] for row in rows if row.get('team_id')}
+        if team_ids:
+            rebuild_team_totals(team_ids)
+    cache.bump('leaderboard')
+    return written + zeroed_rows
+
+
+def reconcile_user(user_id, window=0.0):
+    """``reconcile`` one user, coalescing concurrent and closely spaced calls"""
+    return reconcile_flights.do(user_id, lambda: reconcile(user_ids=[user_id]), window)
+
+
+def assign_ranks(batch_size=1000):
+    """Store each row's 1-based position by total calories in ``rank``
+
+    The API ranks through the in-process index (``ranking``); the stored
+    field serves exports and ad-hoc queries. It is a full scan, so it runs
+    from the rebuild and reconcile commands, not after each write. Only
+    rows whose rank changed are written. Returns the number of rows updated.
+    """
+    db = get_db()
+    cursor = db.leaderboard.find({}, {'rank': 1}).sort([('total_calories', -1), ('_id', 1)]).batch_size(batch_size)
+    batch = []
+    updated = 0
+    for rank, row in enumerate(cursor, 1):
+        if row.get('rank') != rank:
+            batch.append(UpdateOne({'_id': row['_id']}, {'$set': {'rank': rank}}))
+        if len(batch) >= batch_size:
+            updated += db.leaderboard.bulk_write(batch, ordered=False).modified_count
+            batch = []
+    if batch:
+        updated += db.leaderboard.bulk_write(batch, ordered=False).modified_count
+    return updated
+
+
+def team_key(team_id):
+    """team_leaderboard _id; seed teams use integer ids, API writes use strings"""
+    return str(team_id)
+
+
+def team_id_values(team_id):
+    """Every stored spelling of a team id, for matching leaderboard rows"""
+    values = [team_id, str(team_id)]
+    if str(team_id).isdigit():
+        values.append(int(team_id))
+    return list(dict.fromkeys(values))
+
+
+def apply_team_deltas(db, team_deltas):
+    """Apply ``{team_id: (team_name, delta)}`` to team rows in one bulk write"""
+    operations, keys = [], []
+    now = timezone.now()
+    for team_id, (team_name, delta) in team_deltas.items():
+        if not delta:
+            continue
+        keys.append(team_key(team_id))
+        operations.append(UpdateOne(
+            {'_id': team_key(team_id)},
+            {'$inc': delta, '$set': {'updated_at': now}, '$setOnInsert': {'team_id': team_id, 'team_name': team_name}},
+            upsert=True,
+        ))
+    if not operations:
+        return
+    result = db[TEAMS].bulk_write(operations, ordered=False)
+    if result.upserted_ids:
+        # A team's first row: fill member_count (and any missing totals)
+        # from the members themselves
+        rebuild_team_totals([keys[i] for i in result.upserted_ids])
+
+
+def _member_totals(row):
+    return {field: row.get(field, 0) for field in STAT_FIELDS}
+
+
+def count_members(db, changes):
+    """Apply ``{team_id: member count change}`` to team rows
+
+    Call before move_members(): a team row created here is rebuilt from
+    its current members, and the moved totals are then added on top.
+    """
+    for team_id, change in changes.items():
+        if not change:
+            continue
+        result = db[TEAMS].update_one(
+            {'_id': team_key(team_id)},
+            {'$inc': {'member_count': change}, '$setOnInsert': {'team_id': team_id}},
+            upsert=True,
+        )
+        if result.upserted_id is not None:
+            rebuild_team_totals([team_id])
+
+
+def move_members(user_ids, team_id, team_name=None):
+    """Point users' leaderboard rows at ``team_id`` (None: no team) and move their totals"""
+    db = get_db()
+    if team_id is None:
+        query = {'user_id': {'$in': list(user_ids)}, 'team_id': {'$ne': None}}
+    else:
+        query = {'user_id': {'$in': list(user_ids)}, 'team_id': {'$nin': team_id_values(team_id)}}
+    projection = dict({field: 1 for field in STAT_FIELDS}, user_id=1, team_id=1, team_name=1)
+    rows = list(db.leaderboard.find(query, projection))
+    if not rows:
+        return
+    db.leaderboard.update_many(
+        dict(query, user_id={'$in': [row['user_id'] for row in rows]}),
+        {'$set': {'team_id': team_id, 'team_name': team_name}},
+    )
+    team_deltas = {}
+    for row in rows:
+        totals = _member_totals(row)
+        moves = [(row.get('team_id'), row.get('team_name'), -1), (team_id, team_name, 1)]
+        for moved_team, moved_name, sign in moves:
+            if moved_team is None:
+                continue
+            name, delta = team_deltas.get(moved_team, (moved_name, {}))
+            signed = {field: sign * value for field, value in totals.items()}
+            team_deltas[moved_team] = (name, combine_deltas(delta, signed))
+    apply_team_deltas(db, team_deltas)
+    cache.bump('leaderboard')
+
+
+def rename_team(team_id, name):
+    """Rewrite the denormalized team name on member and team rows"""
+    db = get_db()
+    db.leaderboard.update_many({'team_id': {'$in': team_id_values(team_id)}}, {'$set': {'team_name': name}})
+    db[TEAMS].update_one({'_id': team_key(team_id)}, {'$set': {'team_name': name}})
+    cache.bump('leaderboard')
+
+
+def rebuild_team_totals(team_ids=None):
+    """Recompute team rows from member leaderboard rows; returns teams written"""
+    db = get_db()
+    teams_query = {}
+    members_query = {'team_id': {'$ne': None}}
+    if team_ids is not None:
+        values = [value for team_id in team_ids for value in team_id_values(team_id)]
+        teams_query = {'_id': {'$in': values}}
+        members_query = {'team_id': {'$in': values}}
+    pipeline = [
+        {'$match': members_query},
+        {'$group': dict(
+            {'_id': '$team_id'},
+            **{field: {'$sum': {'$ifNull': [f'${field}', 0]}} for field in STAT_FIELDS}
+        )},
+    ]
+    totals = {}
+    for row in db.leaderboard.aggregate(pipeline):
+        # Fold int and string spellings of the same team together
+        key = team_key(row.pop('_id'))
+        totals[key] = combine_deltas(totals.get(key, {}), row)
+
+    now = timezone.now()
+    operations, keys = [], []
+    for team in db.teams.find(teams_query, {'name': 1, 'members': 1}):
+        row = {field: 0 for field in STAT_FIELDS}
+        row.update(totals.get(team_key(team['_id']), {}))
+        row.update({
+            'team_id': team['_id'],
+            'team_name': team.get('name'),
+            'member_count': len(team.get('members') or []),
+            'updated_at': now,
+        })
+        keys.append(team_key(team['_id']))
+        operations.append(UpdateOne({'_id': keys[-1]}, {'$set': row}, upsert=True))
+    if operations:
+        db[TEAMS].bulk_write(operations, ordered=False)
+    if team_ids is None:
+        db[TEAMS].delete_many({'_id': {'$nin': keys}})
+    return len(operations)
+
+
+def team_standings(limit=None):
+    """Team rows ordered by total calories, with 1-based ranks"""
+    cursor = get_db()[TEAMS].find({}).sort(TEAM_STANDINGS_SORT)
+    if limit:
+        cursor = cursor.limit(limit)
+    standings = []
+    for rank, row in enumerate(cursor, 1):
+        row.pop('updated_at', None)
+        row['rank'] = rank
+        standings.append(row)
+    return standings
@@ -0,0 +1,193 @@
+"""Full leaderboard rebuilds (``manage.py rebuild_leaderboard``).
+
+By default a single aggregation groups activities into per-user totals and
+sorts them by calories, and the rows are upserted in that order, so
+``rank`` is written in the same pass. With several workers the users are
+split into id shards that are aggregated and written by separate
+processes, and the ranks are assigned afterwards.
+
+Progress is checkpointed in ``leaderboard_rebuilds`` after every bulk write
+and a rebuild that finds a checkpoint carries on from there. Every row a
+run writes is stamped with the run's ``updated_at``. Rows the run never
+reached (users without activities, or rows displaced by writes between a
+crash and the resume) are reconciled one by one at the end.
+"""
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from bson import ObjectId
+from django.utils import timezone
+from pymongo import UpdateOne
+
+from . import cache
+from .leaderboard import assign_ranks, fill_missing_identity, rebuild_team_totals, reconcile, totals_pipeline
+from .mongo import get_db, init_worker_process
+
+CHECKPOINTS = 'leaderboard_rebuilds'
+CHECKPOINT_ID = 'leaderboard'
+
+# user_shards() default: start from the first user
+FROM_START = object()
+
+
+def _stamp():
+    # BSON dates have millisecond precision
+    now = timezone.now()
+    return now.replace(microsecond=now.microsecond // 1000 * 1000)
+
+
+def _upsert(user_id, totals, stamp, rank=None):
+    fields = dict(totals, updated_at=stamp)
+    on_insert = {'_id': str(ObjectId())}
+    if rank is None:
+        on_insert['rank'] = None
+    else:
+        fields['rank'] = rank
+    return UpdateOne({'user_id': user_id}, {'$set': fields, '$setOnInsert': on_insert}, upsert=True)
+
+
+def load_checkpoint(db, mode, shard_size):
+    """The unfinished run's checkpoint, if it was started with the same settings"""
+    checkpoint = db[CHECKPOINTS].find_one({'_id': CHECKPOINT_ID})
+    if checkpoint and checkpoint.get('mode') == mode and checkpoint.get('shard_size') == shard_size:
+        return checkpoint
+    return None
+
+
+def _save(db, **fields):
+    db[CHECKPOINTS].update_one({'_id': CHECKPOINT_ID}, {'$set': fields})
+
+
+def rebuild_ranked(db, checkpoint, batch_size=1000, progress=None):
+    """Upsert totals in calorie order, writing ranks as it goes"""
+    done = checkpoint['rows']
+    stamp = checkpoint['stamp']
+    pipeline = totals_pipeline() + [{'$sort': {'total_calories': -1, '_id': 1}}]
+    if done:
+        pipeline.append({'$skip': done})
+    batch = []
+    for rank, totals in enumerate(db.activities.aggregate(pipeline, allowDiskUse=True), done + 1):
+        batch.append(_upsert(totals.pop('_id'), totals, stamp, rank))
+        if len(batch) >= batch_size:
+            db.leaderboard.bulk_write(batch, ordered=False)
+            _save(db, rows=rank)
+            if progress:
+                progress(len(batch))
+            batch = []
+    if batch:
+        db.leaderboard.bulk_write(batch, ordered=False)
+        _save(db, rows=rank)
+        if progress:
+            progress(len(batch))
+
+
+def _id_order(value):
+    """Sort key following BSON order for the id types in use (numbers, strings, ObjectIds)"""
+    if isinstance(value, (int, float)):
+        return (0, value, '')
+    if isinstance(value, str):
+        return (1, 0, value)
+    return (2, 0, str(value))
+
+
+def user_shards(db, shard_size, after=FROM_START):
+    """Lists of ``shard_size`` user ids in ``_id`` order, past ``after`` if given"""
+    cursor = db.users.find({}, {'_id': 1}).sort('_id', 1).batch_size(shard_size)
+    threshold = None if after is FROM_START else _id_order(after)
+    shard = []
+    for user in cursor:
+        if threshold is not None and _id_order(user['_id']) <= threshold:
+            continue
+        shard.append(user['_id'])
+        if len(shard) >= shard_size:
+            yield shard
+            shard = []
+    if shard:
+        yield shard
+
+
+def rebuild_shard(user_ids, stamp, batch_size=1000):
+    """Aggregate and upsert one shard of users; returns rows written"""
+    db = get_db()
+    batch = []
+    written = 0
+    for totals in db.activities.aggregate(totals_pipeline(user_ids), allowDiskUse=True):
+        batch.append(_upsert(totals.pop('_id'), totals, stamp))
+        if len(batch) >= batch_size:
+            db.leaderboard.bulk_write(batch, ordered=False)
+            written += len(batch)
+            batch = []
+    if batch:
+        db.leaderboard.bulk_write(batch, ordered=False)
+        written += len(batch)
+    return written
+
+
+def rebuild_sharded(db, checkpoint, workers, shard_size, batch_size=1000, progress=None):
+    """Rebuild user shards on a process pool
+
+    The checkpoint keeps the last user id of the highest shard such that it
+    and every shard before it are done; a resumed run starts after it.
+    """
+    stamp = checkpoint['stamp']
+    shards = user_shards(db, shard_size, checkpoint.get('after', FROM_START))
+    rows = checkpoint['rows']
+    pending = {}
+    finished = {}
+    next_to_record = 0
+
+    def collect(futures):
+        nonlocal rows, next_to_record
+        for future in futures:
+            sequence, last_id = pending.pop(future)
+            written = future.result()
+            rows += written
+            finished[sequence] = last_id
+            if progress:
+                progress(written)
+        after = None
+        while next_to_record in finished:
+            after = finished.pop(next_to_record)
+            next_to_record += 1
+        if after is not None:
+            _save(db, after=after, rows=rows)
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker_process) as pool:
+        for sequence, shard in enumerate(shards):
+            pending[pool.submit(rebuild_shard, shard, stamp, batch_size)] = (sequence, shard[-1])
+            # Bounded look-ahead so shard lists do not pile up in memory
+            if len(pending) >= workers * 2:
+                done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+                collect(done)
+        collect(list(pending))
+
+
+def rebuild(workers=1, shard_size=10000, batch_size=1000, restart=False, progress=None):
+    """Rebuild every leaderboard row from activities; returns a summary dict"""
+    db = get_db()
+    mode = 'ranked' if workers <= 1 else 'sharded'
+    checkpoint = None if restart else load_checkpoint(db, mode, shard_size)
+    resumed = checkpoint is not None
+    if checkpoint is None:
+        checkpoint = {'_id': CHECKPOINT_ID, 'mode': mode, 'shard_size': shard_size, 'stamp': _stamp(), 'rows': 0}
+        db[CHECKPOINTS].replace_one({'_id': CHECKPOINT_ID}, checkpoint, upsert=True)
+        # Read back so the stamp compares equal to what rows will store
+        checkpoint = db[CHECKPOINTS].find_one({'_id': CHECKPOINT_ID})
+
+    if mode == 'ranked':
+        rebuild_ranked(db, checkpoint, batch_size, progress)
+    else:
+        rebuild_sharded(db, checkpoint, workers, shard_size, batch_size, progress)
+    fill_missing_identity(db)
+
+    # Rows this run did not write: users whose activities were all deleted,
+    # or rows displaced by changes since an interrupted run
+    leftovers = [row['user_id'] for row in db.leaderboard.find({'updated_at': {'$ne': checkpoint['stamp']}}, {'user_id': 1})]
+    for start in range(0, len(leftovers), batch_size):
+        reconcile(user_ids=leftovers[start:start + batch_size], batch_size=batch_size)
+    if mode == 'sharded' or leftovers:
+        assign_ranks(batch_size)
+    rebuild_team_totals()
+    cache.bump('leaderboard')
+    rows = db[CHECKPOINTS].find_one({'_id': CHECKPOINT_ID})['rows']
+    db[CHECKPOINTS].delete_one({'_id': CHECKPOINT_ID})
+    return {'mode': mode, 'resumed': resumed, 'rows': rows, 'leftovers': len(leftovers)}
@@ -0,0 +1,132 @@
+"""Minimal asyncio HTTP load generator used by the benchmark commands.
+
+Uses raw ``asyncio`` streams (HTTP/1.1, one request per connection) so a
+single process can keep thousands of requests in flight without extra
+dependencies.
+"""
+import asyncio
+import json
+import time
+from urllib.parse import urlsplit
+
+
+class Result:
+    def __init__(self):
+        self.latencies = []
+        self.statuses = {}
+        self.errors = 0
+        self.bytes = 0
+        self.elapsed = 0.0
+        self.by_label = {}
+
+    def labelled(self, label):
+        """Result for one label (operation) of a mixed run"""
+        result = self.by_label.get(label)
+        if result is None:
+            result = self.by_label[label] = Result()
+        return result
+
+    def record(self, status, latency, size):
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        self.latencies.append(latency)
+        self.bytes += size
+
+    def percentile(self, q):
+        if not self.latencies:
+            return 0.0
+        ordered = sorted(self.latencies)
+        index = min(int(round(q / 100 * (len(ordered) - 1))), len(ordered) - 1)
+        return ordered[index]
+
+    def summary(self):
+        completed = len(self.latencies)
+        return {
+            'requests': completed + self.errors,
+            'errors': self.errors,
+            'statuses': self.statuses,
+            'throughput_rps': round(completed / self.elapsed, 1) if self.elapsed else 0.0,
+            'p50_ms': round(self.percentile(50) * 1000, 2),
+            'p90_ms': round(self.percentile(90) * 1000, 2),
+            'p99_ms': round(self.percentile(99) * 1000, 2),
+            'bytes_per_response': round(self.bytes / completed) if completed else 0,
+        }
+
+
+async def fetch(url, method='GET', body=None, headers=None, timeout=30):
+    """Send one request; return (status, response headers, body bytes)"""
+    parts = urlsplit(url)
+    port = parts.port or (443 if parts.scheme == 'https' else 80)
+    path = parts.path or '/'
+    if parts.query:
+        path += '?' + parts.query
+    payload = json.dumps(body).encode('utf-8') if body is not None else b''
+    lines = [
+        f'{method} {path} HTTP/1.1',
+        f'Host: {parts.netloc}',
+        'Connection: close',
+        f'Content-Length: {len(payload)}',
+    ]
+    if body is not None:
+        lines.append('Content-Type: application/json')
+    for name, value in (headers or {}).items():
+        lines.append(f'{name}: {value}')
+
+    reader, writer = await asyncio.wait_for(
+        asyncio.open_connection(parts.hostname, port, ssl=parts.scheme == 'https'), timeout
+    )
+    try:
+        writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1') + payload)
+        await writer.drain()
+        raw = await asyncio.wait_for(reader.read(), timeout)
+    finally:
+        writer.close()
+    head, _, content = raw.partition(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    status = int(lines[0].split(' ', 2)[1]) if head else 0
+    response_headers = {}
+    for line in lines[1:]:
+        name, _, value = line.partition(':')
+        response_headers[name.strip().lower()] = value.strip()
+    return status, response_headers, content
+
+
+async def request(url, method='GET', body=None, headers=None, timeout=30):
+    """Send one request; return (status, response body bytes)"""
+    status, _, content = await fetch(url, method, body, headers, timeout)
+    return status, content
+
+
+async def run(make_request, total, concurrency, duration=None):
+    """Issue ``total`` requests (or run for ``duration`` seconds) at ``concurrency``
+
+    ``make_request(i)`` returns ``(url, method, body, headers)`` for request i,
+    optionally followed by a label; labelled requests are also summarised
+    per label in ``Result.by_label``.
+    """
+    result = Result()
+    counter = iter(range(total if total else 10 ** 12))
+    deadline = time.perf_counter() + duration if duration else None
+
+    async def worker():
+        for i in counter:
+            if deadline and time.perf_counter() >= deadline:
+                return
+            url, method, body, headers, *label = make_request(i)
+            results = [result, result.labelled(label[0])] if label else [result]
+            started = time.perf_counter()
+            try:
+                status, content = await request(url, method, body, headers)
+            except (OSError, asyncio.TimeoutError, ValueError, IndexError):
+                for each in results:
+                    each.errors += 1
+                continue
+            latency = time.perf_counter() - started
+            for each in results:
+                each.record(status, latency, len(content))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    result.elapsed = time.perf_counter() - started
+    for labelled in result.by_label.values():
+        labelled.elapsed = result.elapsed
+    return result
@@ -0,0 +1,99 @@
+import asyncio
+import datetime
+import time
+
+from bson import ObjectId
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from octofit_tracker import loadtest
+from octofit_tracker.models import Activity
+from octofit_tracker.renderers import ORJSONRenderer
+from octofit_tracker.serializers import ActivitySerializer, RowSerializer
+
+LIST_ENDPOINTS = ['/api/activities/', '/api/leaderboard/', '/api/users/', '/api/teams/', '/api/workouts/']
+
+ENCODINGS = {
+    'identity': {'Accept-Encoding': 'identity'},
+    'gzip': {'Accept-Encoding': 'gzip'},
+    'br': {'Accept-Encoding': 'br, gzip'},
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure p50/p99 latency and bytes on the wire for the list endpoints '
+        'uncompressed, gzip and brotli, and for ETag revalidation (304); with '
+        '--serialization, compare list serialization throughput in-process instead'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://localhost:8000', help='Base URL of a running server')
+        parser.add_argument('--endpoint', action='append', dest='endpoints', help='Path to test (repeatable)')
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--concurrency', type=int, default=20)
+        parser.add_argument('--page-size', type=int, default=100)
+        parser.add_argument('--serialization', action='store_true',
+                            help='Time ModelSerializer + JSONRenderer against RowSerializer + ORJSONRenderer; no server needed')
+        parser.add_argument('--rows', type=int, default=5000, help='Activity rows per --serialization run')
+        parser.add_argument('--repeat', type=int, default=5, help='Runs per --serialization path; the best is reported')
+
+    def run(self, url, headers, options):
+        return asyncio.run(loadtest.run(
+            lambda i: (url, 'GET', None, headers),
+            options['requests'],
+            options['concurrency'],
+        )).summary()
+
+    def report(self, label, summary):
+        self.stdout.write(
+            f'  {label:<12} p50 {summary["p50_ms"]:>8} ms  p99 {summary["p99_ms"]:>8} ms  '
+            f'{summary["bytes_per_response"]:>9} B/response  {summary["throughput_rps"]} req/s  '
+            f'statuses {summary["statuses"]}'
+        )
+
+    def serialization(self, rows, repeat):
+        created_at = timezone.now()
+        rows = [{
+            '_id': str(ObjectId()),
+            'user_id': f'user{i % 50}',
+            'activity_type': 'Running',
+            'duration': 30 + i % 60,
+            'distance': None if i % 7 == 0 else 5.5,
+            'calories_burned': 300 + i,
+            'date': datetime.date(2026, 1, 1) + datetime.timedelta(days=i % 365),
+            'notes': 'Morning run',
+            'created_at': created_at,
+        } for i in range(rows)]
+        instances = [Activity(**row) for row in rows]
+        paths = {
+            'ModelSerializer': lambda: JSONRenderer().render(ActivitySerializer(instances, many=True).data),
+            'RowSerializer': lambda: ORJSONRenderer().render(RowSerializer(ActivitySerializer).serialize(rows)),
+        }
+        for label, render in paths.items():
+            best = float('inf')
+            for _ in range(repeat):
+                started = time.perf_counter()
+                render()
+                best = min(best, time.perf_counter() - started)
+            self.stdout.write(f'  {label:<16} {len(rows) / best:>12,.0f} rows/s  {best * 1000:8.1f} ms')
+
+    def handle(self, *args, **options):
+        if options['serialization']:
+            self.serialization(options['rows'], options['repeat'])
+            return
+        base = options['url'].rstrip('/')
+        for path in options['endpoints'] or LIST_ENDPOINTS:
+            url = f'{base}{path}?page_size={options["page_size"]}'
+            self.stdout.write(url)
+            for label, headers in ENCODINGS.items():
+                self.report(label, self.run(url, headers, options))
+
+            _, response_headers, _ = asyncio.run(loadtest.fetch(url, headers=ENCODINGS['gzip']))
+            etag = response_headers.get('etag')
+            if etag:
+                headers = dict(ENCODINGS['gzip'], **{'If-None-Match': etag})
+                self.report('304 reval', self.run(url, headers, options))
+            else:
+                self.stdout.write('  (no ETag, revalidation skipped)')
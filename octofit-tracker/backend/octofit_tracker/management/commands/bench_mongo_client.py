@@ -0,0 +1,50 @@
+from concurrent.futures import ThreadPoolExecutor
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from pymongo import MongoClient
+
+from octofit_tracker.mongo import client_options, get_db, pool_metrics
+
+
+class Command(BaseCommand):
+    help = 'Compare requests/sec of a new MongoClient per request against the shared pooled client'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000, help='Simulated requests per run')
+        parser.add_argument('--concurrency', type=int, default=16, help='Worker threads')
+
+    def per_request_client(self):
+        # Mirrors the old TeamViewSet.get_mongo_connection behaviour
+        client = MongoClient(**client_options())
+        try:
+            client[settings.DATABASES['default']['NAME']].teams.find_one({})
+        finally:
+            client.close()
+
+    def shared_client(self):
+        get_db().teams.find_one({})
+
+    def run(self, label, func, total, concurrency):
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(lambda _: func(), range(total)))
+        elapsed = time.perf_counter() - started
+        rate = total / elapsed if elapsed else 0.0
+        self.stdout.write(f'{label:<22} {total} requests in {elapsed:.2f}s -> {rate:,.0f} req/s')
+        return rate
+
+    def handle(self, *args, **options):
+        total = options['requests']
+        concurrency = options['concurrency']
+
+        # Warm up the shared pool so the comparison measures steady state
+        self.shared_client()
+
+        before = self.run('new client per request', self.per_request_client, total, concurrency)
+        after = self.run('shared pooled client', self.shared_client, total, concurrency)
+
+        if before:
+            self.stdout.write(self.style.SUCCESS(f'Speedup: {after / before:.1f}x'))
+        self.stdout.write(f'Pool metrics: {pool_metrics.snapshot()}')
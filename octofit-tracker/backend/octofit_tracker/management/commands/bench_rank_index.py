@@ -0,0 +1,36 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from octofit_tracker.ranking import RankIndex
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the in-process leaderboard rank index with synthetic users'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000000, help='Number of ranked users')
+        parser.add_argument('--operations', type=int, default=100000, help='Operations per measurement')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def measure(self, label, func, count):
+        started = time.perf_counter()
+        for _ in range(count):
+            func()
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f'{label:<16} {count / elapsed:>12,.0f} ops/s  {elapsed / count * 1e6:8.2f} us/op')
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        users = options['users']
+        count = options['operations']
+
+        started = time.perf_counter()
+        index = RankIndex((user_id, rng.randint(0, 500000)) for user_id in range(users))
+        self.stdout.write(f'Built index of {len(index):,} users in {time.perf_counter() - started:.2f}s')
+
+        self.measure('update', lambda: index.update(rng.randrange(users), rng.randint(0, 500000)), count)
+        self.measure('rank', lambda: index.rank(rng.randrange(users)), count)
+        self.measure('around(r=5)', lambda: index.around(rng.randrange(users), 5), count)
+        self.measure('top(10)', lambda: index.top(10), count)
@@ -0,0 +1,45 @@
+import asyncio
+
+from django.core.management.base import BaseCommand
+
+from octofit_tracker import loadtest
+
+ENDPOINTS = {
+    'team-list': ('/api/teams/', '/api/async/teams/'),
+    'team-detail': ('/api/teams/1/', '/api/async/teams/1/'),
+    'leaderboard-top': ('/api/leaderboard/top/', '/api/async/leaderboard/top/'),
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Load-test the sync DRF team endpoints on a WSGI server against the '
+        'async variants on an ASGI server, e.g. gunicorn on :8000 and '
+        'uvicorn octofit_tracker.asgi:application on :8001'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--wsgi-url', default='http://localhost:8000', help='Base URL of the WSGI server')
+        parser.add_argument('--asgi-url', default='http://localhost:8001', help='Base URL of the ASGI server')
+        parser.add_argument('--endpoint', choices=sorted(ENDPOINTS), default='team-list')
+        parser.add_argument('--requests', type=int, default=5000)
+        parser.add_argument('--concurrency', type=int, default=1000, help='Requests in flight at once')
+
+    def handle(self, *args, **options):
+        sync_path, async_path = ENDPOINTS[options['endpoint']]
+        runs = [
+            ('sync WSGI', options['wsgi_url'].rstrip('/') + sync_path),
+            ('async ASGI', options['asgi_url'].rstrip('/') + async_path),
+        ]
+        for label, url in runs:
+            result = asyncio.run(loadtest.run(
+                lambda i, url=url: (url, 'GET', None, None),
+                options['requests'],
+                options['concurrency'],
+            ))
+            summary = result.summary()
+            self.stdout.write(
+                f'{label:<11} {url}\n'
+                f'  {summary["throughput_rps"]} req/s, p50 {summary["p50_ms"]} ms, '
+                f'p99 {summary["p99_ms"]} ms, errors {summary["errors"]}, statuses {summary["statuses"]}'
+            )
@@ -0,0 +1,44 @@
+from django.core.management.base import BaseCommand
+from pymongo.errors import PyMongoError
+
+from octofit_tracker.indexes import (
+    describe_plan, ensure_indexes, explain_query, hot_queries, sample_filter, uses_index
+)
+from octofit_tracker.mongo import get_db
+
+
+class Command(BaseCommand):
+    help = 'Create declared MongoDB indexes that are missing and verify hot queries with explain plans'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Report missing indexes without building them')
+        parser.add_argument('--skip-explain', action='store_true', help='Do not run explain-plan verification')
+
+    def handle(self, *args, **options):
+        db = get_db()
+        dry_run = options['dry_run']
+
+        for collection, created, extra in ensure_indexes(db, dry_run=dry_run):
+            if created:
+                verb = 'Missing' if dry_run else 'Created'
+                self.stdout.write(self.style.SUCCESS(f'{collection}: {verb} {", ".join(created)}'))
+            else:
+                self.stdout.write(f'{collection}: all declared indexes present')
+            if extra:
+                self.stdout.write(self.style.WARNING(f'{collection}: undeclared indexes {", ".join(extra)}'))
+
+        if options['skip_explain']:
+            return
+
+        self.stdout.write('\nExplain-plan verification:')
+        for query in hot_queries():
+            try:
+                stages = explain_query(db, sample_filter(db, query))
+            except PyMongoError as e:
+                self.stdout.write(self.style.ERROR(f'  {query["name"]}: explain failed ({e})'))
+                continue
+            line = f'  {query["name"]}: {describe_plan(stages)}'
+            if uses_index(stages):
+                self.stdout.write(self.style.SUCCESS(line))
+            else:
+                self.stdout.write(self.style.WARNING(line))
@@ -0,0 +1,118 @@
+import asyncio
+import datetime
+import json
+import random
+
+from django.core.management.base import BaseCommand, CommandError
+
+from octofit_tracker import loadtest, synthetic
+
+# operation: (weight, path template); {user_id} and {prefix} are filled per request
+READS = {
+    'activity-list': (20, '/api/activities/?page_size=50'),
+    'activity-by-user': (15, '/api/activities/by_user/?user_id={user_id}'),
+    'leaderboard-top': (15, '/api/leaderboard/top/'),
+    'leaderboard-neighbors': (5, '/api/leaderboard/{user_id}/neighbors/'),
+    'leaderboard-teams': (5, '/api/leaderboard/teams/?limit=20'),
+    'user-detail': (10, '/api/users/{user_id}/'),
+    'user-stats': (5, '/api/users/{user_id}/stats/?granularity=week'),
+    'user-search': (5, '/api/users/by_username/?username={prefix}'),
+    'team-list': (5, '/api/teams/'),
+    'workout-recommend': (5, '/api/workouts/recommend/?user_id={user_id}'),
+}
+WRITES = {
+    'activity-create': (80, '/api/activities/'),
+    'activity-bulk': (20, '/api/activities/bulk/'),
+}
+BULK_SIZE = 20
+
+
+def activity_payload(rng, user_id, today):
+    activity = synthetic.generate_activity(rng, 0, 0, today, 30)
+    return {
+        'user_id': user_id,
+        'activity_type': activity['activity_type'],
+        'duration': activity['duration'],
+        'distance': activity['distance'],
+        'calories_burned': activity['calories_burned'],
+        'date': activity['date'].date().isoformat(),
+        'notes': 'load test',
+    }
+
+
+def pick(rng, operations):
+    names = list(operations)
+    return rng.choices(names, [operations[name][0] for name in names])[0]
+
+
+class Command(BaseCommand):
+    help = (
+        'Replay a weighted read/write mix against a running API and report '
+        'throughput and latency percentiles, overall and per operation'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://localhost:8000', help='Base URL of a running server')
+        parser.add_argument('--requests', type=int, default=2000, help='Requests to send (ignored with --duration)')
+        parser.add_argument('--duration', type=float, default=None, help='Run for this many seconds instead')
+        parser.add_argument('--concurrency', type=int, default=50)
+        parser.add_argument('--write-ratio', type=float, default=0.1, help='Fraction of requests that write')
+        parser.add_argument('--seed', type=int, default=0, help='Same seed, same request sequence')
+        parser.add_argument('--sample-users', type=int, default=500, help='User ids to draw requests from')
+        parser.add_argument('--json', action='store_true', help='Print the summary as JSON')
+
+    def sample_users(self, base, count):
+        url = f'{base}/api/users/?page_size={count}&fields=_id,username'
+        status, _, content = asyncio.run(loadtest.fetch(url))
+        if status != 200:
+            raise CommandError(f'Could not list users from {url} (status {status})')
+        users = json.loads(content).get('results') or []
+        if not users:
+            raise CommandError('No users found; run populate_db first')
+        return users
+
+    def handle(self, *args, **options):
+        base = options['url'].rstrip('/')
+        users = self.sample_users(base, options['sample_users'])
+        today = datetime.date.today()
+        seed = options['seed']
+        write_ratio = options['write_ratio']
+
+        def make_request(i):
+            # Seeded per request index, so concurrency does not change the sequence
+            rng = random.Random(f'{seed}:{i}')
+            user = rng.choice(users)
+            if rng.random() < write_ratio:
+                name = pick(rng, WRITES)
+                if name == 'activity-bulk':
+                    body = [activity_payload(rng, rng.choice(users)['_id'], today) for _ in range(BULK_SIZE)]
+                else:
+                    body = activity_payload(rng, user['_id'], today)
+                return base + WRITES[name][1], 'POST', body, None, name
+            name = pick(rng, READS)
+            path = READS[name][1].format(user_id=user['_id'], prefix=(user.get('username') or 'a')[:3])
+            return base + path, 'GET', None, None, name
+
+        result = asyncio.run(loadtest.run(
+            make_request,
+            0 if options['duration'] else options['requests'],
+            options['concurrency'],
+            duration=options['duration'],
+        ))
+        summary = dict(result.summary(), operations={
+            name: labelled.summary() for name, labelled in sorted(result.by_label.items())
+        })
+        if options['json']:
+            self.stdout.write(json.dumps(summary, indent=2))
+            return
+
+        self.stdout.write(
+            f'{summary["requests"]} requests, {summary["throughput_rps"]} req/s, '
+            f'p50 {summary["p50_ms"]} ms, p90 {summary["p90_ms"]} ms, p99 {summary["p99_ms"]} ms, '
+            f'errors {summary["errors"]}, statuses {summary["statuses"]}'
+        )
+        for name, operation in summary['operations'].items():
+            self.stdout.write(
+                f'  {name:<22} {operation["requests"]:>7}  p50 {operation["p50_ms"]:>8} ms  '
+                f'p90 {operation["p90_ms"]:>8} ms  p99 {operation["p99_ms"]:>8} ms  statuses {operation["statuses"]}'
+            )
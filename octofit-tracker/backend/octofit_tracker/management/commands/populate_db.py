@@ -1,28 +1,103 @@
 from django.core.management.base import BaseCommand
-from pymongo import MongoClient
+from octofit_tracker import leaderboard, rollups, search, synthetic
+from octofit_tracker.indexes import ensure_indexes
+from octofit_tracker.mongo import get_db, init_worker_process
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
 from datetime import datetime, timedelta
+import os
 import random
+import time
 
 
 class Command(BaseCommand):
-    help = 'Populate the octofit_db database with test data'
+    help = (
+        'Populate the octofit_db database with test data: the superhero seed '
+        'set plus, with --users, any number of synthetic users and activities'
+    )
 
-    def handle(self, *args, **kwargs):
-        # Connect to MongoDB
-        client = MongoClient('localhost', 27017)
-        db = client['octofit_db']
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=0, help='Synthetic users to generate on top of the seed set')
+        parser.add_argument('--activities-per-user', type=int, default=20,
+                            help='Average activities per synthetic user (+/- 50%%)')
+        parser.add_argument('--teams', type=int, default=None, help='Synthetic teams (default: one per 100 users)')
+        parser.add_argument('--days', type=int, default=365, help='Spread synthetic activities over this many days')
+        parser.add_argument('--seed', type=int, default=None, help='Random seed; the same seed gives the same data')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Generator processes')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Users per generator task')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Documents per insert_many')
+
+    def generate(self, options, first_team_id):
+        """Insert the synthetic users, activities and leaderboard rows in parallel chunks"""
+        users = options['users']
+        chunk_size = options['chunk_size']
+        chunks = [(n, start, min(start + chunk_size, users)) for n, start in enumerate(range(0, users, chunk_size))]
+        chunk_options = {
+            'seed': options['seed'],
+            'activities_per_user': options['activities_per_user'],
+            'team_count': options['teams'],
+            'first_team_id': first_team_id,
+            'days': options['days'],
+            'batch_size': options['batch_size'],
+        }
+        started = time.perf_counter()
+        written_users = written_activities = 0
+
+        def report(result):
+            nonlocal written_users, written_activities
+            written_users += result[0]
+            written_activities += result[1]
+            elapsed = time.perf_counter() - started
+            self.stdout.write(
+                f'  {written_users}/{users} users, {written_activities} activities '
+                f'({written_activities / elapsed:,.0f} activities/s)'
+            )
+
+        if options['workers'] <= 1:
+            for chunk in chunks:
+                report(synthetic.write_chunk(*chunk, chunk_options))
+        else:
+            # Keep only a few chunks queued so memory does not grow with --users
+            pending = set()
+            with ProcessPoolExecutor(max_workers=options['workers'], initializer=init_worker_process) as pool:
+                for chunk in chunks:
+                    pending.add(pool.submit(synthetic.write_chunk, *chunk, chunk_options))
+                    if len(pending) >= options['workers'] * 2:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            report(future.result())
+                for future in pending:
+                    report(future.result())
+
+        db = get_db()
+        batch = []
+        for team in synthetic.team_documents(users, options['teams'], first_team_id):
+            batch.append(team)
+            if len(batch) >= options['batch_size']:
+                db.teams.insert_many(batch, ordered=False)
+                batch = []
+        if batch:
+            db.teams.insert_many(batch, ordered=False)
+        return written_users, written_activities
+
+    def handle(self, *args, **options):
+        if options['seed'] is None:
+            options['seed'] = random.randrange(2 ** 32)
+        if options['teams'] is None:
+            options['teams'] = max(options['users'] // 100, 1) if options['users'] else 0
+        rng = random.Random(options['seed'])
+        db = get_db()
         
-        self.stdout.write(self.style.SUCCESS('Connected to octofit_db'))
+        self.stdout.write(self.style.SUCCESS(f'Connected to {db.name} (seed {options["seed"]})'))
         
         # Drop existing collections to start fresh
-        collections = ['users', 'teams', 'activities', 'leaderboard', 'workouts']
+        collections = ['users', 'teams', 'activities', 'leaderboard', 'workouts', search.SEARCH_COLLECTION, rollups.ROLLUPS, leaderboard.TEAMS]
         for collection in collections:
             db[collection].drop()
             self.stdout.write(self.style.WARNING(f'Dropped collection: {collection}'))
         
-        # Create unique index on email field
-        db.users.create_index('email', unique=True)
-        self.stdout.write(self.style.SUCCESS('Created unique index on users.email'))
+        # Create declared indexes (unique users.email, activity/leaderboard/workout query indexes)
+        for collection, created, _ in ensure_indexes(db):
+            self.stdout.write(self.style.SUCCESS(f'Created indexes on {collection}: {", ".join(created)}'))
         
         # Create Teams
         teams_data = [
@@ -173,20 +248,22 @@ class Command(BaseCommand):
         
         for user in users_data:
             # Create 5-10 activities per user
-            num_activities = random.randint(5, 10)
+            num_activities = rng.randint(5, 10)
             for i in range(num_activities):
-                days_ago = random.randint(0, 30)
+                days_ago = rng.randint(0, 30)
                 activity_datetime = datetime.now() - timedelta(days=days_ago)
                 # Store as date string in YYYY-MM-DD format for consistency
                 activity_date = activity_datetime.date().isoformat()
                 
+                activity_type = rng.choice(activity_types)
                 activities_data.append({
                     '_id': activity_id,
                     'user_id': user['_id'],
-                    'activity_type': random.choice(activity_types),
-                    'duration': random.randint(15, 120),
-                    'calories_burned': random.randint(100, 800),
-                    'distance': round(random.uniform(1, 20), 2),
+                    'activity_type': activity_type,
+                    'type_key': search.activity_type_key(activity_type),
+                    'duration': rng.randint(15, 120),
+                    'calories_burned': rng.randint(100, 800),
+                    'distance': round(rng.uniform(1, 20), 2),
                     'date': activity_date,
                     'notes': f"Great workout session #{i+1}",
                     'created_at': datetime.now()
@@ -196,6 +273,24 @@ class Command(BaseCommand):
         db.activities.insert_many(activities_data)
         self.stdout.write(self.style.SUCCESS(f'Created {len(activities_data)} activities'))
         
+        if options['users']:
+            self.stdout.write(
+                f'Generating {options["users"]} synthetic users in {options["teams"]} teams '
+                f'with {options["workers"]} worker(s)'
+            )
+            started = time.perf_counter()
+            users, activities = self.generate(options, first_team_id=len(teams_data) + 1)
+            elapsed = time.perf_counter() - started
+            self.stdout.write(self.style.SUCCESS(
+                f'Created {users} synthetic users and {activities} activities in {elapsed:.1f}s '
+                f'({(users + activities) / elapsed:,.0f} documents/s)'
+            ))
+        
+        search.rebuild()
+        self.stdout.write(self.style.SUCCESS('Built username search index'))
+        rollups.rebuild()
+        self.stdout.write(self.style.SUCCESS('Built daily activity rollups'))
+        
         # Create Workouts (suggested workouts for heroes)
         workouts_data = [
             {
@@ -259,8 +354,11 @@ class Command(BaseCommand):
         team_names = {1: 'Team Marvel', 2: 'Team DC'}
         
         # Calculate total points for each user based on activities
+        activities_by_user = {}
+        for activity in activities_data:
+            activities_by_user.setdefault(activity['user_id'], []).append(activity)
         for user in users_data:
-            user_activities = [a for a in activities_data if a['user_id'] == user['_id']]
+            user_activities = activities_by_user.get(user['_id'], [])
             total_calories = sum(a['calories_burned'] for a in user_activities)
             total_distance = sum(a['distance'] for a in user_activities)
             total_duration = sum(a['duration'] for a in user_activities)
@@ -275,19 +373,15 @@ class Command(BaseCommand):
                 'total_calories': total_calories,
                 'total_distance': round(total_distance, 2),
                 'total_duration': total_duration,
-                'rank': 0,  # Will be updated below
+                'rank': None,  # Set below, together with the synthetic rows
                 'updated_at': datetime.now()
             })
         
-        # Sort by total_calories descending to match model ordering
-        leaderboard_data.sort(key=lambda x: x['total_calories'], reverse=True)
-        
-        # Add rank
-        for rank, entry in enumerate(leaderboard_data, 1):
-            entry['rank'] = rank
-        
         db.leaderboard.insert_many(leaderboard_data)
+        leaderboard.assign_ranks(batch_size=options['batch_size'])
         self.stdout.write(self.style.SUCCESS('Created leaderboard entries'))
+        leaderboard.rebuild_team_totals()
+        self.stdout.write(self.style.SUCCESS('Created team leaderboard'))
         
         # Print summary
         self.stdout.write(self.style.SUCCESS('\n' + '='*50))
@@ -298,6 +392,3 @@ class Command(BaseCommand):
         self.stdout.write(f'Activities: {db.activities.count_documents({})}')
         self.stdout.write(f'Workouts: {db.workouts.count_documents({})}')
         self.stdout.write(f'Leaderboard Entries: {db.leaderboard.count_documents({})}')
-        
-        # Close connection
-        client.close()
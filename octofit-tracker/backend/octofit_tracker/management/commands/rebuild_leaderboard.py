@@ -0,0 +1,47 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from octofit_tracker import leaderboard_rebuild
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuild every leaderboard row and rank from activities. Progress is '
+        'checkpointed; after a crash, run it again with the same options to resume.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Aggregate user-id shards on this many processes (1: one ranked aggregation)')
+        parser.add_argument('--shard-size', type=int, default=10000, help='Users per shard with --workers > 1')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Upserts per bulk write')
+        parser.add_argument('--restart', action='store_true', help='Ignore an existing checkpoint and start over')
+        parser.add_argument('--progress-every', type=float, default=5.0, help='Seconds between progress lines')
+
+    def handle(self, *args, **options):
+        started = last_report = time.perf_counter()
+        written = 0
+
+        def progress(rows):
+            nonlocal written, last_report
+            written += rows
+            now = time.perf_counter()
+            if now - last_report >= options['progress_every']:
+                last_report = now
+                self.stdout.write(f'  {written} rows ({written / (now - started):,.0f} rows/s)')
+
+        summary = leaderboard_rebuild.rebuild(
+            workers=options['workers'],
+            shard_size=options['shard_size'],
+            batch_size=options['batch_size'],
+            restart=options['restart'],
+            progress=progress,
+        )
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt {summary["rows"]} leaderboard rows ({summary["mode"]}'
+            f'{", resumed" if summary["resumed"] else ""}) in {elapsed:.2f}s, '
+            f'{written / elapsed if elapsed else 0:,.0f} rows/s; '
+            f'{summary["leftovers"]} rows reconciled individually'
+        ))
@@ -0,0 +1,18 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from octofit_tracker import recommendations
+
+
+class Command(BaseCommand):
+    help = 'Rebuild activity profiles and precomputed workout recommendations for every user'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Users per bulk write')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        users = recommendations.rebuild(batch_size=options['batch_size'])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt recommendations for {users} users in {elapsed:.2f}s'))
@@ -0,0 +1,18 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from octofit_tracker import rollups
+
+
+class Command(BaseCommand):
+    help = 'Recompute the daily per-user and per-team activity rollups from the activities collection'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Bucket updates per bulk write')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        written = rollups.rebuild(batch_size=options['batch_size'])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(f'Wrote {written} rollup bucket updates in {elapsed:.2f}s'))
@@ -0,0 +1,26 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from octofit_tracker import search
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuild the username prefix/trigram search index from the users collection '
+        'and backfill normalized activity type keys'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Upserts per bulk write')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        indexed = search.rebuild(batch_size=options['batch_size'])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(f'Indexed {indexed} users in {elapsed:.2f}s'))
+
+        started = time.perf_counter()
+        updated = search.rebuild_activity_type_keys(batch_size=options['batch_size'])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(f'Set type_key on {updated} activities in {elapsed:.2f}s'))
@@ -0,0 +1,29 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from octofit_tracker import leaderboard
+
+
+class Command(BaseCommand):
+    help = (
+        'Rebuild leaderboard totals from activities with a single server-side '
+        'aggregation. Schedule periodically (e.g. cron) to repair drift from '
+        'incremental updates.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', action='append', dest='users', help='Only reconcile this user_id (repeatable)')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Upserts per bulk write')
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        written = leaderboard.reconcile(user_ids=options['users'], batch_size=options['batch_size'])
+        ranked = 0
+        if not options['users']:
+            # Stored ranks are a full scan, refreshed here rather than per write
+            ranked = leaderboard.assign_ranks(batch_size=options['batch_size'])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f'Reconciled {written} leaderboard rows ({ranked} ranks changed) in {elapsed:.2f}s'
+        ))
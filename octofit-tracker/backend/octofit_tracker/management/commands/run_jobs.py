@@ -0,0 +1,37 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from octofit_tracker import jobs
+
+
+class Command(BaseCommand):
+    help = (
+        'Run background jobs from the jobs collection, for deployments whose '
+        'web processes only enqueue (JOBS_WORKERS=0)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=max(settings.JOBS_WORKERS, 1), help='Worker threads')
+        parser.add_argument('--poll-seconds', type=float, default=2.0, help='Seconds between checks for due jobs')
+        parser.add_argument('--once', action='store_true', help='Run the jobs that are due now, then exit')
+        parser.add_argument('--stats-every', type=float, default=60.0, help='Seconds between stats lines')
+
+    def handle(self, *args, **options):
+        if options['once']:
+            outcomes = jobs.job_queue.run_due()
+            self.stdout.write(self.style.SUCCESS(
+                'Ran {} jobs: {}'.format(sum(outcomes.values()), dict(outcomes) or 'none due')
+            ))
+            return
+
+        # No other process hands this one its jobs, so sweep without a grace period
+        jobs.job_queue.start(workers=options['workers'], sweep_seconds=options['poll_seconds'], sweep_grace=0)
+        self.stdout.write(f'Running jobs on {options["workers"]} workers; Ctrl-C to stop')
+        try:
+            while True:
+                time.sleep(options['stats_every'])
+                self.stdout.write(f'  {dict(jobs.job_queue.stats)}, {jobs.job_queue.depth()} pending')
+        except KeyboardInterrupt:
+            self.stdout.write('Stopped; unfinished jobs stay queued and are picked up by the next run')
@@ -0,0 +1,74 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from pymongo.errors import OperationFailure
+
+from octofit_tracker import sync
+from octofit_tracker.mongo import get_db
+
+# "The $changeStream stage is only supported on replica sets"
+CHANGE_STREAMS_UNSUPPORTED = 40573
+
+
+class Command(BaseCommand):
+    help = (
+        'Keep leaderboard, search and team member copies of user and team fields '
+        'in sync from MongoDB change streams (SYNC_SOURCE=change_stream)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-seconds', type=float, default=settings.SYNC_BATCH_SECONDS,
+                            help='Seconds to gather changes before applying them')
+        parser.add_argument('--full', action='store_true',
+                            help='Sync every user and team once and exit (backfill; no change stream needed)')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Ids per batch with --full')
+
+    def full_sync(self, db, batch_size):
+        written = 0
+        for collection in sync.WATCHED:
+            ids = []
+            for document in db[collection].find({}, {'_id': 1}).batch_size(batch_size):
+                ids.append(document['_id'])
+                if len(ids) >= batch_size:
+                    written += sync.apply({collection: ids})
+                    ids = []
+            if ids:
+                written += sync.apply({collection: ids})
+        self.stdout.write(self.style.SUCCESS(f'Synced every user and team; {written} documents rewritten'))
+
+    def handle(self, *args, **options):
+        db = get_db()
+        if options['full']:
+            self.full_sync(db, options['batch_size'])
+            return
+
+        batch_ms = max(int(options['batch_seconds'] * 1000), 1)
+        token = sync.load_resume_token(db)
+        try:
+            with db.watch(sync.CHANGE_STREAM_PIPELINE, resume_after=token, max_await_time_ms=batch_ms) as stream:
+                self.stdout.write('Watching users and teams; Ctrl-C to stop')
+                while stream.alive:
+                    changed = {collection: set() for collection in sync.WATCHED}
+                    # Gather for batch_seconds from the first change; try_next()
+                    # blocks up to batch_ms when there is nothing new
+                    deadline = None
+                    while deadline is None or time.monotonic() < deadline:
+                        event = stream.try_next()
+                        if event is None:
+                            continue
+                        changed[event['ns']['coll']].add(event['documentKey']['_id'])
+                        if deadline is None:
+                            deadline = time.monotonic() + options['batch_seconds']
+                    written = sync.apply(changed)
+                    sync.save_resume_token(db, stream.resume_token)
+                    self.stdout.write(
+                        f'  {len(changed["users"])} users, {len(changed["teams"])} teams changed; '
+                        f'{written} documents rewritten'
+                    )
+        except OperationFailure as e:
+            if e.code == CHANGE_STREAMS_UNSUPPORTED:
+                raise CommandError('Change streams need a replica set; use SYNC_SOURCE=bus or --full instead')
+            raise
+        except KeyboardInterrupt:
+            self.stdout.write('Stopped; the next run resumes from the last applied change')
@@ -0,0 +1,214 @@
+"""Team membership changes.
+
+``Team.members`` and ``User.team_id`` are kept in step: a user belongs to
+at most one team, so joining a team also removes them from their previous
+one. Each change to a team's member list is a single conditional update
+(``$addToSet`` / ``$pull`` guarded by a membership predicate), so
+concurrent requests cannot duplicate a member or remove one twice. The
+user documents and leaderboard rows are brought in line afterwards.
+"""
+from . import cache, leaderboard
+from .mongo import get_db
+
+ADDED = 'added'
+REMOVED = 'removed'
+ALREADY_MEMBER = 'already_member'
+NOT_MEMBER = 'not_member'
+TEAM_NOT_FOUND = 'team_not_found'
+USER_NOT_FOUND = 'user_not_found'
+
+
+def _previous_teams(db, user_ids):
+    """``{user_id: team_id}`` for the users that exist"""
+    return {user['_id']: user.get('team_id') for user in db.users.find({'_id': {'$in': list(user_ids)}}, {'team_id': 1})}
+
+
+def _same_team(a, b):
+    return a is not None and b is not None and str(a) == str(b)
+
+
+def _assign(db, user_ids, team_id, team_name, previous, joined=None):
+    """Point users at ``team_id`` and pull them from their previous teams
+
+    ``joined`` lists the users newly added to the team's member list
+    (default: all of them).
+    """
+    db.users.update_many(
+        {'_id': {'$in': user_ids}},
+        {'$set': {'team_id': str(team_id)}},
+    )
+    leaving = {}
+    for user_id in user_ids:
+        old = previous.get(user_id)
+        if old and not _same_team(old, team_id):
+            leaving.setdefault(str(old), []).append(user_id)
+    counts = {team_id: len(user_ids if joined is None else joined)}
+    for old, members in leaving.items():
+        # users.team_id is a string; seed teams have integer _ids. The
+        # pre-image tells which users this pull removed, so a concurrent
+        # removal is not counted twice
+        before = db.teams.find_one_and_update(
+            {'_id': {'$in': leaderboard.team_id_values(old)}, 'members': {'$in': members}},
+            {'$pull': {'members': {'$in': members}}},
+            projection={'members': 1},
+        )
+        if before is not None:
+            pulled = set(before.get('members') or []).intersection(members)
+            counts[old] = counts.get(old, 0) - len(pulled)
+    leaderboard.count_members(db, counts)
+    leaderboard.move_members(user_ids, team_id, team_name)
+    cache.bump('teams', 'users')
+
+
+def add_member(team_id, user_id):
+    """Add one user to a team; returns one of the status constants"""
+    db = get_db()
+    previous = _previous_teams(db, [user_id])
+    if user_id not in previous:
+        return USER_NOT_FOUND
+    team = db.teams.find_one_and_update(
+        {'_id': team_id, 'members': {'$ne': user_id}},
+        {'$addToSet': {'members': user_id}},
+        projection={'name': 1},
+    )
+    if team is None:
+        return ALREADY_MEMBER if db.teams.count_documents({'_id': team_id}, limit=1) else TEAM_NOT_FOUND
+    _assign(db, [user_id], team_id, team.get('name'), previous)
+    return ADDED
+
+
+def remove_member(team_id, user_id):
+    """Remove one user from a team; returns one of the status constants"""
+    db = get_db()
+    team = db.teams.find_one_and_update(
+        {'_id': team_id, 'members': user_id},
+        {'$pull': {'members': user_id}},
+        projection={'_id': 1},
+    )
+    if team is None:
+        return NOT_MEMBER if db.teams.count_documents({'_id': team_id}, limit=1) else TEAM_NOT_FOUND
+    _release(db, team_id, [user_id])
+    return REMOVED
+
+
+def _release(db, team_id, user_ids):
+    db.users.update_many(
+        {'_id': {'$in': user_ids}, 'team_id': {'$in': leaderboard.team_id_values(team_id)}},
+        {'$set': {'team_id': None}},
+    )
+    leaderboard.count_members(db, {team_id: -len(user_ids)})
+    leaderboard.move_members(user_ids, None)
+    cache.bump('teams', 'users')
+
+
+def update_members(team_id, add=(), remove=()):
+    """Add and remove many users in one call
+
+    Returns ``{user_id: status}`` for every requested user, or None if the
+    team does not exist. A user listed in both ``add`` and ``remove`` is
+    removed.
+    """
+    db = get_db()
+    remove = list(dict.fromkeys(remove))
+    removing = set(remove)
+    add = [user_id for user_id in dict.fromkeys(add) if user_id not in removing]
+    statuses = {}
+
+    if add:
+        previous = _previous_teams(db, add)
+        statuses.update({user_id: USER_NOT_FOUND for user_id in add if user_id not in previous})
+        known = [user_id for user_id in add if user_id in previous]
+        # The pre-image tells which users were already members
+        before = db.teams.find_one_and_update(
+            {'_id': team_id},
+            {'$addToSet': {'members': {'$each': known}}},
+            projection={'name': 1, 'members': 1},
+        )
+        if before is None:
+            return None
+        members = set(before.get('members') or [])
+        added = [user_id for user_id in known if user_id not in members]
+        statuses.update({user_id: ALREADY_MEMBER for user_id in known if user_id in members})
+        statuses.update({user_id: ADDED for user_id in added})
+        if added:
+            _assign(db, added, team_id, before.get('name'), previous)
+
+    if remove:
+        before = db.teams.find_one_and_update(
+            {'_id': team_id},
+            {'$pull': {'members': {'$in': remove}}},
+            projection={'members': 1},
+        )
+        if before is None:
+            return None
+        members = set(before.get('members') or [])
+        removed = [user_id for user_id in remove if user_id in members]
+        statuses.update({user_id: NOT_MEMBER for user_id in remove if user_id not in members})
+        statuses.update({user_id: REMOVED for user_id in removed})
+        if removed:
+            _release(db, team_id, removed)
+
+    if not add and not remove and not db.teams.count_documents({'_id': team_id}, limit=1):
+        return None
+    return statuses
+
+
+def change_team(user_id, old_team_id, new_team_id):
+    """Mirror a User.team_id edit made through the users API onto member lists"""
+    db = get_db()
+    if _same_team(old_team_id, new_team_id):
+        return
+    if not new_team_id:
+        if old_team_id:
+            team = db.teams.find_one_and_update(
+                {'_id': {'$in': leaderboard.team_id_values(old_team_id)}, 'members': user_id},
+                {'$pull': {'members': user_id}},
+                projection={'_id': 1},
+            )
+            if team is not None:
+                leaderboard.count_members(db, {team['_id']: -1})
+        leaderboard.move_members([user_id], None)
+        cache.bump('teams')
+        return
+    before = db.teams.find_one_and_update(
+        {'_id': {'$in': leaderboard.team_id_values(new_team_id)}},
+        {'$addToSet': {'members': user_id}},
+        projection={'name': 1, 'members': 1},
+    )
+    if before is None:
+        return
+    joined = [] if user_id in (before.get('members') or []) else [user_id]
+    _assign(db, [user_id], before['_id'], before.get('name'), {user_id: old_team_id}, joined=joined)
+
+
+def repair_member(user_id, team_id, listed=()):
+    """Bring member lists and the leaderboard row in line with a user's ``team_id``
+
+    ``listed`` holds the ids of the teams whose member lists name the user.
+    Used by ``sync`` for team changes made outside this module.
+    """
+    db = get_db()
+    counts = {}
+    stale = [listed_id for listed_id in listed if not _same_team(listed_id, team_id)]
+    for listed_id in stale:
+        # Only count the pulls that happened; a concurrent repair or member
+        # endpoint may have removed the user already
+        if db.teams.update_one({'_id': listed_id}, {'$pull': {'members': user_id}}).modified_count == 1:
+            counts[listed_id] = -1
+    team_name = None
+    if team_id:
+        before = db.teams.find_one_and_update(
+            {'_id': {'$in': leaderboard.team_id_values(team_id)}},
+            {'$addToSet': {'members': user_id}},
+            projection={'name': 1, 'members': 1},
+        )
+        if before is None:
+            # users.team_id points at a team that does not exist
+            team_id = None
+        else:
+            if user_id not in (before.get('members') or []):
+                counts[before['_id']] = counts.get(before['_id'], 0) + 1
+            team_id, team_name = before['_id'], before.get('name')
+    leaderboard.count_members(db, counts)
+    leaderboard.move_members([user_id], team_id, team_name)
+    cache.bump('teams')
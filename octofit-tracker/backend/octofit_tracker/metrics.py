@@ -0,0 +1,357 @@
+"""Prometheus-style metrics exposed at ``/metrics``.
+
+Counters and histograms live in a per-process registry and cost a lock and
+a dict lookup per update. Collector callbacks read values that are already
+tracked elsewhere (connection pool, response cache) at scrape time.
+
+Under a pre-fork server every worker has its own registry. When
+``METRICS_MULTIPROC_DIR`` is set each worker writes its snapshot there
+every ``METRICS_FLUSH_SECONDS`` from a background thread, and once more at
+exit (``metrics-<pid>.json``) and ``/metrics`` merges the
+snapshots of all workers: counters and histograms are summed, including
+those of workers that have exited, and gauges are summed over the workers
+still running.
+"""
+import atexit
+import bisect
+import json
+import os
+import threading
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.http import HttpResponse
+
+from . import cache, jobs, leaderboard
+from .mongo import client_options, pool_metrics
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def get(self, *label_values):
+        return self._values.get(label_values, 0)
+
+    def samples(self):
+        with self._lock:
+            return [(dict(zip(self.labels, key)), value) for key, value in self._values.items()]
+
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(label_values)
+            if state is None:
+                # Per-bucket (not cumulative) counts, the last one is +Inf
+                state = self._values[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def samples(self):
+        with self._lock:
+            return [
+                (dict(zip(self.labels, key)), {'bounds': list(self.buckets), 'counts': list(counts), 'sum': total})
+                for key, (counts, total) in self._values.items()
+            ]
+
+
+class Registry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+        self._collectors = []
+        self._flushed = 0.0
+        self._flusher_pid = None
+
+    def _register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, documentation, labels=()):
+        return self._register(Counter(name, documentation, labels))
+
+    def histogram(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labels, buckets))
+
+    def register_collector(self, collector):
+        """``collector()`` returns ``[(name, type, help, [(labels, value), ...]), ...]``"""
+        self._collectors.append(collector)
+        return collector
+
+    def collect(self):
+        """This process's metrics as a JSON-serializable snapshot"""
+        families = {
+            metric.name: {'type': metric.type, 'help': metric.documentation, 'samples': metric.samples()}
+            for metric in list(self._metrics.values())
+        }
+        for collector in self._collectors:
+            for name, kind, documentation, samples in collector():
+                families[name] = {'type': kind, 'help': documentation, 'samples': samples}
+        return families
+
+    def flush(self, force=False):
+        """Write this process's snapshot to METRICS_MULTIPROC_DIR (at most every METRICS_FLUSH_SECONDS)"""
+        directory = getattr(settings, 'METRICS_MULTIPROC_DIR', None)
+        if not directory:
+            return
+        now = time.monotonic()
+        if not force and now - self._flushed < getattr(settings, 'METRICS_FLUSH_SECONDS', 1.0):
+            return
+        self._flushed = now
+        path = os.path.join(directory, f'metrics-{os.getpid()}.json')
+        temporary = f'{path}.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(self.collect(), f)
+        os.replace(temporary, path)
+
+    def start_flusher(self):
+        """Flush from a daemon thread in this process, started once per pid
+
+        Checked on each request rather than at import so that workers forked
+        from a preloaded app get a thread of their own.
+        """
+        pid = os.getpid()
+        if self._flusher_pid == pid or not getattr(settings, 'METRICS_MULTIPROC_DIR', None):
+            return
+        with self._lock:
+            if self._flusher_pid == pid:
+                return
+            self._flusher_pid = pid
+        threading.Thread(target=self._flush_loop, name='octofit-metrics-flush', daemon=True).start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(getattr(settings, 'METRICS_FLUSH_SECONDS', 1.0))
+            try:
+                self.flush(force=True)
+            except OSError:
+                pass
+
+
+registry = Registry()
+
+
+@atexit.register
+def _flush_at_exit():
+    if registry._flusher_pid == os.getpid():
+        registry.flush(force=True)
+
+http_requests = registry.counter(
+    'octofit_http_requests_total', 'HTTP requests by endpoint, method and status', ('endpoint', 'method', 'status')
+)
+http_duration = registry.histogram(
+    'octofit_http_request_duration_seconds', 'HTTP request latency by endpoint and method', ('endpoint', 'method')
+)
+view_errors = registry.counter(
+    'octofit_view_errors_total', 'Exceptions turned into error responses by views', ('view', 'action', 'exception')
+)
+
+
+def record_view_error(view, action, exc):
+    """Count an exception a view turned into an error response instead of raising"""
+    view_errors.inc(view, action or '', type(exc).__name__)
+
+
+@registry.register_collector
+def pool_collector():
+    snapshot = pool_metrics.snapshot()
+    return [
+        ('octofit_mongo_pool_connections', 'gauge', 'Open connections in the shared MongoDB pool',
+         [({}, snapshot['connections_open'])]),
+        ('octofit_mongo_pool_checked_out', 'gauge', 'Connections currently checked out',
+         [({}, snapshot['checked_out'])]),
+        ('octofit_mongo_pool_max_size', 'gauge', 'maxPoolSize of the shared MongoDB client',
+         [({}, client_options()['maxPoolSize'])]),
+        ('octofit_mongo_pool_checkouts_total', 'counter', 'Connection checkouts',
+         [({}, snapshot['checkouts'])]),
+        ('octofit_mongo_pool_checkout_failures_total', 'counter', 'Failed connection checkouts',
+         [({}, snapshot['checkout_failures'])]),
+        ('octofit_mongo_pool_wait_seconds_total', 'counter', 'Time spent waiting for a connection',
+         [({}, pool_metrics.wait_time_total)]),
+    ]
+
+
+@registry.register_collector
+def cache_collector():
+    snapshot = cache.stats.snapshot()
+    return [
+        ('octofit_response_cache_total', 'counter', 'Response cache lookups by outcome',
+         [({'outcome': outcome}, snapshot[outcome]) for outcome in ('hits', 'misses', 'not_modified')]),
+    ]
+
+
+@registry.register_collector
+def jobs_collector():
+    stats = jobs.job_queue.stats
+    return [
+        ('octofit_jobs_total', 'counter', 'Background job enqueues and runs by outcome',
+         [({'outcome': outcome}, stats[outcome])
+          for outcome in ('enqueued', 'coalesced', 'succeeded', 'retried', 'failed', 'dropped')]),
+        ('octofit_jobs_pending', 'gauge', 'Jobs queued in this process and not yet claimed',
+         [({}, jobs.job_queue.depth())]),
+    ]
+
+
+@registry.register_collector
+def coalesce_collector():
+    stats = leaderboard.reconcile_flights.stats
+    return [
+        ('octofit_update_stats_recomputes_total', 'counter', 'update_stats calls by whether they ran or shared a recompute',
+         [({'outcome': 'ran'}, stats['calls']), ({'outcome': 'shared'}, stats['shared'])]),
+    ]
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _merge_value(current, value):
+    if current is None:
+        return value
+    if isinstance(value, dict):
+        return dict(current, counts=[a + b for a, b in zip(current['counts'], value['counts'])],
+                    sum=current['sum'] + value['sum'])
+    return current + value
+
+
+def merge(snapshots):
+    """Combine ``[(alive, snapshot), ...]`` into one family mapping"""
+    families = {}
+    for alive, snapshot in snapshots:
+        for name, family in snapshot.items():
+            if family['type'] == 'gauge' and not alive:
+                continue
+            merged = families.setdefault(name, {'type': family['type'], 'help': family['help'], 'samples': {}})
+            for labels, value in family['samples']:
+                key = tuple(sorted(labels.items()))
+                merged['samples'][key] = _merge_value(merged['samples'].get(key), value)
+    return {
+        name: dict(family, samples=[(dict(key), value) for key, value in family['samples'].items()])
+        for name, family in families.items()
+    }
+
+
+def gather():
+    """Metrics for every worker (or only this process without METRICS_MULTIPROC_DIR)"""
+    directory = getattr(settings, 'METRICS_MULTIPROC_DIR', None)
+    if not directory:
+        return registry.collect()
+    registry.flush(force=True)
+    snapshots = []
+    for name in os.listdir(directory):
+        if not (name.startswith('metrics-') and name.endswith('.json')):
+            continue
+        try:
+            with open(os.path.join(directory, name)) as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            continue
+        snapshots.append((_alive(int(name[len('metrics-'):-len('.json')])), snapshot))
+    return merge(snapshots)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels, **extra):
+    pairs = list(labels.items()) + list(extra.items())
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def render(families):
+    """Prometheus text exposition format (0.0.4)"""
+    lines = []
+    for name in sorted(families):
+        family = families[name]
+        lines.append(f'# HELP {name} {family["help"]}')
+        lines.append(f'# TYPE {name} {family["type"]}')
+        for labels, value in family['samples']:
+            if family['type'] != 'histogram':
+                lines.append(f'{name}{_labels(labels)} {value}')
+                continue
+            cumulative = 0
+            for bound, count in zip(value['bounds'] + ['+Inf'], value['counts']):
+                cumulative += count
+                lines.append(f'{name}_bucket{_labels(labels, le=bound)} {cumulative}')
+            lines.append(f'{name}_sum{_labels(labels)} {value["sum"]}')
+            lines.append(f'{name}_count{_labels(labels)} {cumulative}')
+    return '\n'.join(lines) + '\n'
+
+
+def metrics_view(request):
+    return HttpResponse(render(gather()), content_type=CONTENT_TYPE)
+
+
+class MetricsMiddleware:
+    """Per-endpoint request counts and latency
+
+    Endpoints are labelled with the URL name (``team-add-member``) rather
+    than the path, so ids never become label values.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'METRICS_ENABLED', True):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        started = time.perf_counter()
+        response = self.get_response(request)
+        self.record(request, response, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        response = await self.get_response(request)
+        self.record(request, response, time.perf_counter() - started)
+        return response
+
+    def record(self, request, response, elapsed):
+        match = getattr(request, 'resolver_match', None)
+        endpoint = (match.view_name or match.url_name or 'unnamed') if match else 'unmatched'
+        http_requests.inc(endpoint, request.method, str(response.status_code))
+        http_duration.observe(elapsed, endpoint, request.method)
+        registry.start_flusher()
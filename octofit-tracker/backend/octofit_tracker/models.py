@@ -1,6 +1,8 @@
 from django.db import models
 from bson import ObjectId
 
+from .search import activity_type_key
+
 
 class User(models.Model):
     _id = models.CharField(max_length=24, primary_key=True, default=lambda: str(ObjectId()))
@@ -43,12 +45,21 @@ class Activity(models.Model):
     calories_burned = models.IntegerField()
     date = models.DateField()
     notes = models.TextField(blank=True)
+    # Team the user was on when the activity was recorded ('' for none);
+    # rollups charge edits and deletes to it
+    team_id = models.CharField(max_length=24, null=True, blank=True)
+    # search.activity_type_key(activity_type), matched exactly by by_type
+    type_key = models.CharField(max_length=50, null=True, blank=True)
     created_at = models.DateTimeField(auto_now_add=True)
     
     class Meta:
         db_table = 'activities'
         ordering = ['-date']
     
+    def save(self, *args, **kwargs):
+        self.type_key = activity_type_key(self.activity_type)
+        super().save(*args, **kwargs)
+    
     def __str__(self):
         return f"{self.activity_type} - {self.date}"
 
@@ -0,0 +1,204 @@
+"""Process-wide MongoDB connection manager.
+
+Views and management commands that talk to MongoDB directly (rather than
+through the djongo ORM) share a single pooled ``MongoClient`` per process.
+The client is configured from ``settings.DATABASES['default']['CLIENT']``,
+is rebuilt after a fork (gunicorn pre-fork workers) and reports pool
+metrics through a CMAP listener.
+"""
+import asyncio
+import os
+import threading
+import time
+import weakref
+
+from django.conf import settings
+from pymongo import MongoClient, monitoring
+from pymongo.errors import PyMongoError
+
+
+class PoolMetricsListener(monitoring.ConnectionPoolListener):
+    """Tracks connection checkouts and how long callers waited for them"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.connections_open = 0
+            self.checked_out = 0
+            self.checkouts = 0
+            self.checkout_failures = 0
+            self.wait_time_total = 0.0
+            self.wait_time_max = 0.0
+
+    def snapshot(self):
+        with self._lock:
+            checkouts = self.checkouts
+            return {
+                'connections_open': self.connections_open,
+                'checked_out': self.checked_out,
+                'checkouts': checkouts,
+                'checkout_failures': self.checkout_failures,
+                'wait_time_avg_ms': round(self.wait_time_total / checkouts * 1000, 3) if checkouts else 0.0,
+                'wait_time_max_ms': round(self.wait_time_max * 1000, 3),
+            }
+
+    def pool_created(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        with self._lock:
+            self.connections_open += 1
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.connections_open = max(self.connections_open - 1, 0)
+
+    def connection_check_out_started(self, event):
+        self._local.started = time.perf_counter()
+
+    def connection_check_out_failed(self, event):
+        self._local.started = None
+        with self._lock:
+            self.checkout_failures += 1
+
+    def connection_checked_out(self, event):
+        started = getattr(self._local, 'started', None)
+        waited = time.perf_counter() - started if started else 0.0
+        self._local.started = None
+        with self._lock:
+            self.checked_out += 1
+            self.checkouts += 1
+            self.wait_time_total += waited
+            self.wait_time_max = max(self.wait_time_max, waited)
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checked_out = max(self.checked_out - 1, 0)
+
+
+pool_metrics = PoolMetricsListener()
+
+_lock = threading.Lock()
+_client = None
+_client_pid = None
+
+
+def client_options():
+    """Build MongoClient keyword arguments from the default database settings"""
+    options = dict(settings.DATABASES['default'].get('CLIENT', {}))
+    options.setdefault('host', 'localhost')
+    options.setdefault('port', 27017)
+    options.setdefault('maxPoolSize', 100)
+    options.setdefault('minPoolSize', 0)
+    options.setdefault('waitQueueTimeoutMS', 5000)
+    options.setdefault('serverSelectionTimeoutMS', 5000)
+    return options
+
+
+def get_client():
+    """Return the shared MongoClient, creating it on first use in this process"""
+    global _client, _client_pid
+    pid = os.getpid()
+    if _client is not None and _client_pid == pid:
+        return _client
+    with _lock:
+        if _client is None or _client_pid != pid:
+            # A client inherited across fork() must not be used or closed in
+            # the child; drop the reference and build a fresh one.
+            pool_metrics.reset()
+            _client = MongoClient(event_listeners=[pool_metrics], **client_options())
+            _client_pid = pid
+    return _client
+
+
+def get_db():
+    """Return the application database on the shared client"""
+    return get_client()[settings.DATABASES['default']['NAME']]
+
+
+def close_client():
+    """Close the shared client (used at shutdown and in tests)"""
+    global _client, _client_pid
+    with _lock:
+        if _client is not None and _client_pid == os.getpid():
+            _client.close()
+        _client = None
+        _client_pid = None
+
+
+# Motor client per event loop. Under ASGI there is one loop per worker;
+# under WSGI each async view runs on a loop of its own, at the same time
+# as others, so a client must never be closed while its loop may use it.
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_db():
+    """Return the application database on the running event loop's Motor client
+
+    Motor clients are bound to the event loop they are created on, so each
+    loop gets its own client, closed once the loop is garbage collected.
+    """
+    # Imported lazily so WSGI-only deployments do not need motor installed
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    loop = asyncio.get_running_loop()
+    with _lock:
+        client = _async_clients.get(loop)
+        if client is None:
+            client = _async_clients[loop] = AsyncIOMotorClient(event_listeners=[pool_metrics], **client_options())
+            weakref.finalize(loop, client.close)
+    return client[settings.DATABASES['default']['NAME']]
+
+
+def _reset_after_fork():
+    global _client, _client_pid, _async_clients
+    _client = None
+    _client_pid = None
+    _async_clients = weakref.WeakKeyDictionary()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def init_worker_process():
+    """Process pool initializer for commands that write from several processes
+
+    Forked workers inherit the configured Django and build their own client
+    on first use; spawned workers have to set Django up first.
+    """
+    import django
+    django.setup()
+
+
+def health_check():
+    """Ping the server and report round-trip time alongside pool metrics"""
+    started = time.perf_counter()
+    try:
+        get_client().admin.command('ping')
+        ok = True
+        error = None
+    except PyMongoError as e:
+        ok = False
+        error = str(e)
+    result = {
+        'ok': ok,
+        'ping_ms': round((time.perf_counter() - started) * 1000, 3),
+        'pool': pool_metrics.snapshot(),
+    }
+    if error:
+        result['error'] = error
+    return result
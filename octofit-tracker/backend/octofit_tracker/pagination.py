@@ -0,0 +1,185 @@
+"""Keyset (cursor) pagination for ORM querysets and raw Mongo collections.
+
+Pages are fetched with a range predicate on the view's ``cursor_ordering``
+fields (the last field must be unique, normally ``_id``) instead of an
+offset, so every page costs the same regardless of how deep the client is.
+The cursor is an opaque base64 token holding the last row's key values.
+
+Raw collections can hold keys of mixed BSON types (seed teams have integer
+``_id``s, API-created ones strings). Mongo sorts across types but ``$gt``
+and ``$lt`` only match values of the same type, so collection pages also
+take every value of a type sorting after (or before) the cursor's.
+"""
+import base64
+import json
+import operator
+from functools import reduce
+
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+def _row_value(row, name):
+    # Model instances, or dicts from a values() queryset
+    return row[name] if isinstance(row, dict) else getattr(row, name)
+
+
+# BSON comparison order of the $type aliases a cursor value can be compared with
+_TYPE_ORDER = ('null', 'number', 'string', 'object', 'array', 'binData', 'objectId', 'bool', 'date', 'timestamp', 'regex')
+
+
+def _type_alias(value):
+    if value is None:
+        return 'null'
+    if isinstance(value, bool):
+        return 'bool'
+    if isinstance(value, (int, float)):
+        return 'number'
+    if isinstance(value, str):
+        return 'string'
+    return None
+
+
+def _beyond(name, value, direction):
+    """Mongo filter for values of ``name`` sorting after ``value`` (before it if descending)"""
+    comparison = '$lt' if direction < 0 else '$gt'
+    alias = _type_alias(value)
+    if alias is None:
+        return {name: {comparison: value}}
+    position = _TYPE_ORDER.index(alias)
+    types = list(_TYPE_ORDER[:position] if direction < 0 else _TYPE_ORDER[position + 1:])
+    return {'$or': [{name: {comparison: value}}, {name: {'$type': types}}]}
+
+
+def bounded_int(params, name, default, low, high):
+    """Integer query parameter ``name`` clamped to [low, high]
+
+    ``default`` is returned as is when the parameter is missing. Raises
+    ValueError when it is present but not an integer.
+    """
+    value = params.get(name)
+    if value in (None, ''):
+        return default
+    return min(max(int(value), low), high)
+
+
+def sort_spec(ordering):
+    """pymongo sort for an ORM ordering: ``('-date', '_id')`` -> ``[('date', -1), ('_id', 1)]``"""
+    return [(field.lstrip('-'), -1 if field.startswith('-') else 1) for field in ordering]
+
+
+class KeysetPagination(BasePagination):
+    page_size = api_settings.PAGE_SIZE or 100
+    max_page_size = 1000
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    ordering = ('_id',)
+    invalid_cursor_message = 'Invalid cursor'
+
+    def get_ordering(self, view):
+        return tuple(getattr(view, 'cursor_ordering', self.ordering))
+
+    def get_query_params(self, request):
+        # Plain Django requests (the async views) have GET, DRF ones query_params
+        return getattr(request, 'query_params', request.GET)
+
+    def get_page_size(self, request):
+        try:
+            size = int(self.get_query_params(request)[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(size, 1), self.max_page_size)
+
+    def encode_cursor(self, position):
+        data = json.dumps(position, cls=DjangoJSONEncoder, separators=(',', ':'))
+        return base64.urlsafe_b64encode(data.encode('utf-8')).decode('ascii')
+
+    def decode_cursor(self, request, ordering):
+        token = self.get_query_params(request).get(self.cursor_query_param)
+        if not token:
+            return None
+        try:
+            position = json.loads(base64.urlsafe_b64decode(token.encode('ascii')))
+        except (TypeError, ValueError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or len(position) != len(ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return position
+
+    def _start(self, request, view):
+        self.request = request
+        self.ordering_fields = self.get_ordering(view)
+        self.limit = self.get_page_size(request)
+        return self.decode_cursor(request, self.ordering_fields)
+
+    def _finish(self, rows, get_value):
+        self.has_next = len(rows) > self.limit
+        rows = rows[:self.limit]
+        self.next_position = None
+        if self.has_next:
+            self.next_position = [get_value(rows[-1], field.lstrip('-')) for field in self.ordering_fields]
+        return rows
+
+    def paginate_queryset(self, queryset, request, view=None):
+        position = self._start(request, view)
+        queryset = queryset.order_by(*self.ordering_fields)
+        if position is not None:
+            # (a < x) OR (a == x AND b < y) OR ... for each ordering prefix
+            clauses = []
+            for i, field in enumerate(self.ordering_fields):
+                name = field.lstrip('-')
+                lookup = 'lt' if field.startswith('-') else 'gt'
+                equal = {f.lstrip('-'): position[j] for j, f in enumerate(self.ordering_fields[:i])}
+                clauses.append(Q(**equal, **{f'{name}__{lookup}': position[i]}))
+            queryset = queryset.filter(reduce(operator.or_, clauses))
+        return self._finish(list(queryset[:self.limit + 1]), _row_value)
+
+    def collection_query(self, request, view=None, filter=None):
+        """Return the (query, sort) for the requested page of a raw collection"""
+        position = self._start(request, view)
+        sort = sort_spec(self.ordering_fields)
+        query = dict(filter or {})
+        if position is not None:
+            clauses = []
+            for i, (name, direction) in enumerate(sort):
+                clause = {sort[j][0]: position[j] for j in range(i)}
+                clause.update(_beyond(name, position[i], direction))
+                clauses.append(clause)
+            query = {'$and': [query, {'$or': clauses}]} if query else {'$or': clauses}
+        return query, sort
+
+    def finish_collection_page(self, rows):
+        """Trim the look-ahead row fetched by a collection_query() query"""
+        return self._finish(rows, lambda row, name: row.get(name))
+
+    def paginate_collection(self, collection, request, view=None, filter=None, projection=None):
+        """Keyset-paginate a raw pymongo collection"""
+        query, sort = self.collection_query(request, view, filter)
+        rows = list(collection.find(query, projection).sort(sort).limit(self.limit + 1))
+        return self.finish_collection_page(rows)
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.next_position))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
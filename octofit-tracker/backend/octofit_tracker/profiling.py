@@ -0,0 +1,284 @@
+"""Opt-in request profiling (``PROFILING_ENABLED``).
+
+A pymongo ``CommandListener`` registered for every client in the process
+(djongo's as well as the shared one from ``mongo.get_client``) records
+each command issued while a request is being handled. ``ProfilingMiddleware``
+adds the time spent in MongoDB, in the row serializer and in the renderer
+to a ``Server-Timing`` header, logs commands of the same shape repeated
+often enough to look like an N+1 pattern, and for requests slower than
+``PROFILING_SLOW_MS`` writes a stack-sampling profile to
+``PROFILING_DUMP_DIR`` in collapsed-stack format (flamegraph.pl,
+speedscope). Streaming responses are timed up to the first byte.
+
+Under ASGI the profile follows the request's task through its context, not
+its thread. Many requests share the event loop thread, so async requests
+are not stack-sampled, and Motor commands run on Motor's executor threads
+outside the request context are not attributed to the request.
+"""
+import contextvars
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+# Commands that continue an earlier one; many of them are not an N+1
+CONTINUATION_COMMANDS = frozenset({'getMore', 'killCursors', 'endSessions'})
+
+MAX_STACK_DEPTH = 128
+
+_current = contextvars.ContextVar('octofit_profile', default=None)
+
+
+def current_profile():
+    """The profile of the request being handled, or None"""
+    return _current.get()
+
+
+@contextmanager
+def section(name):
+    """Add the time spent in the block to the current request's ``name`` timing"""
+    profile = _current.get()
+    if profile is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add(name, time.perf_counter() - started)
+
+
+def command_shape(name, command):
+    """``find users(_id,team_id)``: command, collection and filter keys
+
+    Two commands with the same shape differ only in their values, which is
+    what a query issued once per row in a loop looks like.
+    """
+    collection = command.get(name)
+    query = command.get('filter')
+    if query is None:
+        for key in ('updates', 'deletes'):
+            statements = command.get(key)
+            if statements:
+                query = statements[0].get('q')
+                break
+    if query is None and command.get('pipeline'):
+        query = command['pipeline'][0].get('$match')
+    keys = ','.join(sorted(query)) if isinstance(query, dict) else ''
+    return f'{name} {collection if isinstance(collection, str) else ""}({keys})'
+
+
+class RequestProfile:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.duration = None
+        self.commands = []
+        self.timings = Counter()
+        self._pending = {}
+
+    def add(self, name, seconds):
+        self.timings[name] += seconds
+
+    def command_started(self, event):
+        self._pending[event.request_id] = (event.command_name, command_shape(event.command_name, event.command))
+
+    def command_finished(self, event):
+        pending = self._pending.pop(event.request_id, None)
+        if pending is None:
+            return
+        name, shape = pending
+        seconds = event.duration_micros / 1e6
+        self.commands.append((name, shape, seconds))
+        self.add('mongo', seconds)
+
+    def finish(self):
+        self.duration = time.perf_counter() - self.started
+
+    def repeated_commands(self, threshold):
+        """``{shape: count}`` for command shapes issued at least ``threshold`` times"""
+        counts = Counter(shape for name, shape, _ in self.commands if name not in CONTINUATION_COMMANDS)
+        return {shape: count for shape, count in counts.most_common() if count >= threshold}
+
+    def server_timing(self, repeated=None):
+        metrics = [f'mongo;dur={self.timings["mongo"] * 1000:.1f};desc="{len(self.commands)} commands"']
+        for name in sorted(self.timings):
+            if name != 'mongo':
+                metrics.append(f'{name};dur={self.timings[name] * 1000:.1f}')
+        if self.duration is not None:
+            metrics.append(f'total;dur={self.duration * 1000:.1f}')
+        for shape, count in (repeated or {}).items():
+            metrics.append(f'nplusone;desc="{shape} x{count}"')
+        return ', '.join(metrics)
+
+
+class CommandTimingListener(monitoring.CommandListener):
+    """Feeds command events into the profile of the request issuing them"""
+
+    def started(self, event):
+        profile = _current.get()
+        if profile is not None:
+            profile.command_started(event)
+
+    def succeeded(self, event):
+        profile = _current.get()
+        if profile is not None:
+            profile.command_finished(event)
+
+    def failed(self, event):
+        profile = _current.get()
+        if profile is not None:
+            profile.command_finished(event)
+
+
+command_listener = CommandTimingListener()
+_installed = False
+
+
+def install():
+    """Register the command listener for clients created from now on"""
+    global _installed
+    if not _installed:
+        monitoring.register(command_listener)
+        _installed = True
+
+
+def collapse(frame):
+    """``outer (file.py:10);inner (file.py:20)`` for a frame and its callers"""
+    names = []
+    while frame is not None and len(names) < MAX_STACK_DEPTH:
+        code = frame.f_code
+        names.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+
+class StackSampler:
+    """Samples the stacks of the threads serving profiled requests
+
+    One daemon thread per process wakes every ``interval`` seconds while at
+    least one request is being sampled and counts each request thread's
+    collapsed stack.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._active = {}
+        self._thread = None
+
+    def start(self, thread_id):
+        samples = Counter()
+        with self._lock:
+            self._active[thread_id] = samples
+            # Threads do not survive fork(); start one in each worker
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='octofit-profiler', daemon=True)
+                self._thread.start()
+        self._wake.set()
+        return samples
+
+    def stop(self, thread_id):
+        with self._lock:
+            return self._active.pop(thread_id, None)
+
+    def _run(self):
+        while True:
+            if not self._active:
+                self._wake.wait()
+                self._wake.clear()
+            time.sleep(self.interval)
+            frames = sys._current_frames()
+            with self._lock:
+                for thread_id, samples in self._active.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        samples[collapse(frame)] += 1
+
+
+def dump_profile(directory, request, duration, samples):
+    """Write collapsed stacks for a slow request; returns the file path"""
+    os.makedirs(directory, exist_ok=True)
+    slug = re.sub(r'[^A-Za-z0-9]+', '-', request.path).strip('-') or 'root'
+    name = f'{time.strftime("%Y%m%dT%H%M%S")}-{request.method}-{slug}-{int(duration * 1000)}ms.folded'
+    path = os.path.join(directory, name)
+    with open(path, 'w') as f:
+        for stack, count in samples.most_common():
+            f.write(f'{stack} {count}\n')
+    return path
+
+
+class ProfilingMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'PROFILING_ENABLED', False):
+            raise MiddlewareNotUsed
+        install()
+        self.get_response = get_response
+        self.slow_seconds = getattr(settings, 'PROFILING_SLOW_MS', 500) / 1000
+        self.dump_dir = getattr(settings, 'PROFILING_DUMP_DIR', 'profiles')
+        self.n_plus_one_threshold = getattr(settings, 'PROFILING_N_PLUS_ONE_THRESHOLD', 10)
+        interval = getattr(settings, 'PROFILING_SAMPLE_INTERVAL_MS', 5)
+        self.sampler = StackSampler(interval / 1000) if interval else None
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        profile = RequestProfile()
+        token = _current.set(profile)
+        thread_id = threading.get_ident()
+        if self.sampler is not None:
+            self.sampler.start(thread_id)
+        try:
+            response = self.get_response(request)
+        finally:
+            samples = self.sampler.stop(thread_id) if self.sampler is not None else None
+            _current.reset(token)
+        return self.report(request, response, profile, samples)
+
+    async def __acall__(self, request):
+        # The context variable stays with this request's task across awaits;
+        # the thread does not, so there is no stack sampling here
+        profile = RequestProfile()
+        token = _current.set(profile)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.report(request, response, profile, None)
+
+    def report(self, request, response, profile, samples):
+        profile.finish()
+        repeated = profile.repeated_commands(self.n_plus_one_threshold)
+        for shape, count in repeated.items():
+            logger.warning('Possible N+1: %s issued %d times by %s %s', shape, count, request.method, request.path)
+        response['Server-Timing'] = profile.server_timing(repeated)
+        if samples and profile.duration >= self.slow_seconds:
+            path = dump_profile(self.dump_dir, request, profile.duration, samples)
+            logger.info('Slow request %s %s (%.0f ms), profile written to %s',
+                        request.method, request.path, profile.duration * 1000, path)
+        return response
+
+    def process_template_response(self, request, response):
+        # DRF responses are rendered right after this hook returns
+        profile = _current.get()
+        if profile is not None:
+            started = time.perf_counter()
+            response.add_post_render_callback(lambda rendered: profile.add('render', time.perf_counter() - started))
+        return response
@@ -0,0 +1,44 @@
+"""Sparse fieldsets: ``?fields=a,b`` and ``?exclude=c,d``.
+
+The selected fields are pushed down into the query (``values()`` for ORM
+querysets, a projection document for raw collections) so unrequested
+columns are never read from MongoDB, decoded or serialized.
+"""
+from rest_framework.exceptions import ParseError
+
+FIELDS_PARAM = 'fields'
+EXCLUDE_PARAM = 'exclude'
+
+
+def _names(value):
+    return [name.strip() for name in value.split(',') if name.strip()]
+
+
+def requested_fields(request, available):
+    """Fields to return, in ``available`` order, or None when not restricted"""
+    params = getattr(request, 'query_params', request.GET)
+    fields = params.get(FIELDS_PARAM)
+    exclude = params.get(EXCLUDE_PARAM)
+    if not fields and not exclude:
+        return None
+    selected = _names(fields) if fields else list(available)
+    excluded = set(_names(exclude or ''))
+    unknown = [name for name in list(selected) + list(excluded) if name not in available]
+    if unknown:
+        raise ParseError(f'Unknown field(s): {", ".join(unknown)}. Available: {", ".join(available)}')
+    selected = set(selected) - excluded
+    return [name for name in available if name in selected]
+
+
+def with_fields(fields, *extra):
+    """``fields`` plus the ``extra`` names the query itself needs, without duplicates"""
+    return list(dict.fromkeys(list(fields) + list(extra)))
+
+
+def mongo_projection(fields, *extra):
+    """pymongo projection document for ``fields`` (+ ``extra``)"""
+    names = with_fields(fields, *extra)
+    projection = {name: 1 for name in names}
+    if '_id' not in projection:
+        projection['_id'] = 0
+    return projection
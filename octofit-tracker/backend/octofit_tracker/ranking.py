@@ -0,0 +1,241 @@
+"""In-process order-statistics index over leaderboard calories.
+
+``RankIndex`` is an indexable skip list ordered by ``total_calories``
+descending (ties broken by user_id) that answers "rank of user X", "who is
+at rank N" and "users around user X" in O(log n). A process-wide instance
+is built lazily from the leaderboard collection, kept current by the
+leaderboard write paths and rebuilt every ``RANK_INDEX_REFRESH_SECONDS`` so
+each worker process also picks up writes made by the others.
+"""
+import random
+import threading
+import time
+
+from django.conf import settings
+
+from .mongo import get_db
+
+MAX_LEVELS = 16  # 4 ** 16 entries before the top level saturates
+MAX_TOP = 1000  # largest ?limit= served by the top endpoints
+BRANCHING = 4
+
+
+class _Node:
+    __slots__ = ('key', 'user_id', 'score', 'next', 'width')
+
+    def __init__(self, key, user_id, score, levels):
+        self.key = key
+        self.user_id = user_id
+        self.score = score
+        self.next = [None] * levels
+        self.width = [0] * levels
+
+
+# Sentinel past the last entry; every real key sorts before it
+_NIL = _Node((float('inf'), ''), None, None, 0)
+
+
+def _key(user_id, score):
+    # user_id is stringified so mixed int/str ids never get compared directly
+    return (-score, str(user_id))
+
+
+class RankIndex:
+    """Indexable skip list of (user_id, score) ordered by score descending"""
+
+    def __init__(self, entries=()):
+        self._lock = threading.RLock()
+        self.build(entries)
+
+    def __len__(self):
+        return len(self._scores)
+
+    def __contains__(self, user_id):
+        return user_id in self._scores
+
+    def build(self, entries):
+        """Replace the contents with ``(user_id, score)`` pairs in O(n log n)"""
+        scores = dict(entries)
+        ordered = sorted((_key(user_id, score), user_id, score) for user_id, score in scores.items())
+        head = _Node(None, None, None, MAX_LEVELS)
+        last = [head] * MAX_LEVELS
+        last_index = [-1] * MAX_LEVELS
+
+        # Deterministic levels: every BRANCHING-th node is promoted one level
+        for index, (key, user_id, score) in enumerate(ordered):
+            levels = 1
+            position = index + 1
+            while levels < MAX_LEVELS and position % BRANCHING == 0:
+                levels += 1
+                position //= BRANCHING
+            node = _Node(key, user_id, score, levels)
+            for level in range(levels):
+                last[level].next[level] = node
+                last[level].width[level] = index - last_index[level]
+                last[level] = node
+                last_index[level] = index
+        for level in range(MAX_LEVELS):
+            last[level].next[level] = _NIL
+            last[level].width[level] = len(ordered) - last_index[level]
+
+        with self._lock:
+            self._head = head
+            self._scores = scores
+
+    def _random_levels(self):
+        levels = 1
+        while levels < MAX_LEVELS and random.random() < 1.0 / BRANCHING:
+            levels += 1
+        return levels
+
+    def _insert(self, user_id, score):
+        key = _key(user_id, score)
+        chain = [None] * MAX_LEVELS
+        steps_at_level = [0] * MAX_LEVELS
+        node = self._head
+        for level in reversed(range(MAX_LEVELS)):
+            while node.next[level].key <= key:
+                steps_at_level[level] += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+
+        levels = self._random_levels()
+        new_node = _Node(key, user_id, score, levels)
+        steps = 0
+        for level in range(levels):
+            previous = chain[level]
+            new_node.next[level] = previous.next[level]
+            previous.next[level] = new_node
+            new_node.width[level] = previous.width[level] - steps
+            previous.width[level] = steps + 1
+            steps += steps_at_level[level]
+        for level in range(levels, MAX_LEVELS):
+            chain[level].width[level] += 1
+        self._scores[user_id] = score
+
+    def _remove(self, user_id):
+        key = _key(user_id, self._scores[user_id])
+        chain = [None] * MAX_LEVELS
+        node = self._head
+        for level in reversed(range(MAX_LEVELS)):
+            while node.next[level].key < key:
+                node = node.next[level]
+            chain[level] = node
+
+        target = chain[0].next[0]
+        for level in range(len(target.next)):
+            previous = chain[level]
+            previous.width[level] += target.width[level] - 1
+            previous.next[level] = target.next[level]
+        for level in range(len(target.next), MAX_LEVELS):
+            chain[level].width[level] -= 1
+        del self._scores[user_id]
+
+    def update(self, user_id, score):
+        """Insert a user or move them to a new score"""
+        with self._lock:
+            if self._scores.get(user_id) == score:
+                return
+            if user_id in self._scores:
+                self._remove(user_id)
+            self._insert(user_id, score)
+
+    def discard(self, user_id):
+        with self._lock:
+            if user_id in self._scores:
+                self._remove(user_id)
+
+    def rank(self, user_id):
+        """Return the 1-based rank of ``user_id``, or None if unranked"""
+        with self._lock:
+            if user_id not in self._scores:
+                return None
+            key = _key(user_id, self._scores[user_id])
+            position = 0
+            node = self._head
+            for level in reversed(range(MAX_LEVELS)):
+                while node.next[level].key < key:
+                    position += node.width[level]
+                    node = node.next[level]
+            return position + 1
+
+    def _slice(self, start, stop):
+        """Return (rank, user_id, score) for 0-based positions [start, stop)"""
+        start = max(start, 0)
+        stop = min(stop, len(self._scores))
+        if start >= stop:
+            return []
+        # Descend to the node at position ``start`` then walk level 0
+        remaining = start + 1
+        node = self._head
+        for level in reversed(range(MAX_LEVELS)):
+            while node.width[level] <= remaining:
+                remaining -= node.width[level]
+                node = node.next[level]
+        result = []
+        for position in range(start, stop):
+            result.append((position + 1, node.user_id, node.score))
+            node = node.next[0]
+        return result
+
+    def top(self, limit):
+        with self._lock:
+            return self._slice(0, limit)
+
+    def around(self, user_id, radius=5):
+        """Return entries within ``radius`` ranks either side of ``user_id``"""
+        with self._lock:
+            rank = self.rank(user_id)
+            if rank is None:
+                return []
+            return self._slice(rank - 1 - radius, rank + radius)
+
+
+_index = None
+_loaded_at = 0.0
+_index_lock = threading.Lock()
+
+
+def _load_entries():
+    cursor = get_db().leaderboard.find({}, {'_id': 0, 'user_id': 1, 'total_calories': 1})
+    return ((row['user_id'], row.get('total_calories') or 0) for row in cursor.batch_size(10000))
+
+
+def get_rank_index():
+    """Return the process-wide index, (re)building it from Mongo when stale"""
+    global _index, _loaded_at
+    refresh = getattr(settings, 'RANK_INDEX_REFRESH_SECONDS', 300)
+    if _index is not None and time.monotonic() - _loaded_at < refresh:
+        return _index
+    with _index_lock:
+        if _index is None or time.monotonic() - _loaded_at >= refresh:
+            entries = _load_entries()
+            if _index is None:
+                _index = RankIndex(entries)
+            else:
+                _index.build(entries)
+            _loaded_at = time.monotonic()
+    return _index
+
+
+def ranked_rows(entries, documents):
+    """Leaderboard ``documents`` for (rank, user_id, score) ``entries``, in rank order with ``rank`` set"""
+    rows = {row['user_id']: row for row in documents}
+    data = []
+    for rank, user_id, _ in entries:
+        row = rows.get(user_id)
+        if row is not None:
+            row['rank'] = rank
+            data.append(row)
+    return data
+
+
+def record_score(user_id, score):
+    """Apply a score change to the index if this process has built one"""
+    if _index is not None:
+        _index.update(user_id, score)
+
+
+def forget(user_id):
+    if _index is not None:
+        _index.discard(user_id)
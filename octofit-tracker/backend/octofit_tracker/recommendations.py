@@ -0,0 +1,260 @@
+"""Precomputed workout recommendations.
+
+Every activity write updates the user's profile in ``activity_profiles``
+(activity-type histogram plus the most recent sessions) and rescores the
+workout catalog for that user into ``workout_recommendations``. The
+recommend endpoint then reads one small document. Stored lists record
+the workout catalog version they were scored against and are rescored
+lazily when the catalog changes. ``rebuild_recommendations`` recomputes
+every user from the activities collection.
+"""
+import datetime
+import threading
+from itertools import groupby
+
+from django.utils import timezone
+from pymongo import UpdateOne
+
+from . import cache
+from .models import Workout
+from .mongo import get_db
+from .search import normalize
+
+PROFILES = 'activity_profiles'
+RECOMMENDATIONS = 'workout_recommendations'
+RECENT_SESSIONS = 10
+TOP_N = 10
+
+DIFFICULTY_LEVELS = {
+    'beginner': 0, 'easy': 0,
+    'intermediate': 1, 'medium': 1,
+    'advanced': 2, 'hard': 2, 'expert': 2,
+}
+
+AFFINITY_WEIGHT = 0.6
+DIFFICULTY_WEIGHT = 0.3
+DURATION_WEIGHT = 0.1
+
+
+def type_key(activity_type):
+    """Histogram key for an activity type; '.' and '$' are not allowed in field names"""
+    return normalize(activity_type).replace('.', '_').replace('$', '_') or 'other'
+
+
+def _session(activity):
+    date = activity['date']
+    if isinstance(date, datetime.date) and not isinstance(date, datetime.datetime):
+        date = datetime.datetime.combine(date, datetime.time())
+    return {
+        'activity_id': activity['_id'],
+        'date': date,
+        'duration': activity.get('duration') or 0,
+        'calories': activity.get('calories_burned') or 0,
+    }
+
+
+def activity_document(activity):
+    """Plain dict view of an Activity instance for the profile functions"""
+    return {
+        '_id': activity._id,
+        'user_id': activity.user_id,
+        'activity_type': activity.activity_type,
+        'duration': activity.duration,
+        'distance': activity.distance,
+        'calories_burned': activity.calories_burned,
+        'date': activity.date,
+        'team_id': activity.team_id,
+    }
+
+
+def _profile_update(activities):
+    """Profile update adding ``activities`` (all of one user)"""
+    counts = {'total': len(activities)}
+    for activity in activities:
+        key = f'type_counts.{type_key(activity["activity_type"])}'
+        counts[key] = counts.get(key, 0) + 1
+    sessions = [_session(activity) for activity in activities]
+    return {
+        '$inc': counts,
+        '$push': {'recent': {'$each': sessions, '$sort': {'date': 1}, '$slice': -RECENT_SESSIONS}},
+    }
+
+
+def record_activity(activity, refresh=True):
+    """Add an activity document to its user's profile and rescore them"""
+    get_db()[PROFILES].update_one({'_id': activity['user_id']}, _profile_update([activity]), upsert=True)
+    if refresh:
+        refresh_user(activity['user_id'])
+
+
+def record_activities(activities):
+    """Add many activity documents to their users' profiles with one bulk write
+
+    Rescoring is left to the caller, as with ``record_activity(refresh=False)``.
+    """
+    by_user = {}
+    for activity in activities:
+        by_user.setdefault(activity['user_id'], []).append(activity)
+    if by_user:
+        get_db()[PROFILES].bulk_write([
+            UpdateOne({'_id': user_id}, _profile_update(user_activities), upsert=True)
+            for user_id, user_activities in by_user.items()
+        ], ordered=False)
+
+
+def forget_activity(activity, refresh=True):
+    """Remove an activity document from its user's profile and rescore them"""
+    get_db()[PROFILES].update_one(
+        {'_id': activity['user_id']},
+        {
+            '$inc': {f'type_counts.{type_key(activity["activity_type"])}': -1, 'total': -1},
+            '$pull': {'recent': {'activity_id': activity['_id']}},
+        },
+    )
+    if refresh:
+        refresh_user(activity['user_id'])
+
+
+class Catalog:
+    """Workout catalog cached per process and reloaded when its version changes"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._workouts = []
+
+    def get(self):
+        version = cache.get_versions(['workouts'])[0]
+        if version != self._version:
+            workouts = list(Workout.objects.values(
+                '_id', 'activity_type', 'difficulty_level', 'estimated_duration'
+            ))
+            with self._lock:
+                self._workouts = workouts
+                self._version = version
+        return self._version, self._workouts
+
+
+catalog = Catalog()
+
+
+def target_level(recent):
+    """Difficulty level a user is ready for, from recent session durations"""
+    if not recent:
+        return 0
+    durations = [session['duration'] for session in recent]
+    average = sum(durations) / len(durations)
+    level = 0 if average < 30 else 1 if average < 60 else 2
+    # Step up when the latest sessions are longer than the earlier ones
+    if len(durations) >= 4:
+        half = len(durations) // 2
+        earlier = sum(durations[:half]) / half
+        later = sum(durations[half:]) / (len(durations) - half)
+        if later > earlier * 1.1:
+            level = min(level + 1, 2)
+    return level
+
+
+def score_workouts(profile, workouts, limit=TOP_N):
+    """Rank catalog workouts for one profile, returning workout ids"""
+    counts = profile.get('type_counts', {}) if profile else {}
+    total = sum(count for count in counts.values() if count > 0)
+    recent = profile.get('recent', []) if profile else []
+    target = target_level(recent)
+    average_duration = sum(s['duration'] for s in recent) / len(recent) if recent else 30
+
+    scored = []
+    for workout in workouts:
+        affinity = max(counts.get(type_key(workout.get('activity_type') or ''), 0), 0) / total if total else 0.0
+        level = DIFFICULTY_LEVELS.get(normalize(workout.get('difficulty_level') or ''), 1)
+        difficulty = 1 - abs(target - level) / 2
+        estimated = workout.get('estimated_duration') or average_duration
+        duration = 1 - min(abs(estimated - average_duration) / max(average_duration, 1), 1)
+        score = AFFINITY_WEIGHT * affinity + DIFFICULTY_WEIGHT * difficulty + DURATION_WEIGHT * duration
+        scored.append((score, str(workout['_id']), workout['_id']))
+    scored.sort(key=lambda item: (-item[0], item[1]))
+    return [workout_id for _, _, workout_id in scored[:limit]]
+
+
+def refresh_user(user_id):
+    """Rescore the catalog for one user and store the result"""
+    db = get_db()
+    version, workouts = catalog.get()
+    profile = db[PROFILES].find_one({'_id': user_id})
+    workout_ids = score_workouts(profile, workouts)
+    db[RECOMMENDATIONS].replace_one(
+        {'_id': user_id},
+        {'workout_ids': workout_ids, 'catalog_version': version, 'computed_at': timezone.now()},
+        upsert=True,
+    )
+    return workout_ids
+
+
+def recommended_workout_ids(user_id, limit=3):
+    """Serve precomputed recommendations, rescoring only if missing or stale"""
+    version, _ = catalog.get()
+    stored = get_db()[RECOMMENDATIONS].find_one({'_id': user_id})
+    if stored is None or stored.get('catalog_version') != version:
+        return refresh_user(user_id)[:limit]
+    return stored['workout_ids'][:limit]
+
+
+def _recent_sessions(db, user_ids):
+    """Each user's latest RECENT_SESSIONS sessions, oldest first"""
+    sessions = {}
+    cursor = db.activities.find(
+        {'user_id': {'$in': user_ids}}, {'user_id': 1, 'date': 1, 'duration': 1, 'calories_burned': 1}
+    ).sort([('user_id', 1), ('date', -1), ('_id', -1)])
+    for activity in cursor:
+        latest = sessions.setdefault(activity.get('user_id'), [])
+        if len(latest) < RECENT_SESSIONS:
+            latest.append(_session(activity))
+    return {user_id: list(reversed(latest)) for user_id, latest in sessions.items()}
+
+
+def _write_profiles(db, type_counts, version, workouts):
+    """Store profiles and rescored lists for ``{user_id: type_counts}``"""
+    recent = _recent_sessions(db, list(type_counts))
+    now = timezone.now()
+    profiles, recommendations = [], []
+    for user_id, counts in type_counts.items():
+        profile = {'type_counts': counts, 'total': sum(counts.values()), 'recent': recent.get(user_id, [])}
+        profiles.append(UpdateOne({'_id': user_id}, {'$set': profile}, upsert=True))
+        recommendations.append(UpdateOne({'_id': user_id}, {'$set': {
+            'workout_ids': score_workouts(profile, workouts),
+            'catalog_version': version,
+            'computed_at': now,
+        }}, upsert=True))
+    db[PROFILES].bulk_write(profiles, ordered=False)
+    db[RECOMMENDATIONS].bulk_write(recommendations, ordered=False)
+
+
+def rebuild(batch_size=1000):
+    """Rebuild every profile from activities and rescore all users
+
+    Type counts come from one (user_id, activity_type) aggregation, so no
+    document grows with a user's history. Recent sessions are then read
+    per batch of users along the activities user_id_date_id index.
+    """
+    db = get_db()
+    version, workouts = catalog.get()
+    pipeline = [
+        {'$group': {'_id': {'user_id': '$user_id', 'activity_type': '$activity_type'}, 'count': {'$sum': 1}}},
+        {'$sort': {'_id.user_id': 1}},
+    ]
+    type_rows = db.activities.aggregate(pipeline, allowDiskUse=True)
+
+    users = 0
+    batch = {}
+    for user_id, rows in groupby(type_rows, key=lambda row: row['_id'].get('user_id')):
+        counts = batch[user_id] = {}
+        for row in rows:
+            key = type_key(row['_id'].get('activity_type') or '')
+            counts[key] = counts.get(key, 0) + row['count']
+        users += 1
+        if len(batch) >= batch_size:
+            _write_profiles(db, batch, version, workouts)
+            batch = {}
+    if batch:
+        _write_profiles(db, batch, version, workouts)
+    return users
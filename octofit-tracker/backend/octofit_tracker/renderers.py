@@ -0,0 +1,43 @@
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+from .streaming import encode_row, orjson
+
+
+class ORJSONRenderer(JSONRenderer):
+    """``application/json`` encoded with orjson
+
+    Falls back to DRF's encoder when orjson is not installed or the client
+    asked for indented output.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if orjson is None or self.get_indent(accepted_media_type or '', renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        return encode_row(data)
+
+
+class NDJSONRenderer(BaseRenderer):
+    """Newline-delimited JSON, one object per line (`?format=ndjson`)
+
+    Streaming views bypass this renderer and write rows straight from the
+    cursor; it only renders ordinary responses such as errors or pages.
+    """
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if isinstance(data, dict) and 'results' in data:
+            data = data['results']
+        if not isinstance(data, list):
+            data = [data]
+        return b''.join(encode_row(row) + b'\n' for row in data)
+
+
+class JSONStreamRenderer(JSONRenderer):
+    """Plain JSON array written in chunks by streaming views (`?format=jsonstream`)"""
+    format = 'jsonstream'
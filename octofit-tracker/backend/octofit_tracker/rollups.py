@@ -0,0 +1,215 @@
+"""Daily activity rollups per user and per team.
+
+Every activity write ``$inc``s one daily bucket for the user and one for
+their team in ``activity_rollups``. The team is the one the user was on
+when the activity was recorded, stored on the activity as ``team_id``, so
+edits and deletes after a team move come off the bucket the activity was
+added to. Activities recorded before that field existed use the user's
+current team; each bucket holds count, calories,
+duration and distance overall and per activity type. Weekly and monthly
+views are folded from the daily buckets at read time, so a year-long
+range reads at most ~365 small documents. ``rebuild_rollups`` recomputes
+every bucket from the activities collection.
+"""
+import datetime
+
+from pymongo import UpdateOne
+
+from .indexes import DECLARED_INDEXES
+from .mongo import get_db
+from .recommendations import type_key
+
+ROLLUPS = 'activity_rollups'
+REBUILD_COLLECTION = 'activity_rollups_rebuild'
+GRANULARITIES = ('day', 'week', 'month')
+METRICS = ('count', 'calories', 'duration', 'distance')
+MAX_RANGE_DAYS = 366 * 5
+
+
+def to_day(value):
+    """Midnight datetime for a date, datetime or ISO date string"""
+    if isinstance(value, datetime.datetime):
+        return datetime.datetime(value.year, value.month, value.day)
+    if isinstance(value, datetime.date):
+        return datetime.datetime(value.year, value.month, value.day)
+    return datetime.datetime.fromisoformat(str(value)[:10])
+
+
+def bucket_id(scope, owner_id, day):
+    return f'{scope}:{owner_id}:{day:%Y-%m-%d}'
+
+
+def increments(activity_type, count, calories, duration, distance):
+    """``$inc`` fields for the overall and per-type totals of a bucket"""
+    values = {'count': count, 'calories': calories, 'duration': duration, 'distance': distance}
+    fields = dict(values)
+    key = type_key(activity_type or '')
+    fields.update({f'by_type.{key}.{metric}': value for metric, value in values.items()})
+    return fields
+
+
+def activity_increments(activity, sign=1):
+    return increments(
+        activity.get('activity_type'),
+        sign,
+        sign * (activity.get('calories_burned') or 0),
+        sign * (activity.get('duration') or 0),
+        sign * (activity.get('distance') or 0),
+    )
+
+
+def merge_increments(*fields):
+    merged = {}
+    for entry in fields:
+        for field, value in entry.items():
+            merged[field] = merged.get(field, 0) + value
+    return merged
+
+
+def _owners(user_id, team_id):
+    owners = [('user', user_id)]
+    if team_id:
+        owners.append(('team', team_id))
+    return owners
+
+
+def _team_ids(db, user_ids=None):
+    """Each user's current team as stored on activities: a string, '' for none"""
+    query = {'_id': {'$in': list(user_ids)}} if user_ids is not None else {}
+    # Seed teams have integer ids while API-written users store strings
+    return {user['_id']: str(user['team_id']) if user.get('team_id') else '' for user in db.users.find(query, {'team_id': 1})}
+
+
+def owning_teams(user_ids):
+    """``team_id`` to record on new activities of these users"""
+    return _team_ids(get_db(), set(user_ids))
+
+
+def owning_team(user_id):
+    return owning_teams([user_id]).get(user_id, '')
+
+
+def _update(scope, owner_id, day, fields):
+    return UpdateOne(
+        {'_id': bucket_id(scope, owner_id, day)},
+        {'$inc': fields, '$setOnInsert': {'scope': scope, 'owner_id': owner_id, 'date': day}},
+        upsert=True,
+    )
+
+
+def apply_activities(activities, sign=1):
+    """Add (sign=1) or remove (sign=-1) activity documents from their buckets
+
+    Increments for the same bucket are merged, so a batch costs one
+    bulk_write, plus one users lookup if some activities have no recorded
+    team.
+    """
+    if not activities:
+        return
+    db = get_db()
+    unrecorded = {activity['user_id'] for activity in activities if activity.get('team_id') is None}
+    team_ids = _team_ids(db, unrecorded) if unrecorded else {}
+    merged = {}
+    for activity in activities:
+        day = to_day(activity['date'])
+        fields = activity_increments(activity, sign)
+        team_id = activity.get('team_id')
+        if team_id is None:
+            team_id = team_ids.get(activity['user_id'])
+        for scope, owner_id in _owners(activity['user_id'], team_id):
+            key = (scope, owner_id, day)
+            merged[key] = merge_increments(merged.get(key, {}), fields)
+    db[ROLLUPS].bulk_write([_update(*key, fields) for key, fields in merged.items()], ordered=False)
+
+
+def apply_activity(activity, sign=1):
+    apply_activities([activity], sign)
+
+
+def period_start(day, granularity):
+    if granularity == 'week':
+        return day - datetime.timedelta(days=day.weekday())
+    if granularity == 'month':
+        return day.replace(day=1)
+    return day
+
+
+def _empty():
+    return {metric: 0 for metric in METRICS}
+
+
+def stats_filter(scope, owner_id, start, end):
+    return {'scope': scope, 'owner_id': owner_id, 'date': {'$gte': start, '$lte': end}}
+
+
+def stats(scope, owner_id, granularity='day', start=None, end=None):
+    """Fold daily buckets in [start, end] into periods of ``granularity``"""
+    end = to_day(end or datetime.date.today())
+    start = to_day(start) if start else end - datetime.timedelta(days=364)
+    query = stats_filter(scope, owner_id, start, end)
+
+    periods = {}
+    for bucket in get_db()[ROLLUPS].find(query, {'_id': 0, 'scope': 0, 'owner_id': 0}).sort('date', 1):
+        key = period_start(bucket['date'], granularity)
+        period = periods.setdefault(key, dict(_empty(), by_type={}))
+        for metric in METRICS:
+            period[metric] += bucket.get(metric, 0)
+        for activity_type, values in bucket.get('by_type', {}).items():
+            totals = period['by_type'].setdefault(activity_type, _empty())
+            for metric in METRICS:
+                totals[metric] += values.get(metric, 0)
+
+    results = []
+    for key in sorted(periods):
+        period = periods[key]
+        # Drop types whose activities were all deleted again
+        period['by_type'] = {t: v for t, v in period['by_type'].items() if v['count']}
+        period['distance'] = round(period['distance'], 2)
+        results.append(dict(period_start=key.date().isoformat(), **period))
+    return results
+
+
+def rebuild(batch_size=1000):
+    """Recompute every bucket from activities; returns buckets written
+
+    Team buckets use the team recorded on each activity, or the user's
+    current team for activities without one. Buckets are built in
+    ``REBUILD_COLLECTION`` and swapped in with one rename, so stats reads
+    never see a missing or half-built collection. Bucket increments made
+    by activity writes while the rebuild runs are replaced with it.
+    """
+    db = get_db()
+    target = db[REBUILD_COLLECTION]
+    # Left over from an interrupted run
+    target.drop()
+    target.create_indexes(DECLARED_INDEXES[ROLLUPS])
+    team_ids = _team_ids(db)
+    pipeline = [
+        {'$group': {
+            '_id': {'user_id': '$user_id', 'team_id': '$team_id', 'date': '$date', 'activity_type': '$activity_type'},
+            'count': {'$sum': 1},
+            'calories': {'$sum': '$calories_burned'},
+            'duration': {'$sum': '$duration'},
+            'distance': {'$sum': {'$ifNull': ['$distance', 0]}},
+        }},
+    ]
+    batch = []
+    written = 0
+    for row in db.activities.aggregate(pipeline, allowDiskUse=True):
+        user_id = row['_id']['user_id']
+        team_id = row['_id'].get('team_id')
+        if team_id is None:
+            team_id = team_ids.get(user_id)
+        day = to_day(row['_id']['date'])
+        fields = increments(row['_id']['activity_type'], *(row[metric] for metric in METRICS))
+        for scope, owner_id in _owners(user_id, team_id):
+            batch.append(_update(scope, owner_id, day, fields))
+        if len(batch) >= batch_size:
+            target.bulk_write(batch, ordered=False)
+            written += len(batch)
+            batch = []
+    if batch:
+        target.bulk_write(batch, ordered=False)
+        written += len(batch)
+    target.rename(ROLLUPS, dropTarget=True)
+    return written
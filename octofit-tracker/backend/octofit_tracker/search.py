@@ -0,0 +1,138 @@
+"""Indexed username search and canonical activity-type matching.
+
+``icontains`` lookups become unanchored, case-insensitive regexes that can
+never use an index. Instead every user gets a row in ``user_search`` holding
+a normalized lowercase key (for index range scans on prefixes) and its
+trigrams (a multikey index used for substring matches). Rows are kept in
+sync by the User signals in ``signals.py``; ``rebuild_search_index``
+backfills them for data written outside the ORM.
+"""
+import unicodedata
+
+from pymongo import UpdateOne
+
+from .mongo import get_db
+
+SEARCH_COLLECTION = 'user_search'
+GRAM_SIZE = 3
+MAX_RESULTS = 100
+
+# Activity types used by the seed data and the frontend
+CANONICAL_ACTIVITY_TYPES = ['Running', 'Cycling', 'Swimming', 'Weightlifting', 'Yoga', 'Boxing', 'Cardio']
+_CANONICAL_BY_KEY = {activity_type.lower(): activity_type for activity_type in CANONICAL_ACTIVITY_TYPES}
+
+
+def normalize(text):
+    """Lowercase and strip accents so 'Zoë' and 'zoe' share a key"""
+    decomposed = unicodedata.normalize('NFKD', text or '')
+    return ''.join(c for c in decomposed if not unicodedata.combining(c)).lower().strip()
+
+
+def ngrams(key, size=GRAM_SIZE):
+    return sorted({key[i:i + size] for i in range(len(key) - size + 1)})
+
+
+def search_document(username):
+    key = normalize(username)
+    return {'username': username, 'key': key, 'grams': ngrams(key)}
+
+
+def index_user(user_id, username):
+    get_db()[SEARCH_COLLECTION].replace_one({'_id': user_id}, search_document(username), upsert=True)
+
+
+def remove_user(user_id):
+    get_db()[SEARCH_COLLECTION].delete_one({'_id': user_id})
+
+
+def rebuild(batch_size=1000):
+    """Rebuild the search collection from the users collection"""
+    db = get_db()
+    indexed = 0
+    batch = []
+    for user in db.users.find({}, {'username': 1}).batch_size(batch_size):
+        batch.append(UpdateOne({'_id': user['_id']}, {'$set': search_document(user.get('username', ''))}, upsert=True))
+        if len(batch) >= batch_size:
+            db[SEARCH_COLLECTION].bulk_write(batch, ordered=False)
+            indexed += len(batch)
+            batch = []
+    if batch:
+        db[SEARCH_COLLECTION].bulk_write(batch, ordered=False)
+        indexed += len(batch)
+    return indexed
+
+
+def prefix_filter(key):
+    # Range scan on the key index: ['abc', 'abc\uffff')
+    return {'key': {'$gte': key, '$lt': key + '\uffff'}}
+
+
+def substring_filter(key, exclude=()):
+    return {'grams': {'$all': ngrams(key)}, '_id': {'$nin': list(exclude)}}
+
+
+def search_user_ids(query, limit=20):
+    """Return user ids whose username starts with, then contains, ``query``
+
+    Prefix matches come first, in key order. Substring matches need at least
+    GRAM_SIZE characters; shorter queries are prefix-only (typeahead).
+    """
+    key = normalize(query)
+    if not key:
+        return []
+    # pymongo treats limit(0) as no limit
+    limit = min(max(limit, 1), MAX_RESULTS)
+    collection = get_db()[SEARCH_COLLECTION]
+
+    prefix = collection.find(prefix_filter(key), {'_id': 1}).sort('key', 1).limit(limit)
+    user_ids = [row['_id'] for row in prefix]
+
+    if len(user_ids) < limit and len(key) >= GRAM_SIZE:
+        candidates = collection.find(substring_filter(key, user_ids), {'_id': 1, 'key': 1}).limit(limit * 4)
+        for row in candidates:
+            # Trigram matches can be false positives ('abcxbcd' has 'abc' and
+            # 'bcd' but not 'abcd'); confirm the substring
+            if key in row['key']:
+                user_ids.append(row['_id'])
+                if len(user_ids) >= limit:
+                    break
+    return user_ids
+
+
+def activity_type_key(activity_type):
+    """Normalized activity type stored on activities as ``type_key``"""
+    return normalize(activity_type)
+
+
+def activity_type_filter(query, key_field=None):
+    """ORM filter kwargs for an activity type query
+
+    Canonical types are matched exactly: on ``key_field`` when the
+    collection stores normalized keys (activities keep ``type_key``),
+    otherwise with an ``$in`` over their spellings. Both can use an index;
+    anything else falls back to a substring search.
+    """
+    canonical = _CANONICAL_BY_KEY.get(normalize(query))
+    if canonical and key_field:
+        return {key_field: activity_type_key(canonical)}
+    if canonical:
+        return {'activity_type__in': sorted({canonical, canonical.lower(), canonical.upper(), query})}
+    return {'activity_type__icontains': query}
+
+
+def rebuild_activity_type_keys(batch_size=1000):
+    """Set ``type_key`` on activities that lack it (written before the field existed or by other tools)"""
+    db = get_db()
+    updated = 0
+    batch = []
+    stale = db.activities.find({'type_key': {'$exists': False}}, {'activity_type': 1}).batch_size(batch_size)
+    for activity in stale:
+        batch.append(UpdateOne(
+            {'_id': activity['_id']}, {'$set': {'type_key': activity_type_key(activity.get('activity_type'))}}
+        ))
+        if len(batch) >= batch_size:
+            updated += db.activities.bulk_write(batch, ordered=False).modified_count
+            batch = []
+    if batch:
+        updated += db.activities.bulk_write(batch, ordered=False).modified_count
+    return updated
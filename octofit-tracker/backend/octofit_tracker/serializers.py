@@ -1,5 +1,12 @@
-from rest_framework import serializers
+import datetime
+from functools import lru_cache
+
+from django.conf import settings
+from django.utils import timezone
+from rest_framework import ISO_8601, serializers
+from rest_framework.settings import api_settings
 from .models import User, Team, Activity, Leaderboard, Workout
+from .profiling import section
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -47,3 +54,84 @@ class WorkoutSerializer(serializers.ModelSerializer):
     class Meta:
         model = Workout
         fields = ['_id', 'name', 'description', 'activity_type', 'difficulty_level', 'estimated_duration', 'estimated_calories', 'exercises', 'created_at']
+
+
+def _iso_datetime(tz):
+    """DateTimeField output (ISO 8601, UTC as 'Z') with the timezone resolved once"""
+    def convert(value):
+        if isinstance(value, str):
+            return value
+        if tz is not None:
+            value = value.astimezone(tz) if value.tzinfo is not None else value.replace(tzinfo=tz)
+        elif value.tzinfo is not None:
+            value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+        text = value.isoformat()
+        return text[:-6] + 'Z' if text.endswith('+00:00') else text
+    return convert
+
+
+class RowSerializer:
+    """Read-only fast path for a ModelSerializer's output
+
+    Works on plain dicts (``queryset.values()`` rows or raw Mongo documents)
+    with one precomputed converter per readable field, skipping DRF's
+    per-field ``get_attribute``/``to_representation`` dispatch. Output
+    matches the ModelSerializer it was compiled from.
+    """
+    
+    def __init__(self, serializer_class):
+        converters = []
+        for name, field in serializer_class().fields.items():
+            if field.write_only:
+                continue
+            if isinstance(field, serializers.CharField):
+                convert = str
+            elif isinstance(field, serializers.IntegerField):
+                convert = int
+            elif isinstance(field, serializers.FloatField):
+                convert = float
+            elif isinstance(field, serializers.JSONField) and not field.binary:
+                convert = None
+            elif (isinstance(field, serializers.DateTimeField) and not hasattr(field, 'timezone')
+                    and getattr(field, 'format', api_settings.DATETIME_FORMAT) == ISO_8601):
+                # Bound per serialize() call, see _converters()
+                convert = _iso_datetime
+            else:
+                convert = field.to_representation
+            converters.append((name, convert))
+        self.compiled = converters
+        self.fields = [name for name, _ in converters]
+    
+    def _converters(self, fields=None):
+        # DRF resolves the current timezone for every datetime value; do it
+        # once per batch instead
+        tz = timezone.get_current_timezone() if settings.USE_TZ else None
+        selected = set(fields) if fields is not None else None
+        return [
+            (name, convert(tz) if convert is _iso_datetime else convert)
+            for name, convert in self.compiled
+            if selected is None or name in selected
+        ]
+    
+    def to_representation(self, row, converters=None):
+        data = {}
+        for name, convert in converters if converters is not None else self._converters():
+            value = row.get(name)
+            data[name] = convert(value) if convert is not None and value is not None else value
+        return data
+    
+    def serialize(self, rows, fields=None):
+        """Serialize rows, optionally only the given subset of fields"""
+        with section('serialize'):
+            converters = self._converters(fields)
+            return [self.to_representation(row, converters) for row in rows]
+    
+    def values(self, queryset, fields=None):
+        """Project a queryset onto the readable fields (or a subset)"""
+        return queryset.values(*(fields if fields is not None else self.fields))
+
+
+@lru_cache(maxsize=None)
+def row_serializer(serializer_class):
+    """Compiled RowSerializer for a ModelSerializer class (built once)"""
+    return RowSerializer(serializer_class)
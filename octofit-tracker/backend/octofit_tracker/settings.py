@@ -24,7 +24,8 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 SECRET_KEY = 'django-insecure-ppw@55ba(6gpz77%p6p$icfioi8*4zo)r)w_-4%&@9t@$wx0ds'
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+# Set DJANGO_DEBUG=0 for the production API profile
+DEBUG = os.environ.get('DJANGO_DEBUG', '1').lower() not in ('0', 'false', 'no')
 
 ALLOWED_HOSTS = ['localhost', '127.0.0.1']
 if os.environ.get('CODESPACE_NAME'):
@@ -52,7 +53,13 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # Outermost so its timings cover the whole stack; inactive unless
+    # PROFILING_ENABLED
+    'octofit_tracker.profiling.ProfilingMiddleware',
+    'octofit_tracker.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
+    # Before anything that reads or writes the response body
+    'octofit_tracker.middleware.CompressionMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -94,11 +101,40 @@ DATABASES = {
         'CLIENT': {
             'host': 'localhost',
             'port': 27017,
+            # Connection pool sizing, shared by djongo and octofit_tracker.mongo
+            'maxPoolSize': int(os.environ.get('MONGO_MAX_POOL_SIZE', 100)),
+            'minPoolSize': int(os.environ.get('MONGO_MIN_POOL_SIZE', 0)),
+            'waitQueueTimeoutMS': int(os.environ.get('MONGO_WAIT_QUEUE_TIMEOUT_MS', 5000)),
         }
     }
 }
 
 
+# Cache
+# Local memory by default; set CACHE_REDIS_URL to share the response cache
+# between worker processes. Cache versions back ETags and invalidation, so
+# with DEBUG off the app will not start on local memory unless
+# CACHE_SINGLE_PROCESS=1 says only one process serves requests.
+
+CACHE_SINGLE_PROCESS = os.environ.get('CACHE_SINGLE_PROCESS', '0').lower() in ('1', 'true', 'yes')
+
+if os.environ.get('CACHE_REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ['CACHE_REDIS_URL'],
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'octofit',
+            'OPTIONS': {'MAX_ENTRIES': 10000},
+        }
+    }
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
 
@@ -168,8 +204,57 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.AllowAny',
     ],
+    # The browsable API is only rendered in development
     'DEFAULT_RENDERER_CLASSES': [
-        'rest_framework.renderers.JSONRenderer',
-        'rest_framework.renderers.BrowsableAPIRenderer',
-    ],
+        'octofit_tracker.renderers.ORJSONRenderer',
+    ] + (['rest_framework.renderers.BrowsableAPIRenderer'] if DEBUG else []),
+    'DEFAULT_PAGINATION_CLASS': 'octofit_tracker.pagination.KeysetPagination',
+    'PAGE_SIZE': 100,
 }
+
+# Response compression (octofit_tracker.middleware.CompressionMiddleware):
+# bodies smaller than COMPRESSION_MIN_SIZE bytes are sent uncompressed
+COMPRESSION_MIN_SIZE = int(os.environ.get('COMPRESSION_MIN_SIZE', 1024))
+COMPRESSION_GZIP_LEVEL = int(os.environ.get('COMPRESSION_GZIP_LEVEL', 6))
+COMPRESSION_BROTLI_QUALITY = int(os.environ.get('COMPRESSION_BROTLI_QUALITY', 5))
+
+# Request profiling (off by default): Server-Timing headers, N+1 warnings
+# and sampled stack dumps for requests slower than PROFILING_SLOW_MS
+PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', '0').lower() in ('1', 'true', 'yes')
+PROFILING_SLOW_MS = int(os.environ.get('PROFILING_SLOW_MS', 500))
+PROFILING_DUMP_DIR = os.environ.get('PROFILING_DUMP_DIR', str(BASE_DIR / 'profiles'))
+PROFILING_SAMPLE_INTERVAL_MS = int(os.environ.get('PROFILING_SAMPLE_INTERVAL_MS', 5))
+PROFILING_N_PLUS_ONE_THRESHOLD = int(os.environ.get('PROFILING_N_PLUS_ONE_THRESHOLD', 10))
+
+# /metrics: per-endpoint request counters and latency histograms. Under
+# gunicorn point METRICS_MULTIPROC_DIR at a directory shared by the workers
+# (emptied before the server starts) so a scrape sees all of them.
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', '1').lower() not in ('0', 'false', 'no')
+METRICS_MULTIPROC_DIR = os.environ.get('METRICS_MULTIPROC_DIR')
+METRICS_FLUSH_SECONDS = float(os.environ.get('METRICS_FLUSH_SECONDS', 1.0))
+
+# Background jobs (octofit_tracker.jobs): worker threads per process (0 to
+# only enqueue and leave the work to `manage.py run_jobs`), the debounce
+# that coalesces repeated requests, and retry backoff
+JOBS_WORKERS = int(os.environ.get('JOBS_WORKERS', 2))
+JOBS_QUEUE_SIZE = int(os.environ.get('JOBS_QUEUE_SIZE', 1000))
+JOBS_COALESCE_SECONDS = float(os.environ.get('JOBS_COALESCE_SECONDS', 2))
+JOBS_SWEEP_SECONDS = float(os.environ.get('JOBS_SWEEP_SECONDS', 30))
+JOBS_TIMEOUT_SECONDS = float(os.environ.get('JOBS_TIMEOUT_SECONDS', 600))
+JOBS_MAX_ATTEMPTS = int(os.environ.get('JOBS_MAX_ATTEMPTS', 5))
+JOBS_RETRY_BASE_SECONDS = float(os.environ.get('JOBS_RETRY_BASE_SECONDS', 5))
+JOBS_RETRY_MAX_SECONDS = float(os.environ.get('JOBS_RETRY_MAX_SECONDS', 600))
+
+# update_stats: concurrent requests for one user share a recompute, which
+# waits this many seconds after the first request for others to join
+UPDATE_STATS_COALESCE_SECONDS = float(os.environ.get('UPDATE_STATS_COALESCE_SECONDS', 0))
+
+# Denormalized user/team fields (octofit_tracker.sync): 'bus' syncs from
+# in-process events, 'change_stream' leaves it to `manage.py
+# sync_denormalized` (needs a replica set), 'off' disables it
+SYNC_SOURCE = os.environ.get('SYNC_SOURCE', 'bus')
+SYNC_BATCH_SECONDS = float(os.environ.get('SYNC_BATCH_SECONDS', 1.0))
+
+# Leaderboard rank index: seconds before a worker rebuilds its in-process
+# index from Mongo to pick up writes handled by other workers
+RANK_INDEX_REFRESH_SECONDS = int(os.environ.get('RANK_INDEX_REFRESH_SECONDS', 300))
@@ -0,0 +1,62 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Activity, Leaderboard, Team, User, Workout
+from . import cache, leaderboard, search, sync
+
+
+@receiver(post_save, sender=User)
+def index_user_for_search(sender, instance, **kwargs):
+    search.index_user(instance._id, instance.username)
+
+
+@receiver(post_delete, sender=User)
+def remove_user_from_search(sender, instance, **kwargs):
+    search.remove_user(instance._id)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_user_etags(sender, **kwargs):
+    cache.bump('users')
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def sync_user_copies(sender, instance, **kwargs):
+    sync.publish('users', instance._id)
+
+
+@receiver(post_save, sender=Activity)
+@receiver(post_delete, sender=Activity)
+def invalidate_activity_etags(sender, **kwargs):
+    cache.bump('activities')
+
+
+@receiver(post_save, sender=Leaderboard)
+@receiver(post_delete, sender=Leaderboard)
+def invalidate_leaderboard_cache(sender, **kwargs):
+    cache.bump('leaderboard')
+
+
+@receiver(post_save, sender=Team)
+def refresh_team_names(sender, instance, created, **kwargs):
+    if not created:
+        leaderboard.rename_team(instance._id, instance.name)
+
+
+@receiver(post_delete, sender=Team)
+def sync_team_copies(sender, instance, **kwargs):
+    sync.publish('teams', instance._id)
+
+
+@receiver(post_save, sender=Team)
+@receiver(post_delete, sender=Team)
+def invalidate_team_etags(sender, **kwargs):
+    cache.bump('teams')
+
+
+@receiver(post_save, sender=Workout)
+@receiver(post_delete, sender=Workout)
+def invalidate_workout_cache(sender, **kwargs):
+    cache.bump('workouts')
@@ -0,0 +1,89 @@
+"""Streaming exports that keep memory flat for multi-million-row responses.
+
+Rows are read with ``values()`` from a server-side cursor in batches and
+encoded one at a time without DRF serializers, then written to a
+``StreamingHttpResponse`` as NDJSON or a chunked JSON array.
+"""
+import datetime
+import decimal
+import json
+
+from bson import ObjectId
+from django.http import StreamingHttpResponse
+from django.utils.functional import Promise
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is optional
+    orjson = None
+
+STREAM_FORMATS = {'ndjson', 'jsonstream'}
+DEFAULT_BATCH_SIZE = 2000
+
+
+def _default(value):
+    if isinstance(value, datetime.datetime):
+        value = value.isoformat()
+        return value[:-6] + 'Z' if value.endswith('+00:00') else value
+    if isinstance(value, datetime.date):
+        return value.isoformat()
+    if isinstance(value, (ObjectId, Promise)):
+        return str(value)
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+if orjson is not None:
+    _ORJSON_OPTIONS = orjson.OPT_UTC_Z | orjson.OPT_NAIVE_UTC | orjson.OPT_NON_STR_KEYS
+
+    def encode_row(row):
+        """Encode one row (or any JSON-able value) to compact JSON bytes"""
+        return orjson.dumps(row, default=_default, option=_ORJSON_OPTIONS)
+else:
+    def encode_row(row):
+        """Encode one row (or any JSON-able value) to compact JSON bytes"""
+        return json.dumps(row, default=_default, separators=(',', ':')).encode('utf-8')
+
+
+def iter_rows(queryset, fields, batch_size=DEFAULT_BATCH_SIZE):
+    """Yield plain dicts for ``fields`` from a server-side cursor"""
+    return queryset.values(*fields).iterator(chunk_size=batch_size)
+
+
+def _ndjson_chunks(rows, batch_size):
+    buffer = []
+    for row in rows:
+        buffer.append(encode_row(row))
+        if len(buffer) >= batch_size:
+            yield b'\n'.join(buffer) + b'\n'
+            buffer = []
+    if buffer:
+        yield b'\n'.join(buffer) + b'\n'
+
+
+def _json_array_chunks(rows, batch_size):
+    yield b'['
+    buffer = []
+    separator = b''
+    for row in rows:
+        buffer.append(encode_row(row))
+        if len(buffer) >= batch_size:
+            yield separator + b','.join(buffer)
+            separator = b','
+            buffer = []
+    if buffer:
+        yield separator + b','.join(buffer)
+    yield b']'
+
+
+def stream_queryset(queryset, fields, stream_format, batch_size=DEFAULT_BATCH_SIZE):
+    """Build a streaming response for ``queryset`` in ``stream_format``"""
+    rows = iter_rows(queryset, fields, batch_size)
+    if stream_format == 'ndjson':
+        chunks = _ndjson_chunks(rows, batch_size)
+        content_type = 'application/x-ndjson'
+    else:
+        chunks = _json_array_chunks(rows, batch_size)
+        content_type = 'application/json'
+    return StreamingHttpResponse(chunks, content_type=content_type)
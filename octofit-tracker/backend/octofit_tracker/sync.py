@@ -0,0 +1,225 @@
+"""Propagation of user and team changes to their denormalized copies.
+
+``users`` and ``teams`` are the sources of truth. Leaderboard rows copy
+``username``, ``team_id`` and ``team_name``, ``team_leaderboard`` rows copy
+the team name, ``user_search`` copies the username, and ``Team.members``
+mirrors ``User.team_id``. Events only name the documents that changed.
+The worker gathers them for ``SYNC_BATCH_SECONDS``, re-reads those sources
+and rewrites only the copies that differ, in a few bulk writes. Events can
+therefore be duplicated, reordered or replayed.
+
+Events come from one of two places (``SYNC_SOURCE``):
+
+- ``bus``: the in-process event bus. ``publish()`` is called by the User
+  signals and a worker thread in each process applies the batches.
+- ``change_stream``: ``manage.py sync_denormalized`` watches MongoDB change
+  streams on ``users`` and ``teams`` and also sees writes made outside the
+  app. Change streams need a replica set, so a standalone local server has
+  to use ``bus``.
+
+The membership endpoints keep member lists and leaderboard rows in step
+themselves (``membership``); the sync finds nothing to do for those writes.
+The batch delay gives them time to finish before it looks.
+"""
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+from pymongo import UpdateMany, UpdateOne
+
+from . import cache, leaderboard, membership, ranking, search
+from .mongo import get_db
+
+logger = logging.getLogger(__name__)
+
+STATE = 'sync_state'
+WATCHED = ('users', 'teams')
+
+# Change stream events that can affect a copy: inserts, replacements and
+# deletes, and updates touching a copied field
+_COPIED_FIELDS = ('username', 'team_id', 'name')
+CHANGE_STREAM_PIPELINE = [{'$match': {
+    'ns.coll': {'$in': list(WATCHED)},
+    '$or': [
+        {'operationType': {'$in': ['insert', 'replace', 'delete']}},
+        {'updateDescription.removedFields': {'$in': list(_COPIED_FIELDS)}},
+    ] + [
+        {f'updateDescription.updatedFields.{field}': {'$exists': True}} for field in _COPIED_FIELDS
+    ],
+}}]
+
+
+def sync_users(db, user_ids):
+    """Rewrite the copies of these users' fields; returns documents written"""
+    user_ids = list(user_ids)
+    users = {user['_id']: user for user in db.users.find({'_id': {'$in': user_ids}}, {'username': 1, 'team_id': 1})}
+    written = 0
+
+    renames = [
+        UpdateOne({'user_id': user_id, 'username': {'$ne': user.get('username', '')}},
+                  {'$set': {'username': user.get('username', '')}})
+        for user_id, user in users.items()
+    ]
+    # An unchanged $set is a no-op on the server
+    reindex = [
+        UpdateOne({'_id': user_id}, {'$set': search.search_document(user.get('username', ''))}, upsert=True)
+        for user_id, user in users.items()
+    ]
+    if renames:
+        written += db.leaderboard.bulk_write(renames, ordered=False).modified_count
+        db[search.SEARCH_COLLECTION].bulk_write(reindex, ordered=False)
+
+    # Team membership, checked against both member lists and leaderboard rows
+    listed = {}
+    for team in db.teams.find({'members': {'$in': user_ids}}, {'members': 1}):
+        for member in team['members']:
+            if member in users:
+                listed.setdefault(member, []).append(team['_id'])
+    rows = {row['user_id']: row.get('team_id') for row in db.leaderboard.find({'user_id': {'$in': user_ids}}, {'user_id': 1, 'team_id': 1})}
+    for user_id, user in users.items():
+        team_id = user.get('team_id') or None
+        teams = listed.get(user_id, [])
+        if team_id:
+            key = leaderboard.team_key(team_id)
+            in_step = [leaderboard.team_key(listed_id) for listed_id in teams] == [key]
+            in_step = in_step and (user_id not in rows or leaderboard.team_key(rows[user_id]) == key)
+        else:
+            in_step = not teams and rows.get(user_id) is None
+        if not in_step:
+            membership.repair_member(user_id, team_id, teams)
+            written += 1
+
+    deleted = [user_id for user_id in user_ids if user_id not in users]
+    if deleted:
+        written += remove_users(db, deleted)
+    if written:
+        cache.bump('leaderboard', 'teams')
+    return written
+
+
+def remove_users(db, user_ids):
+    """Drop deleted users from member lists, team totals, the leaderboard and search"""
+    counts = {}
+    for team in db.teams.find({'members': {'$in': user_ids}}, {'members': 1}):
+        counts[team['_id']] = -len(set(team['members']) & set(user_ids))
+    if counts:
+        db.teams.update_many({'_id': {'$in': list(counts)}}, {'$pull': {'members': {'$in': user_ids}}})
+        leaderboard.count_members(db, counts)
+    # Takes their totals off their teams' rows
+    leaderboard.move_members(user_ids, None)
+    removed = db.leaderboard.delete_many({'user_id': {'$in': user_ids}}).deleted_count
+    db[search.SEARCH_COLLECTION].delete_many({'_id': {'$in': user_ids}})
+    for user_id in user_ids:
+        ranking.forget(user_id)
+    return len(counts) + removed
+
+
+def sync_teams(db, team_ids):
+    """Rewrite the copies of these teams' names; clear deleted teams. Returns documents written"""
+    values = [value for team_id in team_ids for value in leaderboard.team_id_values(team_id)]
+    teams = {team['_id']: team.get('name') for team in db.teams.find({'_id': {'$in': values}}, {'name': 1})}
+    written = 0
+    member_rows = [
+        UpdateMany({'team_id': {'$in': leaderboard.team_id_values(team_id)}, 'team_name': {'$ne': name}},
+                   {'$set': {'team_name': name}})
+        for team_id, name in teams.items()
+    ]
+    team_rows = [
+        UpdateOne({'_id': leaderboard.team_key(team_id), 'team_name': {'$ne': name}}, {'$set': {'team_name': name}})
+        for team_id, name in teams.items()
+    ]
+    if member_rows:
+        written += db.leaderboard.bulk_write(member_rows, ordered=False).modified_count
+        written += db[leaderboard.TEAMS].bulk_write(team_rows, ordered=False).modified_count
+
+    known = {leaderboard.team_key(team_id) for team_id in teams}
+    deleted = [team_id for team_id in team_ids if leaderboard.team_key(team_id) not in known]
+    if deleted:
+        values = [value for team_id in deleted for value in leaderboard.team_id_values(team_id)]
+        # users.team_id is stored as a string
+        written += db.users.update_many({'team_id': {'$in': values}}, {'$set': {'team_id': None}}).modified_count
+        members = [row['user_id'] for row in db.leaderboard.find({'team_id': {'$in': values}}, {'user_id': 1})]
+        if members:
+            leaderboard.move_members(members, None)
+            written += len(members)
+        written += db[leaderboard.TEAMS].delete_many({'_id': {'$in': [leaderboard.team_key(t) for t in deleted]}}).deleted_count
+    if written:
+        cache.bump('leaderboard', 'teams', 'users')
+    return written
+
+
+def apply(changed):
+    """Sync ``{'users': ids, 'teams': ids}``; returns documents written"""
+    db = get_db()
+    written = 0
+    if changed.get('teams'):
+        written += sync_teams(db, list(changed['teams']))
+    if changed.get('users'):
+        written += sync_users(db, list(changed['users']))
+    return written
+
+
+class SyncWorker:
+    """Gathers changed ids and applies them in batches on a background thread"""
+
+    def __init__(self):
+        self._reset()
+
+    def _reset(self):
+        # Also run in a forked child, whose copy of the thread is gone
+        self._lock = threading.Lock()
+        self._wake = threading.Condition(self._lock)
+        self._changed = {collection: set() for collection in WATCHED}
+        self._thread = None
+
+    def publish(self, collection, *ids):
+        with self._wake:
+            self._changed[collection].update(ids)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name='octofit-sync', daemon=True)
+                self._thread.start()
+            self._wake.notify()
+
+    def _take(self):
+        with self._wake:
+            while not any(self._changed.values()):
+                self._wake.wait()
+        time.sleep(settings.SYNC_BATCH_SECONDS)
+        with self._lock:
+            changed, self._changed = self._changed, {collection: set() for collection in WATCHED}
+        return changed
+
+    def _loop(self):
+        while True:
+            changed = self._take()
+            try:
+                apply(changed)
+            except Exception:
+                logger.exception('Denormalization sync failed; retrying')
+                with self._lock:
+                    for collection, ids in changed.items():
+                        self._changed[collection].update(ids)
+                time.sleep(settings.SYNC_BATCH_SECONDS)
+
+
+worker = SyncWorker()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=worker._reset)
+
+
+def publish(collection, *ids):
+    """Report changed ``users`` or ``teams`` documents to the in-process sync worker"""
+    if settings.SYNC_SOURCE == 'bus':
+        worker.publish(collection, *ids)
+
+
+def load_resume_token(db):
+    state = db[STATE].find_one({'_id': 'change_stream'})
+    return state.get('token') if state else None
+
+
+def save_resume_token(db, token):
+    db[STATE].update_one({'_id': 'change_stream'}, {'$set': {'token': token}}, upsert=True)
@@ -0,0 +1,180 @@
+"""Synthetic users, teams and activities for load and performance testing.
+
+Users are generated in fixed-size chunks, each from its own
+``random.Random`` seeded with ``(seed, chunk)``, so a run is reproducible
+regardless of how many worker processes share the work. A chunk writes its
+users, their activities and their leaderboard rows with batched
+``insert_many`` calls, so memory stays bounded by the batch size and the
+leaderboard totals are summed as the activities are generated.
+
+Ids are deterministic too: users and activities get 24-character hex ids
+(the width of the ObjectId strings the API creates), teams get integers
+like the seed teams.
+"""
+import datetime
+import random
+
+from django.utils import timezone
+
+from .mongo import get_db
+from .search import activity_type_key
+
+# activity type: (relative frequency, (min, max) minutes, kcal per minute, km per minute)
+ACTIVITY_PROFILES = {
+    'Running': (25, (20, 75), 11.0, 0.16),
+    'Cycling': (20, (30, 150), 8.0, 0.4),
+    'Swimming': (10, (20, 60), 9.0, 0.04),
+    'Weightlifting': (15, (30, 90), 6.0, None),
+    'Yoga': (12, (20, 75), 3.5, None),
+    'Boxing': (8, (20, 60), 10.0, None),
+    'Cardio': (10, (15, 60), 8.5, None),
+}
+ACTIVITY_TYPES = list(ACTIVITY_PROFILES)
+ACTIVITY_WEIGHTS = [profile[0] for profile in ACTIVITY_PROFILES.values()]
+
+FIRST_NAMES = [
+    'Ada', 'Alan', 'Amara', 'Ben', 'Chen', 'Dara', 'Elena', 'Farah', 'Grace', 'Hugo', 'Iris', 'Jonas',
+    'Kai', 'Lena', 'Mateo', 'Nia', 'Omar', 'Priya', 'Quinn', 'Rosa', 'Sam', 'Tariq', 'Uma', 'Yuki',
+]
+LAST_NAMES = [
+    'Adams', 'Baker', 'Costa', 'Diaz', 'Evans', 'Fischer', 'Garcia', 'Haddad', 'Ito', 'Jensen', 'Khan',
+    'Lopez', 'Meyer', 'Nakamura', 'Okafor', 'Petrov', 'Rossi', 'Silva', 'Tanaka', 'Wong',
+]
+TEAM_ADJECTIVES = ['Swift', 'Iron', 'Golden', 'Rapid', 'Mighty', 'Silent', 'Bold', 'Steady']
+TEAM_NOUNS = ['Falcons', 'Wolves', 'Comets', 'Titans', 'Otters', 'Rhinos', 'Sparks', 'Pumas']
+
+# Activity ids are user_index * ACTIVITY_ID_STRIDE + n
+ACTIVITY_ID_STRIDE = 1 << 20
+
+
+def user_id(index):
+    return f'{index:024x}'
+
+
+def team_id(number, first_team_id):
+    """Integer id of synthetic team ``number`` (0-based)"""
+    return first_team_id + number
+
+
+def team_name(number):
+    adjective = TEAM_ADJECTIVES[number % len(TEAM_ADJECTIVES)]
+    noun = TEAM_NOUNS[number // len(TEAM_ADJECTIVES) % len(TEAM_NOUNS)]
+    return f'{adjective} {noun} {number + 1}'
+
+
+def team_number(index, team_count):
+    """Users are dealt round-robin onto the teams"""
+    return index % team_count if team_count else None
+
+
+def generate_user(rng, index, team):
+    first_name = rng.choice(FIRST_NAMES)
+    last_name = rng.choice(LAST_NAMES)
+    username = f'{first_name}{last_name}{index}'.lower()
+    return {
+        '_id': user_id(index),
+        'username': username,
+        'email': f'{username}@example.com',
+        'password': 'password123',
+        'first_name': first_name,
+        'last_name': last_name,
+        'team_id': str(team) if team is not None else None,
+    }
+
+
+def generate_activity(rng, index, n, today, days):
+    activity_type = rng.choices(ACTIVITY_TYPES, ACTIVITY_WEIGHTS)[0]
+    _, (low, high), kcal_per_minute, km_per_minute = ACTIVITY_PROFILES[activity_type]
+    duration = rng.randint(low, high)
+    day = today - datetime.timedelta(days=rng.randrange(days))
+    return {
+        '_id': f'{index * ACTIVITY_ID_STRIDE + n:024x}',
+        'user_id': user_id(index),
+        'activity_type': activity_type,
+        'type_key': activity_type_key(activity_type),
+        'duration': duration,
+        'distance': round(duration * km_per_minute * rng.uniform(0.7, 1.3), 2) if km_per_minute else None,
+        'calories_burned': int(duration * kcal_per_minute * rng.uniform(0.8, 1.2)),
+        # Midnight, like the ORM and the bulk ingest endpoint store dates
+        'date': datetime.datetime.combine(day, datetime.time()),
+        'notes': '',
+    }
+
+
+def activity_count(rng, activities_per_user):
+    """Around ``activities_per_user`` (+/- 50%) so users are not all alike"""
+    if activities_per_user <= 0:
+        return 0
+    return rng.randint(max(1, activities_per_user // 2), activities_per_user + activities_per_user // 2)
+
+
+def chunk_rng(seed, chunk):
+    return random.Random(f'{seed}:{chunk}')
+
+
+def write_chunk(chunk, start, stop, options):
+    """Generate and insert users [start, stop); returns (users, activities) written
+
+    ``options``: seed, activities_per_user, team_count, first_team_id, days,
+    batch_size. Runs in worker processes, so it only takes picklable values.
+    """
+    db = get_db()
+    rng = chunk_rng(options['seed'], chunk)
+    now = timezone.now()
+    today = now.date()
+    batch_size = options['batch_size']
+    users, rows, activities = [], [], []
+    written = 0
+
+    for index in range(start, stop):
+        number = team_number(index, options['team_count'])
+        team = team_id(number, options['first_team_id']) if number is not None else None
+        user = generate_user(rng, index, team)
+        user['created_at'] = now
+        users.append(user)
+        totals = {'total_activities': 0, 'total_calories': 0, 'total_duration': 0, 'total_distance': 0.0}
+        for n in range(activity_count(rng, options['activities_per_user'])):
+            activity = generate_activity(rng, index, n, today, options['days'])
+            activity['created_at'] = now
+            activities.append(activity)
+            totals['total_activities'] += 1
+            totals['total_calories'] += activity['calories_burned']
+            totals['total_duration'] += activity['duration']
+            totals['total_distance'] += activity['distance'] or 0
+            if len(activities) >= batch_size:
+                db.activities.insert_many(activities, ordered=False)
+                written += len(activities)
+                activities = []
+        totals['total_distance'] = round(totals['total_distance'], 2)
+        rows.append(dict(
+            totals,
+            _id=user['_id'],
+            user_id=user['_id'],
+            username=user['username'],
+            team_id=user['team_id'],
+            team_name=team_name(number) if number is not None else None,
+            rank=None,
+            updated_at=now,
+        ))
+
+    if activities:
+        db.activities.insert_many(activities, ordered=False)
+        written += len(activities)
+    for start_at in range(0, len(users), batch_size):
+        db.users.insert_many(users[start_at:start_at + batch_size], ordered=False)
+        db.leaderboard.insert_many(rows[start_at:start_at + batch_size], ordered=False)
+    return len(users), written
+
+
+def team_documents(user_count, team_count, first_team_id):
+    """Synthetic team documents with their member lists, one at a time"""
+    now = timezone.now()
+    for number in range(team_count):
+        yield {
+            '_id': team_id(number, first_team_id),
+            'name': team_name(number),
+            'description': 'Synthetic load-test team',
+            'created_by': user_id(number) if number < user_count else '',
+            'members': [user_id(index) for index in range(number, user_count, team_count)],
+            'created_at': now,
+        }
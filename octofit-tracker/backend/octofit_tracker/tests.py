@@ -1,8 +1,36 @@
-from django.test import TestCase
-from rest_framework.test import APITestCase, APIClient
+import asyncio
+import datetime
+import gzip
+import json
+import os
+import tempfile
+import threading
+import time
+from unittest import mock
+from django.core.exceptions import ImproperlyConfigured
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from rest_framework.exceptions import NotFound, ParseError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.test import APITestCase, APIClient, APIRequestFactory
 from rest_framework import status
 from .models import User, Team, Activity, Leaderboard, Workout
 from bson import ObjectId
+from . import (
+    batch, cache, indexes, ingest, jobs, leaderboard, membership, metrics, middleware, mongo, profiling, projection,
+    recommendations, rollups, search, streaming, sync, synthetic,
+)
+from . import leaderboard_rebuild
+from .coalesce import SingleFlight
+from .pagination import KeysetPagination
+from .parsers import NDJSONParser
+from .ranking import RankIndex
+from .renderers import NDJSONRenderer, ORJSONRenderer
+from .serializers import ActivitySerializer, LeaderboardSerializer, UserSerializer, RowSerializer
+from .views import LeaderboardViewSet, TeamViewSet, UserViewSet, WorkoutViewSet, batch_reads
 
 
 class UserAPITestCase(APITestCase):
@@ -26,7 +54,7 @@ class UserAPITestCase(APITestCase):
         User.objects.create(**self.user_data)
         response = self.client.get('/api/users/')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
+        self.assertEqual(len(response.data['results']), 1)
 
 
 class TeamAPITestCase(APITestCase):
@@ -56,7 +84,7 @@ class TeamAPITestCase(APITestCase):
         Team.objects.create(**self.team_data)
         response = self.client.get('/api/teams/')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
+        self.assertEqual(len(response.data['results']), 1)
 
 
 class ActivityAPITestCase(APITestCase):
@@ -89,7 +117,16 @@ class ActivityAPITestCase(APITestCase):
         Activity.objects.create(**self.activity_data)
         response = self.client.get('/api/activities/')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
+        self.assertEqual(len(response.data['results']), 1)
+    
+    def test_bulk_create_activities(self):
+        invalid = dict(self.activity_data, duration='thirty')
+        response = self.client.post('/api/activities/bulk/', [self.activity_data, invalid], format='json')
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual(response.data['created'], 1)
+        self.assertEqual(response.data['results'][1]['status'], 'invalid')
+        self.assertIn('duration', response.data['results'][1]['errors'])
+        self.assertEqual(Activity.objects.count(), 1)
 
 
 class LeaderboardAPITestCase(APITestCase):
@@ -120,7 +157,7 @@ class LeaderboardAPITestCase(APITestCase):
         Leaderboard.objects.create(**self.leaderboard_data)
         response = self.client.get('/api/leaderboard/')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
+        self.assertEqual(len(response.data['results']), 1)
 
 
 class WorkoutAPITestCase(APITestCase):
@@ -149,4 +186,1269 @@ class WorkoutAPITestCase(APITestCase):
         Workout.objects.create(**self.workout_data)
         response = self.client.get('/api/workouts/')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
-        self.assertEqual(len(response.data), 1)
+        self.assertEqual(len(response.data['results']), 1)
+
+
+class MongoConnectionManagerTestCase(SimpleTestCase):
+    def tearDown(self):
+        mongo.close_client()
+    
+    def test_client_is_shared(self):
+        self.assertIs(mongo.get_client(), mongo.get_client())
+    
+    def test_client_rebuilt_after_fork(self):
+        client = mongo.get_client()
+        with mock.patch('octofit_tracker.mongo.os.getpid', return_value=-1):
+            self.assertIsNot(mongo.get_client(), client)
+    
+    def test_pool_options_from_settings(self):
+        options = mongo.client_options()
+        self.assertEqual(options['host'], 'localhost')
+        self.assertIn('maxPoolSize', options)
+    
+    def test_async_clients_are_per_event_loop(self):
+        async def database():
+            return mongo.get_async_db(), mongo.get_async_db()
+        
+        motor_client = mock.Mock(side_effect=lambda **options: mock.MagicMock())
+        with mock.patch.dict('sys.modules', {'motor.motor_asyncio': mock.Mock(AsyncIOMotorClient=motor_client)}):
+            first, again = asyncio.run(database())
+            second, _ = asyncio.run(database())
+        self.assertIs(first, again)
+        self.assertIsNot(first, second)
+        self.assertEqual(motor_client.call_count, 2)
+
+
+class LeaderboardDeltaTestCase(SimpleTestCase):
+    def test_activity_delta(self):
+        activity = Activity(duration=30, distance=None, calories_burned=300)
+        self.assertEqual(leaderboard.activity_delta(activity, sign=-1), {
+            'total_activities': -1,
+            'total_calories': -300,
+            'total_duration': -30,
+            'total_distance': 0,
+        })
+    
+    def test_combine_deltas_drops_cancelled_fields(self):
+        old = leaderboard.activity_delta(Activity(duration=30, distance=5.0, calories_burned=300), sign=-1)
+        new = leaderboard.activity_delta(Activity(duration=45, distance=5.0, calories_burned=300))
+        self.assertEqual(leaderboard.combine_deltas(old, new), {'total_duration': 15})
+
+
+class LeaderboardReconcileTestCase(SimpleTestCase):
+    def reconcile(self, db, users=(), **kwargs):
+        db.activities.aggregate.return_value = [
+            {'_id': 'a', 'total_activities': 1, 'total_calories': 300, 'total_duration': 30, 'total_distance': 0},
+        ]
+        with mock.patch.object(leaderboard, 'get_db', return_value=db), \
+                mock.patch.object(leaderboard, 'fill_missing_identity'), \
+                mock.patch.object(leaderboard, 'rebuild_team_totals'), \
+                mock.patch.object(leaderboard, '_row_defaults', side_effect=lambda db, user_id: {'username': user_id}), \
+                mock.patch.object(leaderboard.User, 'objects') as objects, \
+                mock.patch.object(leaderboard.ranking, 'record_score') as self.record_score, \
+                mock.patch.object(leaderboard.cache, 'bump'):
+            objects.filter.return_value.values_list.return_value = list(users)
+            return leaderboard.reconcile(**kwargs)
+    
+    def test_full_run_zeroes_rows_not_stamped_by_the_run(self):
+        db = mock.MagicMock()
+        db.leaderboard.bulk_write.return_value.bulk_api_result = {'nModified': 1, 'nUpserted': 0, 'writeErrors': []}
+        db.leaderboard.update_many.return_value.modified_count = 2
+        self.assertEqual(self.reconcile(db), 3)
+        [write] = db.leaderboard.bulk_write.call_args.args[0]
+        run = write._doc['$set']['run_id']
+        started = write._doc['$set']['updated_at']
+        self.assertEqual(write._filter, {'updated_at': {'$not': {'$gte': started}}, 'user_id': 'a'})
+        stale = db.leaderboard.update_many.call_args.args[0]
+        self.assertEqual(stale, {'updated_at': {'$not': {'$gte': started}}, 'run_id': {'$ne': run}})
+    
+    def test_rows_updated_during_the_run_are_skipped(self):
+        db = mock.MagicMock()
+        db.leaderboard.bulk_write.side_effect = leaderboard.BulkWriteError({
+            'nModified': 0, 'nUpserted': 0, 'writeErrors': [{'index': 0, 'code': 11000, 'errmsg': 'dup'}],
+        })
+        db.leaderboard.update_many.return_value.modified_count = 0
+        db.leaderboard.find.return_value = [{'user_id': 'a', 'total_calories': 450}]
+        self.assertEqual(self.reconcile(db), 0)
+        # The live delta's total, not the aggregation's
+        self.record_score.assert_called_once_with('a', 450)
+    
+    def test_requested_users_without_activities_get_a_zero_row(self):
+        db = mock.MagicMock()
+        db.leaderboard.bulk_write.return_value.bulk_api_result = {'nModified': 1, 'nUpserted': 1}
+        self.reconcile(db, users=['b'], user_ids=['a', 'b', 'gone'])
+        zeroed = db.leaderboard.bulk_write.call_args_list[-1].args[0]
+        self.assertEqual([op._filter['user_id'] for op in zeroed], ['b', 'gone'])
+        self.assertEqual([op._upsert for op in zeroed], [True, False])
+        self.assertEqual(zeroed[0]._doc['$setOnInsert'], {'username': 'b'})
+        self.assertEqual(zeroed[0]._doc['$set']['total_activities'], 0)
+    
+    def test_identity_backfill_is_batched(self):
+        db = mock.MagicMock()
+        db.leaderboard.find.return_value.batch_size.return_value = [{'user_id': 'a'}, {'user_id': 'b'}, {'user_id': 'c'}]
+        db.teams.find.return_value = [{'_id': 1, 'name': 'Team Marvel'}]
+        users = [{'_id': 'a', 'username': 'ada', 'team_id': '1'}, {'_id': 'b', 'username': 'bo', 'team_id': None}]
+        with mock.patch.object(leaderboard.User, 'objects') as objects:
+            objects.filter.return_value.values.return_value = users
+            leaderboard.fill_missing_identity(db, batch_size=2)
+        self.assertEqual(db.leaderboard.bulk_write.call_count, 2)
+        self.assertEqual(db.teams.find.call_count, 2)
+        first = db.leaderboard.bulk_write.call_args_list[0].args[0]
+        self.assertEqual(first[0]._doc['$set'], {'username': 'ada', 'team_id': '1', 'team_name': 'Team Marvel'})
+        self.assertEqual(first[1]._doc['$set'], {'username': 'bo', 'team_id': None, 'team_name': None})
+
+
+class TeamLeaderboardTestCase(SimpleTestCase):
+    def test_team_id_values_cover_int_and_str_ids(self):
+        self.assertEqual(leaderboard.team_id_values(1), [1, '1'])
+        self.assertEqual(leaderboard.team_id_values('2'), ['2', 2])
+        self.assertEqual(leaderboard.team_id_values('abc'), ['abc'])
+    
+    def test_team_deltas_are_incremented_into_team_rows(self):
+        db = mock.MagicMock()
+        db[leaderboard.TEAMS].bulk_write.return_value.upserted_ids = {}
+        leaderboard.apply_team_deltas(db, {1: ('Team Marvel', {'total_calories': 300}), 2: ('Team DC', {})})
+        operations = db[leaderboard.TEAMS].bulk_write.call_args[0][0]
+        self.assertEqual(len(operations), 1)
+        self.assertEqual(operations[0]._filter, {'_id': '1'})
+        self.assertEqual(operations[0]._doc['$inc'], {'total_calories': 300})
+    
+    def test_team_standings_are_ranked(self):
+        rows = [{'_id': '2', 'team_id': 2, 'total_calories': 900}, {'_id': '1', 'team_id': 1, 'total_calories': 400}]
+        collection = mock.MagicMock()
+        collection.find.return_value.sort.return_value = rows
+        with mock.patch.object(leaderboard, 'get_db', return_value={leaderboard.TEAMS: collection}):
+            standings = leaderboard.team_standings()
+        self.assertEqual([(row['rank'], row['team_id']) for row in standings], [(1, 2), (2, 1)])
+
+
+class LeaderboardRebuildTestCase(SimpleTestCase):
+    def test_ranked_pass_writes_ranks_and_checkpoints(self):
+        db = mock.MagicMock()
+        db.activities.aggregate.return_value = [
+            {'_id': user_id, 'total_activities': 1, 'total_calories': calories, 'total_duration': 30, 'total_distance': 0}
+            for user_id, calories in [('a', 900), ('b', 500), ('c', 100)]
+        ]
+        checkpoint = {'rows': 0, 'stamp': 'stamp'}
+        leaderboard_rebuild.rebuild_ranked(db, checkpoint, batch_size=2)
+        writes = [op for call in db.leaderboard.bulk_write.call_args_list for op in call.args[0]]
+        self.assertEqual([op._doc['$set']['rank'] for op in writes], [1, 2, 3])
+        self.assertEqual([op._filter for op in writes], [{'user_id': 'a'}, {'user_id': 'b'}, {'user_id': 'c'}])
+        saved = [call.args[1]['$set']['rows'] for call in db[leaderboard_rebuild.CHECKPOINTS].update_one.call_args_list]
+        self.assertEqual(saved, [2, 3])
+    
+    def test_resume_skips_written_rows_and_continues_ranks(self):
+        db = mock.MagicMock()
+        db.activities.aggregate.return_value = [
+            {'_id': 'c', 'total_activities': 1, 'total_calories': 100, 'total_duration': 30, 'total_distance': 0},
+        ]
+        leaderboard_rebuild.rebuild_ranked(db, {'rows': 2, 'stamp': 'stamp'}, batch_size=10)
+        pipeline = db.activities.aggregate.call_args.args[0]
+        self.assertEqual(pipeline[-1], {'$skip': 2})
+        [op] = db.leaderboard.bulk_write.call_args.args[0]
+        self.assertEqual(op._doc['$set']['rank'], 3)
+    
+    def test_user_shards_resume_after_mixed_type_ids(self):
+        db = mock.MagicMock()
+        db.users.find.return_value.sort.return_value.batch_size.return_value = [
+            {'_id': 1}, {'_id': 2}, {'_id': 10}, {'_id': '0a'}, {'_id': '0b'},
+        ]
+        self.assertEqual(list(leaderboard_rebuild.user_shards(db, 2)), [[1, 2], [10, '0a'], ['0b']])
+        self.assertEqual(list(leaderboard_rebuild.user_shards(db, 2, after=10)), [['0a', '0b']])
+
+
+@override_settings(JOBS_WORKERS=0)
+class JobQueueTestCase(SimpleTestCase):
+    def setUp(self):
+        self.collection = mock.MagicMock()
+        self.queue = jobs.JobQueue(collection=self.collection)
+    
+    def test_job_key_ignores_kwarg_order(self):
+        self.assertEqual(
+            jobs.job_key('leaderboard.reconcile', (), {'user_ids': ['u1'], 'batch_size': 10}),
+            jobs.job_key('leaderboard.reconcile', (), {'batch_size': 10, 'user_ids': ['u1']}),
+        )
+        self.assertNotEqual(jobs.job_key('recommendations.refresh', (1,)), jobs.job_key('recommendations.refresh', ('1',)))
+    
+    def test_waiting_job_absorbs_repeat_requests(self):
+        self.collection.update_one.return_value.matched_count = 1
+        self.assertFalse(self.queue.enqueue('recommendations.refresh', 'u1'))
+        self.collection.update_one.assert_called_once()
+        query = self.collection.update_one.call_args.args[0]
+        self.assertEqual(query, {'_id': 'recommendations.refresh:[["u1"], {}]', 'status': jobs.QUEUED})
+    
+    def test_new_job_is_upserted_after_debounce(self):
+        self.collection.update_one.return_value.matched_count = 0
+        before = timezone.now()
+        with override_settings(JOBS_COALESCE_SECONDS=30):
+            self.assertTrue(self.queue.enqueue('leaderboard.reconcile', user_ids=['u1']))
+        query, update = self.collection.update_one.call_args.args
+        self.assertEqual(query['status'], {'$ne': jobs.QUEUED})
+        self.assertTrue(self.collection.update_one.call_args.kwargs['upsert'])
+        self.assertEqual(update['$set']['status'], jobs.QUEUED)
+        self.assertGreaterEqual(update['$set']['run_at'], before + datetime.timedelta(seconds=30))
+    
+    def test_concurrent_enqueue_counts_as_coalesced(self):
+        self.collection.update_one.side_effect = [mock.Mock(matched_count=0), jobs.DuplicateKeyError('dup')]
+        self.assertFalse(self.queue.enqueue('recommendations.refresh', 'u1'))
+        self.assertEqual(self.queue.stats['coalesced'], 1)
+    
+    def test_locally_pending_job_coalesces_without_a_round_trip(self):
+        self.queue._threads = [mock.Mock()]
+        self.queue._pending.add(jobs.job_key('recommendations.refresh', ('u1',)))
+        self.assertFalse(self.queue.enqueue('recommendations.refresh', 'u1'))
+        self.collection.update_one.assert_not_called()
+    
+    def test_unknown_job_is_rejected(self):
+        with self.assertRaises(ValueError):
+            self.queue.enqueue('nope')
+    
+    def claimed(self, attempts=1):
+        job = {'_id': 'key', 'name': 'recommendations.refresh', 'args': ['u1'], 'kwargs': {},
+               'attempts': attempts, 'started_at': datetime.datetime(2024, 1, 1)}
+        self.collection.find_one_and_update.return_value = job
+        return job
+    
+    def test_successful_run_is_marked_done(self):
+        self.claimed()
+        with mock.patch.object(recommendations, 'refresh_user') as refresh_user:
+            self.assertEqual(self.queue.run('key'), jobs.DONE)
+        refresh_user.assert_called_once_with('u1')
+        query, update = self.collection.update_one.call_args.args
+        self.assertEqual(query['status'], jobs.RUNNING)
+        self.assertEqual(update['$set']['status'], jobs.DONE)
+    
+    def test_failed_run_is_retried_with_backoff(self):
+        self.claimed(attempts=2)
+        before = timezone.now()
+        with mock.patch.object(recommendations, 'refresh_user', side_effect=RuntimeError('boom')), \
+                self.assertLogs('octofit_tracker.jobs', 'WARNING'):
+            self.assertEqual(self.queue.run('key'), jobs.QUEUED)
+        update = self.collection.update_one.call_args.args[1]['$set']
+        self.assertEqual(update['last_error'], 'RuntimeError: boom')
+        # JOBS_RETRY_BASE_SECONDS * 2 ** (attempts - 1), -20% jitter
+        self.assertGreaterEqual(update['run_at'], before + datetime.timedelta(seconds=8))
+    
+    @override_settings(JOBS_MAX_ATTEMPTS=3)
+    def test_job_fails_after_max_attempts(self):
+        self.claimed(attempts=3)
+        with mock.patch.object(recommendations, 'refresh_user', side_effect=RuntimeError('boom')), \
+                self.assertLogs('octofit_tracker.jobs', 'ERROR'):
+            self.assertEqual(self.queue.run('key'), jobs.FAILED)
+        self.assertEqual(self.collection.update_one.call_args.args[1]['$set']['status'], jobs.FAILED)
+    
+    def test_job_claimed_elsewhere_is_skipped(self):
+        self.collection.find_one_and_update.return_value = None
+        with mock.patch.object(recommendations, 'refresh_user') as refresh_user:
+            self.assertIsNone(self.queue.run('key'))
+        refresh_user.assert_not_called()
+
+
+class SingleFlightTestCase(SimpleTestCase):
+    def call_in_threads(self, flights, count, fn, key='u1', window=0.0):
+        results = [None] * count
+        
+        def call(index):
+            try:
+                results[index] = flights.do(key, fn, window)
+            except Exception as e:
+                results[index] = e
+        
+        threads = [threading.Thread(target=call, args=(index,)) for index in range(count)]
+        for thread in threads:
+            thread.start()
+        return threads, results
+    
+    def test_callers_within_the_window_share_one_call(self):
+        flights = SingleFlight()
+        calls = []
+        threads, results = self.call_in_threads(flights, 5, lambda: calls.append(1) or len(calls), window=0.2)
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [1] * 5)
+        self.assertEqual(flights.stats, {'calls': 1, 'shared': 4})
+    
+    def test_callers_during_a_running_call_share_the_next_one(self):
+        flights = SingleFlight()
+        started, release = threading.Event(), threading.Event()
+        calls = []
+        
+        def recompute():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return len(calls)
+        
+        first, first_results = self.call_in_threads(flights, 1, recompute)
+        self.assertTrue(started.wait(5))
+        later, later_results = self.call_in_threads(flights, 3, recompute)
+        deadline = time.monotonic() + 5
+        while flights.stats['shared'] < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        release.set()
+        for thread in first + later:
+            thread.join(5)
+        self.assertEqual(first_results, [1])
+        self.assertEqual(later_results, [2, 2, 2])
+        self.assertEqual(len(calls), 2)
+    
+    def test_errors_reach_every_caller(self):
+        flights = SingleFlight()
+        
+        def fail():
+            raise RuntimeError('boom')
+        
+        threads, results = self.call_in_threads(flights, 3, fail, window=0.2)
+        for thread in threads:
+            thread.join(5)
+        self.assertTrue(all(isinstance(result, RuntimeError) for result in results))
+        self.assertEqual(flights.stats['calls'], 1)
+        # The failed call is not cached
+        self.assertEqual(flights.do('u1', lambda: 'ok'), 'ok')
+
+
+class DenormalizationSyncTestCase(SimpleTestCase):
+    def setUp(self):
+        self.db = mock.MagicMock()
+        self.db.teams.find.return_value = []
+        self.db.leaderboard.find.return_value = []
+        patch = mock.patch.object(membership, 'repair_member')
+        self.repair_member = patch.start()
+        self.addCleanup(patch.stop)
+    
+    def test_username_changes_are_written_only_where_stale(self):
+        self.db.users.find.return_value = [{'_id': 'u1', 'username': 'renamed', 'team_id': None}]
+        self.db.leaderboard.bulk_write.return_value.modified_count = 1
+        self.assertEqual(sync.sync_users(self.db, ['u1']), 1)
+        [rename] = self.db.leaderboard.bulk_write.call_args.args[0]
+        self.assertEqual(rename._filter, {'user_id': 'u1', 'username': {'$ne': 'renamed'}})
+        self.repair_member.assert_not_called()
+    
+    def test_team_change_made_elsewhere_is_repaired(self):
+        self.db.users.find.return_value = [{'_id': 'u1', 'username': 'ada', 'team_id': '2'}]
+        self.db.teams.find.return_value = [{'_id': 1, 'members': ['u1', 'u9']}]
+        self.db.leaderboard.find.return_value = [{'user_id': 'u1', 'team_id': 1}]
+        sync.sync_users(self.db, ['u1'])
+        self.repair_member.assert_called_once_with('u1', '2', [1])
+    
+    def test_members_in_step_with_int_team_ids_are_left_alone(self):
+        self.db.users.find.return_value = [{'_id': 'u1', 'username': 'ada', 'team_id': '1'}]
+        self.db.teams.find.return_value = [{'_id': 1, 'members': ['u1']}]
+        self.db.leaderboard.find.return_value = [{'user_id': 'u1', 'team_id': 1}]
+        sync.sync_users(self.db, ['u1'])
+        self.repair_member.assert_not_called()
+    
+    def test_deleted_users_leave_teams_and_leaderboard(self):
+        self.db.users.find.return_value = []
+        self.db.teams.find.return_value = [{'_id': 1, 'members': ['u1', 'u2']}]
+        with mock.patch.object(leaderboard, 'count_members') as count_members, \
+                mock.patch.object(leaderboard, 'move_members') as move_members:
+            sync.sync_users(self.db, ['u1'])
+        self.db.teams.update_many.assert_called_once_with({'_id': {'$in': [1]}}, {'$pull': {'members': {'$in': ['u1']}}})
+        count_members.assert_called_once_with(self.db, {1: -1})
+        move_members.assert_called_once_with(['u1'], None)
+        self.db.leaderboard.delete_many.assert_called_once_with({'user_id': {'$in': ['u1']}})
+    
+    @override_settings(SYNC_SOURCE='bus', SYNC_BATCH_SECONDS=0.2)
+    def test_events_within_the_batch_window_are_applied_together(self):
+        worker = sync.SyncWorker()
+        applied = threading.Event()
+        with mock.patch.object(sync, 'apply', side_effect=lambda changed: applied.set()) as apply:
+            worker.publish('users', 'u1')
+            worker.publish('users', 'u1', 'u2')
+            worker.publish('teams', 1)
+            self.assertTrue(applied.wait(5))
+        apply.assert_called_once_with({'users': {'u1', 'u2'}, 'teams': {1}})
+    
+    @override_settings(SYNC_SOURCE='change_stream')
+    def test_bus_is_off_when_change_streams_are_used(self):
+        with mock.patch.object(sync.worker, 'publish') as publish:
+            sync.publish('users', 'u1')
+        publish.assert_not_called()
+
+
+class BatchReadTestCase(SimpleTestCase):
+    def setUp(self):
+        self.factory = APIRequestFactory()
+    
+    def test_requested_ids_are_deduplicated_in_order(self):
+        request = Request(self.factory.get('/api/users/', {'ids': 'b, a,,b'}))
+        self.assertEqual(batch.requested_ids(request), ['b', 'a'])
+        self.assertIsNone(batch.requested_ids(Request(self.factory.get('/api/users/'))))
+        too_many = Request(self.factory.get('/api/users/', {'ids': ','.join(map(str, range(batch.MAX_IDS + 1)))}))
+        with self.assertRaises(ValueError):
+            batch.requested_ids(too_many)
+    
+    def test_ids_response_keeps_request_order_and_lists_missing(self):
+        view = UserViewSet()
+        view.request = Request(self.factory.get('/api/users/', {'ids': 'u2,u1,u3', 'fields': 'username'}))
+        view.format_kwarg = None
+        rows = [{'_id': 'u1', 'username': 'ada'}, {'_id': 'u2', 'username': 'bo'}]
+        with mock.patch.object(UserViewSet, 'get_queryset') as get_queryset, \
+                mock.patch.object(RowSerializer, 'values', return_value=rows) as values:
+            response = view.list(view.request)
+        get_queryset.return_value.filter.assert_called_once_with(_id__in=['u2', 'u1', 'u3'])
+        self.assertIs(values.call_args.args[0], get_queryset.return_value.filter.return_value.order_by.return_value)
+        self.assertEqual(response.data['results'], [{'username': 'bo'}, {'username': 'ada'}])
+        self.assertEqual(response.data['missing'], ['u3'])
+    
+    def test_detail_reads_are_folded_into_one_ids_read_per_resource(self):
+        def dispatch(request, path):
+            if path.startswith('/api/users/'):
+                return 200, {'results': [{'username': 'ada'}, {'username': 'bo'}], 'missing': ['u9']}
+            return 200, [{'rank': 1}]
+        
+        paths = ['/api/users/u2/?fields=username', '/api/leaderboard/top/', '/api/users/u9/?fields=username',
+                 '/api/users/u1/?fields=username', '/api/users/u2/?fields=username']
+        with mock.patch.object(batch, 'dispatch', side_effect=dispatch) as dispatched:
+            responses = batch.run(None, paths)
+        self.assertEqual(dispatched.call_args_list, [
+            mock.call(None, '/api/users/?ids=u2%2Cu9%2Cu1&fields=username'),
+            mock.call(None, '/api/leaderboard/top/'),
+        ])
+        self.assertEqual([r['status'] for r in responses], [200, 200, 404, 200, 200])
+        self.assertEqual(responses[0]['body'], {'username': 'ada'})
+        self.assertEqual(responses[3]['body'], {'username': 'bo'})
+        self.assertEqual(responses[4]['body'], {'username': 'ada'})
+    
+    def test_list_actions_are_not_folded_as_detail_reads(self):
+        paths = ['/api/users/by_username/?username=ada', '/api/activities/by_user/?user_id=u1', '/api/workouts/u1/']
+        groups, single = batch.plan(paths)
+        self.assertEqual(groups, {('workouts', ''): [(2, 'u1')]})
+        self.assertEqual(single, [0, 1])
+    
+    def test_failing_sub_request_gets_its_own_500(self):
+        request = self.factory.get('/api/batch/')
+        with mock.patch.object(UserViewSet, 'list', side_effect=RuntimeError('boom')), \
+                self.assertLogs('octofit_tracker.batch', 'ERROR'):
+            code, body = batch.dispatch(request, '/api/users/')
+        self.assertEqual((code, body), (500, {'error': 'Internal server error'}))
+    
+    def test_async_routes_get_their_own_400(self):
+        request = self.factory.post('/api/batch/', {'requests': [
+            {'path': '/api/async/teams/'}, {'path': '/api/async/leaderboard/top/'},
+        ]}, format='json')
+        with mock.patch('octofit_tracker.async_views.get_async_db') as get_async_db:
+            response = batch_reads(request)
+        get_async_db.assert_not_called()
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([r['status'] for r in response.data['responses']], [400, 400])
+        self.assertEqual(response.data['responses'][0]['body'], {'error': 'Async endpoints cannot be batched'})
+    
+    def test_batch_endpoint_validates_requests(self):
+        too_many = {'requests': [{'path': '/api/users/u1/'}] * (batch.MAX_REQUESTS + 1)}
+        outside = {'requests': [{'path': '/admin/'}]}
+        for body in ({}, {'requests': [{'path': '/api/users/u1/', 'method': 'DELETE'}]}, outside, too_many):
+            response = batch_reads(self.factory.post('/api/batch/', body, format='json'))
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class TeamMembershipTestCase(SimpleTestCase):
+    def setUp(self):
+        self.db = mock.MagicMock()
+        patches = [
+            mock.patch.object(membership, 'get_db', return_value=self.db),
+            mock.patch.object(leaderboard, 'count_members'),
+            mock.patch.object(leaderboard, 'move_members'),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+    
+    def test_add_member_is_one_conditional_update(self):
+        self.db.users.find.return_value = [{'_id': 'u1', 'team_id': None}]
+        self.db.teams.find_one_and_update.return_value = {'_id': 1, 'name': 'Team Marvel'}
+        self.assertEqual(membership.add_member(1, 'u1'), membership.ADDED)
+        query, update = self.db.teams.find_one_and_update.call_args[0]
+        self.assertEqual(query, {'_id': 1, 'members': {'$ne': 'u1'}})
+        self.assertEqual(update, {'$addToSet': {'members': 'u1'}})
+        self.db.users.update_many.assert_called_once_with({'_id': {'$in': ['u1']}}, {'$set': {'team_id': '1'}})
+    
+    def test_add_existing_member(self):
+        self.db.users.find.return_value = [{'_id': 'u1', 'team_id': '1'}]
+        self.db.teams.find_one_and_update.return_value = None
+        self.db.teams.count_documents.return_value = 1
+        self.assertEqual(membership.add_member(1, 'u1'), membership.ALREADY_MEMBER)
+        self.db.users.update_many.assert_not_called()
+    
+    def test_update_members_reports_each_user(self):
+        self.db.users.find.return_value = [{'_id': 'u1', 'team_id': None}, {'_id': 'u2', 'team_id': '1'}]
+        self.db.teams.find_one_and_update.side_effect = [
+            {'_id': 1, 'name': 'Team Marvel', 'members': ['u2', 'u4']},
+            {'_id': 1, 'members': ['u1', 'u2', 'u4']},
+        ]
+        statuses = membership.update_members(1, add=['u1', 'u2', 'u3'], remove=['u4', 'u5'])
+        self.assertEqual(statuses, {
+            'u1': membership.ADDED,
+            'u2': membership.ALREADY_MEMBER,
+            'u3': membership.USER_NOT_FOUND,
+            'u4': membership.REMOVED,
+            'u5': membership.NOT_MEMBER,
+        })
+    
+    def test_moving_users_counts_only_those_pulled_from_the_old_team(self):
+        self.db.users.find.return_value = [{'_id': user_id, 'team_id': '1'} for user_id in ('u1', 'u2', 'u3')]
+        self.db.teams.find_one_and_update.side_effect = [
+            {'_id': 2, 'name': 'Team DC', 'members': []},
+            # u2 and u3 were already removed from team 1 by a concurrent request
+            {'_id': 1, 'members': ['u1', 'u9']},
+        ]
+        membership.update_members(2, add=['u1', 'u2', 'u3'])
+        query, update = self.db.teams.find_one_and_update.call_args.args
+        self.assertEqual(query, {'_id': {'$in': leaderboard.team_id_values('1')}, 'members': {'$in': ['u1', 'u2', 'u3']}})
+        self.assertEqual(update, {'$pull': {'members': {'$in': ['u1', 'u2', 'u3']}}})
+        leaderboard.count_members.assert_called_once_with(self.db, {2: 3, '1': -1})
+    
+    def test_repair_member_follows_user_team_id(self):
+        self.db.teams.find_one_and_update.return_value = {'_id': 2, 'name': 'Team DC', 'members': []}
+        self.db.teams.update_one.side_effect = [mock.Mock(modified_count=1), mock.Mock(modified_count=0)]
+        membership.repair_member('u1', '2', listed=[1, 3])
+        self.assertEqual(self.db.teams.update_one.call_args_list, [
+            mock.call({'_id': 1}, {'$pull': {'members': 'u1'}}),
+            mock.call({'_id': 3}, {'$pull': {'members': 'u1'}}),
+        ])
+        leaderboard.count_members.assert_called_once_with(self.db, {1: -1, 2: 1})
+        leaderboard.move_members.assert_called_once_with(['u1'], 2, 'Team DC')
+
+
+class TeamStatsTestCase(SimpleTestCase):
+    def test_unknown_or_non_numeric_team_is_not_found(self):
+        db = mock.MagicMock()
+        db.teams.find_one.return_value = None
+        view = TeamViewSet.as_view({'get': 'stats'})
+        with mock.patch.object(TeamViewSet, 'get_mongo_connection', return_value=db):
+            response = view(APIRequestFactory().get('/api/teams/abc/stats/'), pk='abc')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(db.teams.find_one.call_args.args[0], {'_id': {'$in': ['abc']}})
+
+
+class QueryParamValidationTestCase(SimpleTestCase):
+    def get(self, viewset, action, path, params, **kwargs):
+        view = viewset.as_view({'get': action})
+        return view(APIRequestFactory().get(path, params), **kwargs)
+    
+    def test_by_username_rejects_a_non_integer_limit(self):
+        response = self.get(UserViewSet, 'by_username', '/api/users/by_username/', {'username': 'bat', 'limit': 'abc'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_by_username_clamps_limit(self):
+        with mock.patch.object(search, 'search_user_ids', return_value=[]) as search_user_ids:
+            for limit, expected in (('0', 1), ('-5', 1), ('100000', search.MAX_RESULTS)):
+                response = self.get(
+                    UserViewSet, 'by_username', '/api/users/by_username/', {'username': 'bat', 'limit': limit}
+                )
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertEqual(search_user_ids.call_args.kwargs['limit'], expected)
+
+    
+    def test_neighbors_rejects_a_non_integer_radius(self):
+        response = self.get(LeaderboardViewSet, 'neighbors', '/api/leaderboard/u1/neighbors/', {'radius': 'abc'}, pk='u1')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_neighbors_clamps_radius(self):
+        index = mock.MagicMock()
+        index.__contains__.return_value = True
+        index.rank.return_value = 1
+        index.around.return_value = []
+        with mock.patch('octofit_tracker.views.get_rank_index', return_value=index), \
+                mock.patch('octofit_tracker.views.get_db'):
+            for radius, expected in (('-3', 0), ('500', 100)):
+                response = self.get(
+                    LeaderboardViewSet, 'neighbors', '/api/leaderboard/u1/neighbors/', {'radius': radius}, pk='u1'
+                )
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                index.around.assert_called_with('u1', expected)
+    
+    def test_team_standings_reject_a_non_integer_limit(self):
+        response = self.get(LeaderboardViewSet, 'teams', '/api/leaderboard/teams/', {'limit': 'abc'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_team_standings_clamp_limit(self):
+        with mock.patch.object(leaderboard, 'team_standings', return_value=[]) as team_standings:
+            for params, expected in (({}, None), ({'limit': '0'}, 1), ({'limit': '-2'}, 1), ({'limit': '5000'}, 1000)):
+                response = self.get(LeaderboardViewSet, 'teams', '/api/leaderboard/teams/', params)
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertEqual(team_standings.call_args.kwargs['limit'], expected)
+    
+    def test_recommend_rejects_a_non_integer_limit(self):
+        response = self.get(WorkoutViewSet, 'recommend', '/api/workouts/recommend/', {'user_id': 'u1', 'limit': 'abc'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    
+    def test_recommend_clamps_limit(self):
+        with mock.patch.object(recommendations, 'recommended_workout_ids', return_value=[]) as recommended:
+            for limit, expected in (('0', 1), ('-1', 1), ('99', recommendations.TOP_N)):
+                response = self.get(
+                    WorkoutViewSet, 'recommend', '/api/workouts/recommend/', {'user_id': 'u1', 'limit': limit}
+                )
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                self.assertEqual(recommended.call_args.kwargs['limit'], expected)
+    
+    def test_top_rejects_a_non_integer_limit(self):
+        response = self.get(LeaderboardViewSet, 'top', '/api/leaderboard/top/', {'limit': 'abc'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+class RankIndexTestCase(SimpleTestCase):
+    def setUp(self):
+        self.index = RankIndex([('a', 100), ('b', 300), ('c', 200), ('d', 50)])
+    
+    def test_rank_orders_by_score_descending(self):
+        self.assertEqual([self.index.rank(u) for u in 'abcd'], [3, 1, 2, 4])
+        self.assertIsNone(self.index.rank('missing'))
+    
+    def test_update_moves_user(self):
+        self.index.update('d', 1000)
+        self.index.update('e', 150)
+        self.assertEqual([user_id for _, user_id, _ in self.index.top(10)], ['d', 'b', 'c', 'e', 'a'])
+    
+    def test_around(self):
+        self.index.discard('b')
+        self.assertEqual(self.index.around('a', radius=1), [(1, 'c', 200), (2, 'a', 100), (3, 'd', 50)])
+
+
+class KeysetPaginationTestCase(SimpleTestCase):
+    def setUp(self):
+        self.paginator = KeysetPagination()
+        self.ordering = ('-date', '-_id')
+    
+    def request(self, **params):
+        return Request(APIRequestFactory().get('/api/activities/', params))
+    
+    def test_cursor_round_trip(self):
+        cursor = self.paginator.encode_cursor(['2026-02-04', 'abc'])
+        position = self.paginator.decode_cursor(self.request(cursor=cursor), self.ordering)
+        self.assertEqual(position, ['2026-02-04', 'abc'])
+    
+    def test_invalid_cursor(self):
+        with self.assertRaises(NotFound):
+            self.paginator.decode_cursor(self.request(cursor='not-a-cursor'), self.ordering)
+    
+    def test_page_size_is_bounded(self):
+        self.assertEqual(self.paginator.get_page_size(self.request(page_size=10 ** 6)), self.paginator.max_page_size)
+    
+    def test_collection_cursor_continues_past_mixed_type_ids(self):
+        view = mock.Mock(cursor_ordering=('_id',))
+        query, sort = self.paginator.collection_query(self.request(cursor=self.paginator.encode_cursor([7])), view)
+        self.assertEqual(sort, [('_id', 1)])
+        later = ['string', 'object', 'array', 'binData', 'objectId', 'bool', 'date', 'timestamp', 'regex']
+        self.assertEqual(query, {'$or': [{'$or': [{'_id': {'$gt': 7}}, {'_id': {'$type': later}}]}]})
+        view.cursor_ordering = ('-_id',)
+        query, _ = self.paginator.collection_query(self.request(cursor=self.paginator.encode_cursor(['abc'])), view)
+        self.assertEqual(query, {'$or': [{'$or': [{'_id': {'$lt': 'abc'}}, {'_id': {'$type': ['null', 'number']}}]}]})
+
+
+class StreamingExportTestCase(SimpleTestCase):
+    rows = [
+        {'_id': ObjectId('65c0f1f1f1f1f1f1f1f1f1f1'), 'date': datetime.date(2026, 2, 4), 'calories_burned': 300},
+        {'_id': 'abc', 'date': datetime.date(2026, 2, 3), 'calories_burned': 150},
+    ]
+    
+    def test_json_array_chunks(self):
+        body = b''.join(streaming._json_array_chunks(iter(self.rows), batch_size=1))
+        data = json.loads(body)
+        self.assertEqual(data[0], {'_id': '65c0f1f1f1f1f1f1f1f1f1f1', 'date': '2026-02-04', 'calories_burned': 300})
+        self.assertEqual(len(data), 2)
+    
+    def test_empty_json_array(self):
+        self.assertEqual(b''.join(streaming._json_array_chunks(iter([]), batch_size=10)), b'[]')
+    
+    def test_ndjson_renderer_unwraps_pages(self):
+        body = NDJSONRenderer().render({'next': None, 'results': [{'a': 1}, {'a': 2}]})
+        self.assertEqual(body, b'{"a":1}\n{"a":2}\n')
+
+
+class RowSerializerTestCase(SimpleTestCase):
+    fields = ['_id', 'user_id', 'activity_type', 'duration', 'distance', 'calories_burned', 'date', 'notes', 'created_at']
+    
+    def make_rows(self, count):
+        created_at = timezone.now()
+        return [{
+            '_id': str(ObjectId()),
+            'user_id': f'user{i % 50}',
+            'activity_type': 'Running',
+            'duration': 30 + i % 60,
+            'distance': None if i % 7 == 0 else 5.5,
+            'calories_burned': 300 + i,
+            'date': datetime.date(2026, 1, 1) + datetime.timedelta(days=i % 365),
+            'notes': 'Morning run',
+            'created_at': created_at,
+        } for i in range(count)]
+    
+    def test_matches_model_serializer(self):
+        rows = self.make_rows(20)
+        expected = ActivitySerializer([Activity(**row) for row in rows], many=True).data
+        self.assertEqual(RowSerializer(ActivitySerializer).serialize(rows), [dict(item) for item in expected])
+    
+    def test_raw_documents_and_write_only_fields(self):
+        row = {'_id': ObjectId('65c0f1f1f1f1f1f1f1f1f1f1'), 'user_id': 7, 'total_calories': 900,
+               'updated_at': datetime.datetime(2026, 2, 4, 12, 30)}
+        data = RowSerializer(LeaderboardSerializer).to_representation(row)
+        self.assertEqual(data['_id'], '65c0f1f1f1f1f1f1f1f1f1f1')
+        self.assertEqual(data['user_id'], '7')
+        self.assertEqual(data['updated_at'], '2026-02-04T12:30:00Z')
+        self.assertIsNone(data['rank'])
+        self.assertNotIn('password', RowSerializer(UserSerializer).fields)
+    
+    def test_orjson_renderer_matches_json_renderer(self):
+        data = {'next': None, 'results': RowSerializer(ActivitySerializer).serialize(self.make_rows(3))}
+        self.assertEqual(json.loads(ORJSONRenderer().render(data)), json.loads(JSONRenderer().render(data)))
+    
+    def test_fast_path_renders_the_same_json(self):
+        # Throughput is measured by `manage.py bench_api_payloads --serialization`
+        rows = self.make_rows(500)
+        instances = [Activity(**row) for row in rows]
+        drf = JSONRenderer().render(ActivitySerializer(instances, many=True).data)
+        fast = ORJSONRenderer().render(RowSerializer(ActivitySerializer).serialize(rows))
+        self.assertEqual(json.loads(fast), json.loads(drf))
+
+
+class FieldProjectionTestCase(SimpleTestCase):
+    available = ['_id', 'user_id', 'activity_type', 'notes', 'date']
+    
+    def request(self, query):
+        return Request(APIRequestFactory().get('/api/activities/', query))
+    
+    def test_no_parameters_means_no_projection(self):
+        self.assertIsNone(projection.requested_fields(self.request({}), self.available))
+    
+    def test_fields_keep_declared_order(self):
+        fields = projection.requested_fields(self.request({'fields': 'date, _id'}), self.available)
+        self.assertEqual(fields, ['_id', 'date'])
+    
+    def test_exclude(self):
+        fields = projection.requested_fields(self.request({'exclude': 'notes'}), self.available)
+        self.assertEqual(fields, ['_id', 'user_id', 'activity_type', 'date'])
+    
+    def test_unknown_field_is_rejected(self):
+        with self.assertRaises(ParseError):
+            projection.requested_fields(self.request({'fields': 'password'}), self.available)
+    
+    def test_mongo_projection_adds_query_fields(self):
+        self.assertEqual(projection.mongo_projection(['username'], 'user_id'), {'username': 1, 'user_id': 1, '_id': 0})
+        self.assertEqual(projection.mongo_projection(['_id']), {'_id': 1})
+    
+    def test_row_serializer_subset(self):
+        row = {'_id': 'a1', 'user_id': 'u1', 'notes': 'long text', 'duration': 30}
+        data = RowSerializer(ActivitySerializer).serialize([row], ['_id', 'duration'])
+        self.assertEqual(data, [{'_id': 'a1', 'duration': 30}])
+
+
+class IndexDiffTestCase(SimpleTestCase):
+    def test_diff_reports_missing_and_undeclared(self):
+        collection = mock.Mock()
+        collection.index_information.return_value = {
+            '_id_': {'key': [('_id', 1)]},
+            'user_id_1_date_-1__id_-1': {'key': [('user_id', 1), ('date', -1), ('_id', -1)]},
+            'notes_1': {'key': [('notes', 1)]},
+        }
+        missing, extra = indexes.diff_indexes(collection, indexes.DECLARED_INDEXES['activities'])
+        self.assertEqual([model.document['name'] for model in missing], ['type_key_date_id', 'date_id'])
+        self.assertEqual(extra, ['notes_1'])
+    
+    def test_hot_queries_follow_the_view_filters_and_orderings(self):
+        queries = {query['name']: query for query in indexes.hot_queries()}
+        self.assertEqual(queries['ActivityViewSet.by_type']['filter'], {'type_key': 'running'})
+        self.assertEqual(queries['ActivityViewSet.by_user']['sort'], [('date', -1), ('_id', -1)])
+        self.assertEqual(
+            queries['WorkoutViewSet.by_difficulty']['filter'],
+            {'difficulty_level': {'$regex': '^beginner$', '$options': 'i'}}
+        )
+    
+    def test_keyset_queries_have_an_index_covering_filter_and_sort(self):
+        declared = {tuple(model.document['key'].items()) for model in indexes.DECLARED_INDEXES['activities']}
+        queries = {query['name']: query for query in indexes.hot_queries()}
+        for name in ('ActivityViewSet.by_user', 'ActivityViewSet.by_type'):
+            query = queries[name]
+            keys = tuple([(field, 1) for field in query['filter']] + query['sort'])
+            self.assertIn(keys, declared, name)
+
+
+class SearchKeyTestCase(SimpleTestCase):
+    def test_normalize_strips_case_and_accents(self):
+        self.assertEqual(search.normalize('  Zoë '), 'zoe')
+    
+    def test_ngrams(self):
+        self.assertEqual(search.ngrams('batman'), ['atm', 'bat', 'man', 'tma'])
+        self.assertEqual(search.ngrams('ab'), [])
+    
+    def test_canonical_activity_type_uses_exact_match(self):
+        self.assertEqual(
+            search.activity_type_filter('running'),
+            {'activity_type__in': ['RUNNING', 'Running', 'running']}
+        )
+        self.assertEqual(search.activity_type_filter('run'), {'activity_type__icontains': 'run'})
+    
+    def test_canonical_activity_type_matches_the_normalized_key(self):
+        self.assertEqual(search.activity_type_filter(' RUNNING', key_field='type_key'), {'type_key': 'running'})
+        self.assertEqual(
+            search.activity_type_filter('run', key_field='type_key'), {'activity_type__icontains': 'run'}
+        )
+
+
+class BulkIngestValidationTestCase(SimpleTestCase):
+    def test_valid_item(self):
+        document, errors = ingest.validate_item({
+            'user_id': 'u1', 'activity_type': 'Running', 'duration': '30',
+            'calories_burned': 300, 'date': '2026-02-04', 'distance': '5.5'
+        }, now=None)
+        self.assertIsNone(errors)
+        self.assertEqual(document['duration'], 30)
+        self.assertEqual(document['distance'], 5.5)
+        self.assertEqual(document['date'], datetime.datetime(2026, 2, 4))
+    
+    def test_invalid_item(self):
+        document, errors = ingest.validate_item({'user_id': 'u1', 'duration': -5, 'date': 'yesterday'}, now=None)
+        self.assertIsNone(document)
+        self.assertEqual(set(errors), {'activity_type', 'calories_burned', 'duration', 'date'})
+    
+    def test_out_of_range_numbers_are_invalid(self):
+        item = {'user_id': 'u1', 'activity_type': 'Running', 'date': '2026-02-04'}
+        for duration, calories, distance in ((1e400, 2 ** 63, 'inf'), (float('nan'), '1e400', float('-inf'))):
+            document, errors = ingest.validate_item(
+                dict(item, duration=duration, calories_burned=calories, distance=distance), now=None)
+            self.assertIsNone(document)
+            self.assertEqual(set(errors), {'calories_burned', 'duration', 'distance'})
+        document, errors = ingest.validate_item(dict(item, duration=ingest.MAX_INT, calories_burned=0), now=None)
+        self.assertEqual(document['duration'], ingest.MAX_INT)
+    
+    def test_ndjson_parser(self):
+        stream = [b'{"a": 1}\n', b'\n', b'{"a": 2}\n']
+        self.assertEqual(NDJSONParser().parse(stream), [{'a': 1}, {'a': 2}])
+
+
+class CachedResponseTestCase(SimpleTestCase):
+    class View:
+        calls = 0
+        
+        @cache.cached_response('workouts')
+        def list(self, request):
+            self.calls += 1
+            return Response([{'name': 'Morning Cardio'}])
+    
+    def setUp(self):
+        self.view = self.View()
+        self.factory = APIRequestFactory()
+        cache.bump('workouts')
+    
+    def test_read_through_and_invalidation(self):
+        first = self.view.list(Request(self.factory.get('/api/workouts/')))
+        self.view.list(Request(self.factory.get('/api/workouts/')))
+        self.assertEqual(self.view.calls, 1)
+        cache.bump('workouts')
+        second = self.view.list(Request(self.factory.get('/api/workouts/')))
+        self.assertEqual(self.view.calls, 2)
+        self.assertNotEqual(first['ETag'], second['ETag'])
+    
+    def test_if_none_match_returns_304(self):
+        etag = self.view.list(Request(self.factory.get('/api/workouts/')))['ETag']
+        response = self.view.list(Request(self.factory.get('/api/workouts/', HTTP_IF_NONE_MATCH=etag)))
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(self.view.calls, 1)
+    
+    def test_compressed_etag_revalidates(self):
+        etag = self.view.list(Request(self.factory.get('/api/workouts/')))['ETag']
+        compressed = etag[:-1] + '-gzip"'
+        response = self.view.list(Request(self.factory.get('/api/workouts/', HTTP_IF_NONE_MATCH=compressed)))
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+    
+    def test_per_process_cache_is_refused_outside_debug(self):
+        redis = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://'}}
+        with override_settings(DEBUG=False, CACHE_SINGLE_PROCESS=False):
+            with self.assertRaises(ImproperlyConfigured):
+                cache.check_backend()
+            with override_settings(CACHES=redis):
+                cache.check_backend()
+            with override_settings(CACHE_SINGLE_PROCESS=True):
+                cache.check_backend()
+        with override_settings(DEBUG=True):
+            cache.check_backend()
+
+
+class CompressionMiddlewareTestCase(SimpleTestCase):
+    def compress(self, body, accept='gzip', etag=None):
+        response = HttpResponse(body, content_type='application/json')
+        if etag:
+            response['ETag'] = etag
+        request = RequestFactory().get('/api/activities/', HTTP_ACCEPT_ENCODING=accept)
+        return middleware.CompressionMiddleware(lambda request: response)(request)
+    
+    def test_gzip_above_threshold_keeps_strong_etag(self):
+        body = json.dumps([{'activity_type': 'Running', 'duration': 30}] * 200)
+        response = self.compress(body, etag='"abc"')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.content).decode(), body)
+        self.assertEqual(response['ETag'], '"abc-gzip"')
+        self.assertIn('Accept-Encoding', response['Vary'])
+    
+    def test_small_bodies_are_not_compressed(self):
+        response = self.compress('{"ok": true}')
+        self.assertFalse(response.has_header('Content-Encoding'))
+    
+    def test_async_chain_is_awaited_and_compressed(self):
+        body = json.dumps([{'activity_type': 'Running', 'duration': 30}] * 200)
+        
+        async def view(request):
+            return HttpResponse(body, content_type='application/json')
+        
+        compression = middleware.CompressionMiddleware(view)
+        self.assertTrue(asyncio.iscoroutinefunction(compression))
+        response = asyncio.run(compression(RequestFactory().get('/api/async/teams/', HTTP_ACCEPT_ENCODING='gzip')))
+        self.assertEqual(gzip.decompress(response.content).decode(), body)
+    
+    def test_accept_encoding_quality(self):
+        self.assertEqual(middleware.accepted_encodings('gzip;q=0, br, deflate;q=0.5'), ['br', 'deflate'])
+        with mock.patch.object(middleware, 'brotli', None):
+            self.assertEqual(middleware.choose_encoding('br, gzip'), 'gzip')
+            self.assertIsNone(middleware.choose_encoding('br'))
+
+
+@override_settings(PROFILING_ENABLED=True, PROFILING_SAMPLE_INTERVAL_MS=0, PROFILING_N_PLUS_ONE_THRESHOLD=3)
+class ProfilingMiddlewareTestCase(SimpleTestCase):
+    def command(self, request_id, name, command, micros=1500):
+        event = mock.Mock(request_id=request_id, command_name=name, command=command, duration_micros=micros)
+        profiling.command_listener.started(event)
+        profiling.command_listener.succeeded(event)
+    
+    def test_command_shape(self):
+        self.assertEqual(profiling.command_shape('find', {'find': 'teams', 'filter': {'_id': 1}}), 'find teams(_id)')
+        self.assertEqual(
+            profiling.command_shape('update', {'update': 'users', 'updates': [{'q': {'team_id': '1', '_id': 'a'}}]}),
+            'update users(_id,team_id)'
+        )
+        self.assertEqual(
+            profiling.command_shape('aggregate', {'aggregate': 'activities', 'pipeline': [{'$match': {'user_id': 'a'}}]}),
+            'aggregate activities(user_id)'
+        )
+    
+    def test_server_timing_and_n_plus_one(self):
+        def view(request):
+            for i in range(4):
+                self.command(i, 'find', {'find': 'teams', 'filter': {'_id': i}})
+            self.command(9, 'getMore', {'getMore': 1, 'collection': 'teams'})
+            with profiling.section('serialize'):
+                pass
+            return HttpResponse('{}', content_type='application/json')
+        
+        with self.assertLogs('octofit_tracker.profiling', 'WARNING') as logs:
+            response = profiling.ProfilingMiddleware(view)(RequestFactory().get('/api/leaderboard/'))
+        timing = response['Server-Timing']
+        self.assertIn('mongo;dur=7.5;desc="5 commands"', timing)
+        self.assertIn('serialize;dur=', timing)
+        self.assertIn('nplusone;desc="find teams(_id) x4"', timing)
+        self.assertIn('find teams(_id) issued 4 times', logs.output[0])
+        # Outside a request the listener records nothing
+        self.command(10, 'find', {'find': 'teams'})
+        self.assertIsNone(profiling.current_profile())
+    
+    def test_concurrent_async_requests_keep_their_own_profiles(self):
+        async def view(request):
+            count = int(request.GET['n'])
+            for i in range(count):
+                self.command(f'{request.GET["n"]}-{i}', 'find', {'find': 'teams', 'filter': {'_id': i}})
+                # Interleave the two requests on the one event loop thread
+                await asyncio.sleep(0)
+            return HttpResponse('{}', content_type='application/json')
+        
+        profiler = profiling.ProfilingMiddleware(view)
+        self.assertTrue(asyncio.iscoroutinefunction(profiler))
+        
+        async def both():
+            factory = RequestFactory()
+            return await asyncio.gather(profiler(factory.get('/api/async/teams/', {'n': 1})),
+                                        profiler(factory.get('/api/async/teams/', {'n': 2})))
+        
+        first, second = asyncio.run(both())
+        self.assertIn('desc="1 commands"', first['Server-Timing'])
+        self.assertIn('desc="2 commands"', second['Server-Timing'])
+    
+    def test_slow_request_dumps_sampled_stacks(self):
+        def slow_view(request):
+            time.sleep(0.05)
+            return HttpResponse('{}', content_type='application/json')
+        
+        with tempfile.TemporaryDirectory() as directory:
+            with override_settings(PROFILING_SLOW_MS=10, PROFILING_SAMPLE_INTERVAL_MS=1, PROFILING_DUMP_DIR=directory):
+                profiling.ProfilingMiddleware(slow_view)(RequestFactory().get('/api/activities/'))
+            [name] = os.listdir(directory)
+            self.assertIn('GET-api-activities', name)
+            with open(os.path.join(directory, name)) as f:
+                self.assertIn('slow_view', f.read())
+
+
+class MetricsTestCase(SimpleTestCase):
+    def test_text_exposition(self):
+        registry = metrics.Registry()
+        requests = registry.counter('test_requests_total', 'Requests', ('endpoint',))
+        latency = registry.histogram('test_latency_seconds', 'Latency', buckets=(0.1, 1.0))
+        requests.inc('user-list')
+        requests.inc('user-list')
+        latency.observe(0.05)
+        latency.observe(0.1)
+        latency.observe(3)
+        text = metrics.render(registry.collect())
+        self.assertIn('# TYPE test_requests_total counter', text)
+        self.assertIn('test_requests_total{endpoint="user-list"} 2', text)
+        self.assertIn('test_latency_seconds_bucket{le="0.1"} 2', text)
+        self.assertIn('test_latency_seconds_bucket{le="1.0"} 2', text)
+        self.assertIn('test_latency_seconds_bucket{le="+Inf"} 3', text)
+        self.assertIn('test_latency_seconds_count 3', text)
+    
+    def test_merge_keeps_exited_workers_counters_but_not_gauges(self):
+        def snapshot(requests, connections):
+            return {
+                'requests_total': {'type': 'counter', 'help': '', 'samples': [[{'status': '200'}, requests]]},
+                'connections': {'type': 'gauge', 'help': '', 'samples': [[{}, connections]]},
+            }
+        merged = metrics.merge([(True, snapshot(3, 4)), (False, snapshot(5, 9))])
+        self.assertEqual(merged['requests_total']['samples'], [({'status': '200'}, 8)])
+        self.assertEqual(merged['connections']['samples'], [({}, 4)])
+    
+    def test_middleware_labels_by_url_name_across_workers(self):
+        def view(request):
+            request.resolver_match = mock.Mock(view_name='team-detail')
+            return HttpResponse('{}', content_type='application/json', status=404)
+        
+        with tempfile.TemporaryDirectory() as directory, override_settings(METRICS_MULTIPROC_DIR=directory):
+            # Another worker's snapshot
+            with open(os.path.join(directory, 'metrics-999999999.json'), 'w') as f:
+                json.dump({'octofit_http_requests_total': {'type': 'counter', 'help': '', 'samples': [
+                    [{'endpoint': 'team-detail', 'method': 'GET', 'status': '404'}, 10],
+                ]}}, f)
+            before = metrics.http_requests.get('team-detail', 'GET', '404')
+            metrics.MetricsMiddleware(view)(RequestFactory().get('/api/teams/7/'))
+            text = metrics.render(metrics.gather())
+        self.assertIn(f'octofit_http_requests_total{{endpoint="team-detail",method="GET",status="404"}} {before + 11}', text)
+        self.assertIn('octofit_mongo_pool_max_size', text)
+        self.assertIn('octofit_response_cache_total{outcome="hits"}', text)
+    
+    def test_middleware_stays_async_under_asgi(self):
+        async def view(request):
+            request.resolver_match = mock.Mock(view_name='async-team-list')
+            return HttpResponse('[]', content_type='application/json')
+        
+        middleware = metrics.MetricsMiddleware(view)
+        self.assertTrue(asyncio.iscoroutinefunction(middleware))
+        before = metrics.http_requests.get('async-team-list', 'GET', '200')
+        response = asyncio.run(middleware(RequestFactory().get('/api/async/teams/')))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(metrics.http_requests.get('async-team-list', 'GET', '200'), before + 1)
+    
+    def test_team_view_failures_are_counted(self):
+        before = metrics.view_errors.get('TeamViewSet', 'list', 'RuntimeError')
+        view = TeamViewSet.as_view({'get': 'list'})
+        with mock.patch.object(TeamViewSet, 'get_mongo_connection', side_effect=RuntimeError('down')):
+            response = view(APIRequestFactory().get('/api/teams/'))
+        self.assertEqual(response.status_code, status.HTTP_500_INTERNAL_SERVER_ERROR)
+        self.assertEqual(metrics.view_errors.get('TeamViewSet', 'list', 'RuntimeError'), before + 1)
+
+
+class SyntheticDataTestCase(SimpleTestCase):
+    options = {
+        'seed': 7, 'activities_per_user': 10, 'team_count': 3, 'first_team_id': 3, 'days': 90, 'batch_size': 16,
+    }
+    
+    def write(self, chunk, start, stop):
+        db = mock.MagicMock()
+        with mock.patch.object(synthetic, 'get_db', return_value=db):
+            counts = synthetic.write_chunk(chunk, start, stop, self.options)
+        inserted = {}
+        for name in ('users', 'activities', 'leaderboard'):
+            inserted[name] = [
+                {key: value for key, value in document.items() if key not in ('created_at', 'updated_at')}
+                for call in getattr(db, name).insert_many.call_args_list
+                for document in call.args[0]
+            ]
+        return counts, inserted
+    
+    def test_chunks_are_reproducible_and_batched(self):
+        counts, first = self.write(2, 20, 30)
+        _, second = self.write(2, 20, 30)
+        self.assertEqual(first, second)
+        self.assertEqual(counts, (10, len(first['activities'])))
+        self.assertEqual([user['_id'] for user in first['users']], [synthetic.user_id(i) for i in range(20, 30)])
+        _, other_seed = self.write(3, 20, 30)
+        self.assertNotEqual(first['activities'], other_seed['activities'])
+    
+    def test_leaderboard_rows_match_generated_activities(self):
+        _, inserted = self.write(0, 0, 5)
+        for row in inserted['leaderboard']:
+            activities = [a for a in inserted['activities'] if a['user_id'] == row['user_id']]
+            self.assertEqual(row['total_activities'], len(activities))
+            self.assertEqual(row['total_calories'], sum(a['calories_burned'] for a in activities))
+            self.assertTrue(5 <= row['total_activities'] <= 15)
+    
+    def test_team_members_follow_user_assignment(self):
+        _, inserted = self.write(0, 0, 7)
+        teams = {team['_id']: team for team in synthetic.team_documents(7, 3, 3)}
+        for user in inserted['users']:
+            self.assertIn(user['_id'], teams[int(user['team_id'])]['members'])
+        self.assertEqual(sum(len(team['members']) for team in teams.values()), 7)
+
+
+class RecommendationScoringTestCase(SimpleTestCase):
+    workouts = [
+        {'_id': 'w1', 'activity_type': 'Running', 'difficulty_level': 'beginner', 'estimated_duration': 20},
+        {'_id': 'w2', 'activity_type': 'Running', 'difficulty_level': 'advanced', 'estimated_duration': 75},
+        {'_id': 'w3', 'activity_type': 'Yoga', 'difficulty_level': 'beginner', 'estimated_duration': 30},
+    ]
+    
+    def test_new_user_gets_beginner_workouts_first(self):
+        self.assertEqual(recommendations.score_workouts(None, self.workouts)[:2], ['w3', 'w1'])
+    
+    def test_affinity_and_progression(self):
+        recent = [{'duration': d, 'calories': 500} for d in (60, 65, 80, 90)]
+        profile = {'type_counts': {'running': 4, 'yoga': 1}, 'recent': recent}
+        self.assertEqual(recommendations.target_level(recent), 2)
+        self.assertEqual(recommendations.score_workouts(profile, self.workouts)[0], 'w2')
+    
+    def test_type_key_is_a_valid_field_name(self):
+        self.assertEqual(recommendations.type_key('H.I.I.T'), 'h_i_i_t')
+        self.assertEqual(recommendations.type_key(''), 'other')
+    
+    def activity(self, activity_id, user_id, activity_type, day):
+        return {'_id': activity_id, 'user_id': user_id, 'activity_type': activity_type, 'duration': 30,
+                'calories_burned': 200, 'date': datetime.datetime(2024, 5, day)}
+    
+    def test_record_activities_writes_each_user_once(self):
+        db = mock.MagicMock()
+        with mock.patch.object(recommendations, 'get_db', return_value=db):
+            recommendations.record_activities([
+                self.activity('a1', 'u1', 'Running', 1), self.activity('a2', 'u2', 'Yoga', 1),
+                self.activity('a3', 'u1', 'running', 2),
+            ])
+        db[recommendations.PROFILES].bulk_write.assert_called_once()
+        operations = db[recommendations.PROFILES].bulk_write.call_args.args[0]
+        self.assertEqual([operation._filter for operation in operations], [{'_id': 'u1'}, {'_id': 'u2'}])
+        self.assertEqual(operations[0]._doc['$inc'], {'total': 2, 'type_counts.running': 2})
+        self.assertEqual(len(operations[0]._doc['$push']['recent']['$each']), 2)
+    
+    def test_rebuild_sums_type_counts_and_reads_recent_sessions_per_batch(self):
+        db = mock.MagicMock()
+        db.activities.aggregate.return_value = iter([
+            {'_id': {'user_id': 'u1', 'activity_type': 'Running'}, 'count': 3},
+            {'_id': {'user_id': 'u1', 'activity_type': 'running'}, 'count': 2},
+            {'_id': {'user_id': 'u2', 'activity_type': 'Yoga'}, 'count': 1},
+        ])
+        db.activities.find.return_value.sort.return_value = [
+            self.activity(f'a{day}', 'u1', 'Running', day) for day in range(15, 0, -1)
+        ] + [self.activity('b1', 'u2', 'Yoga', 1)]
+        with mock.patch.object(recommendations, 'get_db', return_value=db), \
+                mock.patch.object(recommendations.catalog, 'get', return_value=(1, self.workouts)):
+            self.assertEqual(recommendations.rebuild(batch_size=10), 2)
+        pipeline = db.activities.aggregate.call_args.args[0]
+        self.assertNotIn('$push', str(pipeline))
+        # PROFILES then RECOMMENDATIONS on the same mock collection
+        profiles = {
+            operation._filter['_id']: operation._doc['$set']
+            for operation in db[recommendations.PROFILES].bulk_write.call_args_list[0].args[0]
+        }
+        self.assertEqual(profiles['u1']['type_counts'], {'running': 5})
+        self.assertEqual(profiles['u1']['total'], 5)
+        recent = profiles['u1']['recent']
+        self.assertEqual(len(recent), recommendations.RECENT_SESSIONS)
+        self.assertEqual([session['activity_id'] for session in recent[-2:]], ['a14', 'a15'])
+        self.assertEqual(profiles['u2']['total'], 1)
+
+
+class RollupBucketTestCase(SimpleTestCase):
+    def test_period_start(self):
+        day = datetime.datetime(2024, 5, 16)  # a Thursday
+        self.assertEqual(rollups.period_start(day, 'day'), day)
+        self.assertEqual(rollups.period_start(day, 'week'), datetime.datetime(2024, 5, 13))
+        self.assertEqual(rollups.period_start(day, 'month'), datetime.datetime(2024, 5, 1))
+    
+    def test_to_day_accepts_dates_and_strings(self):
+        expected = datetime.datetime(2024, 5, 16)
+        self.assertEqual(rollups.to_day('2024-05-16'), expected)
+        self.assertEqual(rollups.to_day(datetime.date(2024, 5, 16)), expected)
+        self.assertEqual(rollups.to_day(datetime.datetime(2024, 5, 16, 18, 30)), expected)
+    
+    def test_activity_increments(self):
+        activity = {'activity_type': 'Running', 'calories_burned': 300, 'duration': 30, 'distance': 5.0}
+        fields = rollups.activity_increments(activity, sign=-1)
+        self.assertEqual(fields['count'], -1)
+        self.assertEqual(fields['calories'], -300)
+        self.assertEqual(fields['by_type.running.distance'], -5.0)
+    
+    def test_stats_folds_daily_buckets_into_weeks(self):
+        buckets = [
+            {'date': datetime.datetime(2024, 5, 13), 'count': 1, 'calories': 100, 'duration': 10, 'distance': 1,
+             'by_type': {'running': {'count': 1, 'calories': 100, 'duration': 10, 'distance': 1}}},
+            {'date': datetime.datetime(2024, 5, 19), 'count': 2, 'calories': 200, 'duration': 20, 'distance': 0,
+             'by_type': {'yoga': {'count': 2, 'calories': 200, 'duration': 20, 'distance': 0},
+                         'running': {'count': 0, 'calories': 0, 'duration': 0, 'distance': 0}}},
+            {'date': datetime.datetime(2024, 5, 20), 'count': 1, 'calories': 50, 'duration': 5, 'distance': 0,
+             'by_type': {}},
+        ]
+        collection = mock.MagicMock()
+        collection.find.return_value.sort.return_value = buckets
+        with mock.patch.object(rollups, 'get_db', return_value={rollups.ROLLUPS: collection}):
+            periods = rollups.stats('user', 'u1', 'week', '2024-05-01', '2024-05-31')
+        self.assertEqual([p['period_start'] for p in periods], ['2024-05-13', '2024-05-20'])
+        self.assertEqual(periods[0]['count'], 3)
+        self.assertEqual(periods[0]['calories'], 300)
+        self.assertEqual(periods[0]['by_type']['running']['count'], 1)
+    
+    def test_team_buckets_use_the_team_recorded_on_the_activity(self):
+        db = mock.MagicMock()
+        db.users.find.return_value = [{'_id': 'u2', 'team_id': 2}]
+        activities = [
+            {'user_id': 'u1', 'team_id': '1', 'date': '2024-05-16', 'activity_type': 'Running', 'calories_burned': 300},
+            {'user_id': 'u3', 'team_id': '', 'date': '2024-05-16', 'activity_type': 'Yoga', 'calories_burned': 100},
+            {'user_id': 'u2', 'date': '2024-05-16', 'activity_type': 'Yoga', 'calories_burned': 100},
+        ]
+        with mock.patch.object(rollups, 'get_db', return_value=db):
+            rollups.apply_activities(activities, sign=-1)
+        self.assertEqual(db.users.find.call_args.args[0], {'_id': {'$in': ['u2']}})
+        operations = db[rollups.ROLLUPS].bulk_write.call_args.args[0]
+        self.assertEqual(sorted(op._filter['_id'] for op in operations), [
+            'team:1:2024-05-16', 'team:2:2024-05-16', 'user:u1:2024-05-16', 'user:u2:2024-05-16', 'user:u3:2024-05-16',
+        ])
+    
+    def test_rebuild_swaps_in_a_fully_built_collection(self):
+        collections = {rollups.ROLLUPS: mock.MagicMock(), rollups.REBUILD_COLLECTION: mock.MagicMock()}
+        db = mock.MagicMock()
+        db.__getitem__.side_effect = collections.__getitem__
+        db.users.find.return_value = []
+        db.activities.aggregate.return_value = [{
+            '_id': {'user_id': 'u1', 'team_id': '1', 'date': datetime.datetime(2024, 5, 16), 'activity_type': 'Yoga'},
+            'count': 1, 'calories': 100, 'duration': 30, 'distance': 0,
+        }]
+        with mock.patch.object(rollups, 'get_db', return_value=db):
+            self.assertEqual(rollups.rebuild(), 2)
+        live, target = collections[rollups.ROLLUPS], collections[rollups.REBUILD_COLLECTION]
+        self.assertEqual(live.mock_calls, [])
+        self.assertEqual(
+            [name for name, _, _ in target.mock_calls], ['drop', 'create_indexes', 'bulk_write', 'rename']
+        )
+        target.rename.assert_called_once_with(rollups.ROLLUPS, dropTarget=True)
+
+
+class AsyncTeamViewsTestCase(SimpleTestCase):
+    async def test_method_not_allowed(self):
+        response = await self.async_client.post('/api/async/teams/')
+        self.assertEqual(response.status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+        self.assertEqual(response['Allow'], 'GET')
+    
+    async def test_leaderboard_top_rejects_a_non_integer_limit(self):
+        response = await self.async_client.get('/api/async/leaderboard/top/', {'limit': 'abc'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+    
+    async def test_leaderboard_top_matches_the_sync_rank_order_and_fields(self):
+        index = RankIndex([('u2', 300), ('u1', 300), ('u3', 100)])
+        documents = [
+            {'_id': 'l3', 'user_id': 'u3', 'username': 'c', 'total_calories': 100},
+            {'_id': 'l2', 'user_id': 'u2', 'username': 'b', 'total_calories': 300},
+            {'_id': 'l1', 'user_id': 'u1', 'username': 'a', 'total_calories': 300},
+        ]
+        db = mock.MagicMock()
+        db.leaderboard.find.return_value.to_list = mock.AsyncMock(return_value=documents)
+        with mock.patch('octofit_tracker.async_views.get_rank_index', return_value=index), \
+                mock.patch('octofit_tracker.async_views.get_async_db', return_value=db):
+            response = await self.async_client.get(
+                '/api/async/leaderboard/top/', {'limit': '0', 'fields': 'user_id,total_calories,rank'}
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        # limit=0 is clamped to 1; ties are broken by user_id like RankIndex.top
+        self.assertEqual(response.json(), [{'user_id': 'u1', 'total_calories': 300, 'rank': 1}])
+        self.assertEqual(db.leaderboard.find.call_args.args[1], {'user_id': 1, 'total_calories': 1, 'rank': 1, '_id': 0})
@@ -20,9 +20,10 @@ from rest_framework import routers
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework.reverse import reverse
+from . import async_views, metrics
 from .views import (
     UserViewSet, TeamViewSet, ActivityViewSet,
-    LeaderboardViewSet, WorkoutViewSet
+    LeaderboardViewSet, WorkoutViewSet, batch_reads, health
 )
 
 # Get the base URL based on environment
@@ -53,6 +54,8 @@ def api_root(request, format=None):
         'activities': reverse('activity-list', request=request, format=format),
         'leaderboard': reverse('leaderboard-list', request=request, format=format),
         'workouts': reverse('workout-list', request=request, format=format),
+        'health': reverse('health', request=request, format=format),
+        'batch': reverse('batch', request=request, format=format),
         'admin': request.build_absolute_uri('/admin/'),
     })
 
@@ -60,7 +63,17 @@ def api_root(request, format=None):
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', api_root, name='api-root'),
+    path('api/health/', health, name='health'),
+    path('api/batch/', batch_reads, name='batch'),
+    # Prometheus scrape target
+    path('metrics', metrics.metrics_view, name='metrics'),
     path('api/', include(router.urls)),
+    # ASGI-native variants of the Mongo-backed team and leaderboard reads
+    path('api/async/teams/', async_views.team_list, name='async-team-list'),
+    path('api/async/teams/<int:pk>/', async_views.team_detail, name='async-team-detail'),
+    path('api/async/teams/<int:pk>/add_member/', async_views.team_add_member, name='async-team-add-member'),
+    path('api/async/teams/<int:pk>/remove_member/', async_views.team_remove_member, name='async-team-remove-member'),
+    path('api/async/leaderboard/top/', async_views.leaderboard_top, name='async-leaderboard-top'),
     path('', api_root, name='root'),
 ]
 
@@ -1,18 +1,139 @@
+import datetime
+
+from django.conf import settings
+from django.http import Http404
+from pymongo import ReturnDocument
 from rest_framework import viewsets, status
-from rest_framework.decorators import action
+from rest_framework.decorators import action, api_view
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 from .models import User, Team, Activity, Leaderboard, Workout
 from .serializers import (
     UserSerializer, TeamSerializer, ActivitySerializer, 
-    LeaderboardSerializer, WorkoutSerializer
+    LeaderboardSerializer, WorkoutSerializer, row_serializer
 )
-from pymongo import MongoClient
-from django.conf import settings
+from .mongo import get_db, health_check
+from . import leaderboard as leaderboard_stats
+from . import batch, ingest, jobs, membership, metrics, projection, recommendations, rollups, search
+from . import cache
+from .cache import cached_response, conditional_response
+from .pagination import bounded_int
+from .parsers import NDJSONParser
+from .ranking import MAX_TOP, get_rank_index, ranked_rows, record_score, forget
+from .renderers import JSONStreamRenderer, NDJSONRenderer
+from .streaming import STREAM_FORMATS, stream_queryset
+
+# Renderers for endpoints that support `?format=ndjson` / `?format=jsonstream` exports
+EXPORT_RENDERER_CLASSES = api_settings.DEFAULT_RENDERER_CLASSES + [NDJSONRenderer, JSONStreamRenderer]
+
+
+def rollup_stats_response(request, scope, owner_id):
+    """Serve `?granularity=day|week|month&from=YYYY-MM-DD&to=YYYY-MM-DD` from rollups"""
+    granularity = request.query_params.get('granularity', 'day')
+    if granularity not in rollups.GRANULARITIES:
+        return Response(
+            {'error': f'granularity must be one of {", ".join(rollups.GRANULARITIES)}'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    try:
+        end = rollups.to_day(request.query_params.get('to') or datetime.date.today())
+        start = rollups.to_day(request.query_params.get('from') or end - datetime.timedelta(days=364))
+    except ValueError:
+        return Response({'error': 'from and to must be YYYY-MM-DD dates'}, status=status.HTTP_400_BAD_REQUEST)
+    if start > end or (end - start).days > rollups.MAX_RANGE_DAYS:
+        return Response(
+            {'error': f'from must be before to and at most {rollups.MAX_RANGE_DAYS} days apart'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    return Response({
+        'granularity': granularity,
+        'from': start.date().isoformat(),
+        'to': end.date().isoformat(),
+        'periods': rollups.stats(scope, owner_id, granularity, start, end),
+    })
 
 
-class UserViewSet(viewsets.ModelViewSet):
+def stream_export(request, serializer_class, queryset):
+    """Return a streaming export response if the client asked for one"""
+    stream_format = getattr(request.accepted_renderer, 'format', None)
+    if stream_format not in STREAM_FORMATS:
+        return None
+    fields = projection.requested_fields(request, serializer_class.Meta.fields) or serializer_class.Meta.fields
+    return stream_queryset(queryset, fields, stream_format)
+
+
+class FastReadMixin:
+    """Serve list-style reads through the compiled RowSerializer
+
+    Rows come straight from ``values()`` as dicts and skip the
+    ModelSerializer. ``?fields=`` / ``?exclude=`` are pushed down into the
+    ``values()`` projection; writes are unchanged.
+    """
+    
+    def get_row_serializer(self):
+        return row_serializer(self.serializer_class)
+    
+    def get_output_fields(self):
+        """Fields selected with ?fields= / ?exclude= (all readable fields by default)"""
+        available = self.get_row_serializer().fields
+        return projection.requested_fields(self.request, available) or available
+    
+    def serialize_rows(self, queryset):
+        """Serialize a (non-paginated) queryset with the requested fields"""
+        rows = self.get_row_serializer()
+        fields = self.get_output_fields()
+        return rows.serialize(rows.values(queryset, fields), fields)
+    
+    def fast_paginated_response(self, queryset):
+        rows = self.get_row_serializer()
+        fields = self.get_output_fields()
+        # The keyset cursor is built from the ordering fields, so read them too
+        ordering = [field.lstrip('-') for field in self.paginator.get_ordering(self)]
+        page = self.paginate_queryset(rows.values(queryset, projection.with_fields(fields, *ordering)))
+        return self.get_paginated_response(rows.serialize(page, fields))
+    
+    def ids_response(self, ids):
+        """`?ids=a,b,c`: the rows for those ids from one `$in` query, in request order"""
+        rows = self.get_row_serializer()
+        fields = self.get_output_fields()
+        queryset = self.filter_queryset(self.get_queryset()).filter(_id__in=ids).order_by()
+        found = {row['_id']: row for row in rows.values(queryset, projection.with_fields(fields, '_id'))}
+        return Response({
+            'next': None,
+            'results': rows.serialize([found[id_] for id_ in ids if id_ in found], fields),
+            'missing': [id_ for id_ in ids if id_ not in found],
+        })
+    
+    def list(self, request, *args, **kwargs):
+        try:
+            ids = batch.requested_ids(request)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        if ids is not None:
+            return self.ids_response(ids)
+        return self.fast_paginated_response(self.filter_queryset(self.get_queryset()))
+    
+    def retrieve(self, request, *args, **kwargs):
+        if projection.requested_fields(request, self.get_row_serializer().fields) is None:
+            return super().retrieve(request, *args, **kwargs)
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        queryset = self.filter_queryset(self.get_queryset()).filter(
+            **{self.lookup_field: self.kwargs[lookup_url_kwarg]}
+        )
+        data = self.serialize_rows(queryset[:1])
+        if not data:
+            raise Http404
+        return Response(data[0])
+
+
+class UserViewSet(FastReadMixin, viewsets.ModelViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
+    cursor_ordering = ('_id',)
+    
+    @conditional_response('users')
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
     
     def update(self, request, *args, **kwargs):
         """Custom update method to handle partial updates and team changes"""
@@ -29,10 +150,15 @@ class UserViewSet(viewsets.ModelViewSet):
                     status=status.HTTP_400_BAD_REQUEST
                 )
         
+        old_team_id = instance.team_id
         serializer = self.get_serializer(instance, data=request.data, partial=partial)
         serializer.is_valid(raise_exception=True)
         self.perform_update(serializer)
         
+        # Keep Team.members and the leaderboard in step with User.team_id
+        if serializer.instance.team_id != old_team_id:
+            membership.change_team(serializer.instance._id, old_team_id, serializer.instance.team_id)
+        
         return Response(serializer.data)
     
     def partial_update(self, request, *args, **kwargs):
@@ -42,51 +168,90 @@ class UserViewSet(viewsets.ModelViewSet):
     
     @action(detail=False, methods=['get'])
     def by_username(self, request):
+        """Typeahead: usernames starting with, then containing, `username`"""
         username = request.query_params.get('username', None)
         if username:
-            users = User.objects.filter(username__icontains=username)
-            serializer = self.get_serializer(users, many=True)
-            return Response(serializer.data)
+            try:
+                limit = bounded_int(request.query_params, 'limit', 20, 1, search.MAX_RESULTS)
+            except ValueError:
+                return Response({'error': 'limit must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+            user_ids = search.search_user_ids(username, limit=limit)
+            fields = self.get_output_fields()
+            rows = User.objects.filter(_id__in=user_ids).values(*projection.with_fields(fields, '_id'))
+            users = {row['_id']: row for row in rows}
+            ordered = [users[user_id] for user_id in user_ids if user_id in users]
+            return Response({'next': None, 'results': self.get_row_serializer().serialize(ordered, fields)})
         return Response({'error': 'Username parameter required'}, status=status.HTTP_400_BAD_REQUEST)
+    
+    @action(detail=True, methods=['get'])
+    @conditional_response('activities')
+    def stats(self, request, pk=None):
+        """Activity totals per day, week or month from the daily rollups"""
+        user = self.get_object()
+        return rollup_stats_response(request, 'user', user._id)
 
 
 class TeamViewSet(viewsets.ModelViewSet):
     queryset = Team.objects.none()  # Empty queryset to avoid ORM issues
     serializer_class = TeamSerializer
+    cursor_ordering = ('_id',)
     
     def get_mongo_connection(self):
-        """Get MongoDB connection"""
-        client = MongoClient('localhost', 27017)
-        db = client['octofit_db']
-        return db
+        """Get the shared, pooled MongoDB database handle"""
+        return get_db()
+    
+    def failure_response(self, message, exc):
+        """500 response for an unexpected error, counted in /metrics"""
+        metrics.record_view_error(type(self).__name__, self.action, exc)
+        return Response(
+            {'error': f'{message}: {str(exc)}'}, 
+            status=status.HTTP_500_INTERNAL_SERVER_ERROR
+        )
+    
+    # TeamSerializer fields plus the computed member_count
+    team_fields = TeamSerializer.Meta.fields + ['member_count']
+    
+    def get_team_projection(self):
+        """(fields, Mongo projection) for ?fields= / ?exclude=, or (None, None)"""
+        fields = projection.requested_fields(self.request, self.team_fields)
+        if fields is None:
+            return None, None
+        stored = [field for field in fields if field != 'member_count']
+        extra = ['members'] if 'member_count' in fields else []
+        return fields, projection.mongo_projection(stored, '_id', *extra)
+    
+    def format_team(self, team, fields=None):
+        # Convert ObjectId to string and format data
+        team['_id'] = str(team['_id'])
+        # Ensure members is a list
+        if 'members' not in team:
+            team['members'] = []
+        # Add member_count
+        team['member_count'] = len(team['members'])
+        if fields is not None:
+            team = {field: team.get(field) for field in fields}
+        return team
     
+    @conditional_response('teams')
     def list(self, request):
         """Override list to fetch from MongoDB directly"""
+        fields, team_projection = self.get_team_projection()
         try:
             db = self.get_mongo_connection()
-            teams = list(db.teams.find())
+            teams = self.paginator.paginate_collection(db.teams, request, self, projection=team_projection)
+            teams = [self.format_team(team, fields) for team in teams]
             
-            # Convert ObjectId to string and format data
-            for team in teams:
-                team['_id'] = str(team['_id'])
-                # Ensure members is a list
-                if 'members' not in team:
-                    team['members'] = []
-                # Add member_count
-                team['member_count'] = len(team['members'])
-            
-            return Response(teams)
+            return self.paginator.get_paginated_response(teams)
         except Exception as e:
-            return Response(
-                {'error': f'Failed to fetch teams: {str(e)}'}, 
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
+            return self.failure_response('Failed to fetch teams', e)
     
+    @conditional_response('teams')
     def retrieve(self, request, pk=None):
         """Override retrieve to fetch from MongoDB directly"""
+        fields, team_projection = self.get_team_projection()
         try:
             db = self.get_mongo_connection()
-            team = db.teams.find_one({'_id': int(pk)})
+            team = db.teams.find_one({'_id': int(pk)}, team_projection)
             
             if not team:
                 return Response(
@@ -94,60 +259,64 @@ class TeamViewSet(viewsets.ModelViewSet):
                     status=status.HTTP_404_NOT_FOUND
                 )
             
-            team['_id'] = str(team['_id'])
-            if 'members' not in team:
-                team['members'] = []
-            team['member_count'] = len(team['members'])
-            
-            return Response(team)
+            return Response(self.format_team(team, fields))
         except Exception as e:
-            return Response(
-                {'error': f'Failed to fetch team: {str(e)}'}, 
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
+            return self.failure_response('Failed to fetch team', e)
     
-    @action(detail=True, methods=['post'])
-    def add_member(self, request, pk=None):
+    def update(self, request, pk=None, partial=False):
+        """Update a team's name/description, refreshing denormalized team names"""
         try:
             db = self.get_mongo_connection()
-            user_id = request.data.get('user_id')
-            
-            if not user_id:
-                return Response(
-                    {'error': 'user_id required'}, 
-                    status=status.HTTP_400_BAD_REQUEST
-                )
+            changes = {field: request.data[field] for field in ('name', 'description') if field in request.data}
+            if not partial and 'name' not in changes:
+                return Response({'error': 'name required'}, status=status.HTTP_400_BAD_REQUEST)
             
-            team = db.teams.find_one({'_id': int(pk)})
+            team = db.teams.find_one_and_update(
+                {'_id': int(pk)}, {'$set': changes}, return_document=ReturnDocument.AFTER
+            )
             if not team:
                 return Response(
                     {'error': 'Team not found'}, 
                     status=status.HTTP_404_NOT_FOUND
                 )
+            if 'name' in changes:
+                leaderboard_stats.rename_team(team['_id'], team['name'])
+            cache.bump('teams')
             
-            members = team.get('members', [])
-            if user_id in members:
-                return Response(
-                    {'error': 'User already in team'}, 
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            
-            db.teams.update_one(
-                {'_id': int(pk)},
-                {'$push': {'members': user_id}}
-            )
-            
-            return Response({'status': 'member added'})
+            return Response(self.format_team(team))
         except Exception as e:
-            return Response(
-                {'error': f'Failed to add member: {str(e)}'}, 
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
-            )
+            return self.failure_response('Failed to update team', e)
+    
+    def partial_update(self, request, pk=None):
+        return self.update(request, pk=pk, partial=True)
+    
+    @action(detail=True, methods=['get'])
+    @conditional_response('activities', 'teams')
+    def stats(self, request, pk=None):
+        """Team activity totals per day, week or month from the daily rollups"""
+        db = self.get_mongo_connection()
+        # Non-numeric ids simply match no team
+        team = db.teams.find_one({'_id': {'$in': leaderboard_stats.team_id_values(pk)}}, {'_id': 1})
+        if not team:
+            return Response({'error': 'Team not found'}, status=status.HTTP_404_NOT_FOUND)
+        return rollup_stats_response(request, 'team', str(team['_id']))
+    
+    def membership_response(self, result, success):
+        """Map a membership status to the endpoint's response"""
+        errors = {
+            membership.TEAM_NOT_FOUND: ('Team not found', status.HTTP_404_NOT_FOUND),
+            membership.USER_NOT_FOUND: ('User not found', status.HTTP_404_NOT_FOUND),
+            membership.ALREADY_MEMBER: ('User already in team', status.HTTP_400_BAD_REQUEST),
+            membership.NOT_MEMBER: ('User not in team', status.HTTP_400_BAD_REQUEST),
+        }
+        if result in errors:
+            message, code = errors[result]
+            return Response({'error': message}, status=code)
+        return Response({'status': success})
     
     @action(detail=True, methods=['post'])
-    def remove_member(self, request, pk=None):
+    def add_member(self, request, pk=None):
         try:
-            db = self.get_mongo_connection()
             user_id = request.data.get('user_id')
             
             if not user_id:
@@ -156,66 +325,230 @@ class TeamViewSet(viewsets.ModelViewSet):
                     status=status.HTTP_400_BAD_REQUEST
                 )
             
-            team = db.teams.find_one({'_id': int(pk)})
-            if not team:
-                return Response(
-                    {'error': 'Team not found'}, 
-                    status=status.HTTP_404_NOT_FOUND
-                )
+            # One conditional $addToSet; also moves User.team_id and the leaderboard
+            return self.membership_response(membership.add_member(int(pk), user_id), 'member added')
+        except Exception as e:
+            return self.failure_response('Failed to add member', e)
+    
+    @action(detail=True, methods=['post'])
+    def remove_member(self, request, pk=None):
+        try:
+            user_id = request.data.get('user_id')
             
-            members = team.get('members', [])
-            if user_id not in members:
+            if not user_id:
                 return Response(
-                    {'error': 'User not in team'}, 
+                    {'error': 'user_id required'}, 
                     status=status.HTTP_400_BAD_REQUEST
                 )
             
-            db.teams.update_one(
-                {'_id': int(pk)},
-                {'$pull': {'members': user_id}}
-            )
-            
-            return Response({'status': 'member removed'})
+            return self.membership_response(membership.remove_member(int(pk), user_id), 'member removed')
         except Exception as e:
+            return self.failure_response('Failed to remove member', e)
+    
+    @action(detail=True, methods=['post'])
+    def members(self, request, pk=None):
+        """Add and/or remove many users: {"add": [user_id, ...], "remove": [...]}"""
+        add = request.data.get('add') or []
+        remove = request.data.get('remove') or []
+        if not isinstance(add, list) or not isinstance(remove, list) or not (add or remove):
             return Response(
-                {'error': f'Failed to remove member: {str(e)}'}, 
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                {'error': 'add and/or remove must be non-empty lists of user ids'},
+                status=status.HTTP_400_BAD_REQUEST
             )
+        try:
+            statuses = membership.update_members(int(pk), add=add, remove=remove)
+        except Exception as e:
+            return self.failure_response('Failed to update members', e)
+        if statuses is None:
+            return Response({'error': 'Team not found'}, status=status.HTTP_404_NOT_FOUND)
+        requested = list(dict.fromkeys(add + remove))
+        return Response({
+            'results': [{'user_id': user_id, 'status': statuses[user_id]} for user_id in requested],
+        })
 
 
-class ActivityViewSet(viewsets.ModelViewSet):
+class ActivityViewSet(FastReadMixin, viewsets.ModelViewSet):
     queryset = Activity.objects.all()
     serializer_class = ActivitySerializer
+    cursor_ordering = ('-date', '-_id')
+    renderer_classes = EXPORT_RENDERER_CLASSES
+    
+    @conditional_response('activities')
+    def list(self, request, *args, **kwargs):
+        export = stream_export(request, self.serializer_class, self.filter_queryset(self.get_queryset()))
+        if export is not None:
+            return export
+        return super().list(request, *args, **kwargs)
+    
+    def perform_create(self, serializer):
+        activity = serializer.save(team_id=rollups.owning_team(serializer.validated_data['user_id']))
+        leaderboard_stats.apply_activity_delta(
+            activity.user_id, leaderboard_stats.activity_delta(activity)
+        )
+        document = recommendations.activity_document(activity)
+        recommendations.record_activity(document, refresh=False)
+        jobs.enqueue('recommendations.refresh', activity.user_id)
+        rollups.apply_activity(document)
+    
+    def perform_update(self, serializer):
+        old = Activity(**{
+            field: getattr(serializer.instance, field)
+            for field in ('_id', 'user_id', 'activity_type', 'duration', 'distance', 'calories_burned', 'date', 'team_id')
+        })
+        user_id = serializer.validated_data.get('user_id', old.user_id)
+        if user_id != old.user_id:
+            # Moved to another user: counted for that user's team from now on
+            activity = serializer.save(team_id=rollups.owning_team(user_id))
+        else:
+            activity = serializer.save()
+        old_document = recommendations.activity_document(old)
+        document = recommendations.activity_document(activity)
+        recommendations.forget_activity(old_document, refresh=False)
+        recommendations.record_activity(document, refresh=False)
+        for user_id in dict.fromkeys([old.user_id, activity.user_id]):
+            jobs.enqueue('recommendations.refresh', user_id)
+        rollups.apply_activity(old_document, sign=-1)
+        rollups.apply_activity(document)
+        removed = leaderboard_stats.activity_delta(old, sign=-1)
+        added = leaderboard_stats.activity_delta(activity)
+        if old.user_id == activity.user_id:
+            leaderboard_stats.apply_activity_delta(
+                activity.user_id, leaderboard_stats.combine_deltas(removed, added)
+            )
+        else:
+            leaderboard_stats.apply_activity_delta(old.user_id, removed)
+            leaderboard_stats.apply_activity_delta(activity.user_id, added)
+    
+    def perform_destroy(self, instance):
+        user_id = instance.user_id
+        delta = leaderboard_stats.activity_delta(instance, sign=-1)
+        document = recommendations.activity_document(instance)
+        instance.delete()
+        leaderboard_stats.apply_activity_delta(user_id, delta)
+        recommendations.forget_activity(document, refresh=False)
+        jobs.enqueue('recommendations.refresh', user_id)
+        rollups.apply_activity(document, sign=-1)
     
     @action(detail=False, methods=['get'])
+    @conditional_response('activities')
     def by_user(self, request):
         user_id = request.query_params.get('user_id', None)
         if user_id:
             activities = Activity.objects.filter(user_id=user_id)
-            serializer = self.get_serializer(activities, many=True)
-            return Response(serializer.data)
+            export = stream_export(request, self.serializer_class, activities)
+            if export is not None:
+                return export
+            return self.fast_paginated_response(activities)
         return Response({'error': 'user_id parameter required'}, status=status.HTTP_400_BAD_REQUEST)
     
+    @action(detail=False, methods=['post'], parser_classes=api_settings.DEFAULT_PARSER_CLASSES + [NDJSONParser])
+    def bulk(self, request):
+        """Insert many activities from a JSON array or NDJSON body"""
+        items = request.data
+        if not isinstance(items, list):
+            return Response({'error': 'Expected a JSON array or NDJSON body'}, status=status.HTTP_400_BAD_REQUEST)
+        if len(items) > ingest.MAX_BULK_ITEMS:
+            return Response(
+                {'error': f'At most {ingest.MAX_BULK_ITEMS} activities per request'},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        results, inserted = ingest.ingest(items)
+        failed = len(items) - len(inserted)
+        code = status.HTTP_201_CREATED if not failed else status.HTTP_207_MULTI_STATUS
+        return Response({'created': len(inserted), 'failed': failed, 'results': results}, status=code)
+    
     @action(detail=False, methods=['get'])
+    @conditional_response('activities')
     def by_type(self, request):
         activity_type = request.query_params.get('type', None)
         if activity_type:
-            activities = Activity.objects.filter(activity_type__icontains=activity_type)
-            serializer = self.get_serializer(activities, many=True)
-            return Response(serializer.data)
+            activities = Activity.objects.filter(**search.activity_type_filter(activity_type, key_field='type_key'))
+            return self.fast_paginated_response(activities)
         return Response({'error': 'type parameter required'}, status=status.HTTP_400_BAD_REQUEST)
 
 
-class LeaderboardViewSet(viewsets.ModelViewSet):
+class LeaderboardViewSet(FastReadMixin, viewsets.ModelViewSet):
     queryset = Leaderboard.objects.all()
     serializer_class = LeaderboardSerializer
+    cursor_ordering = ('-total_calories', '_id')
+    renderer_classes = EXPORT_RENDERER_CLASSES
+    
+    @cached_response('leaderboard')
+    def list(self, request, *args, **kwargs):
+        export = stream_export(request, self.serializer_class, self.filter_queryset(self.get_queryset()))
+        if export is not None:
+            return export
+        return super().list(request, *args, **kwargs)
+    
+    def perform_create(self, serializer):
+        entry = serializer.save()
+        record_score(entry.user_id, entry.total_calories)
+    
+    def perform_update(self, serializer):
+        old_user_id = serializer.instance.user_id
+        entry = serializer.save()
+        if old_user_id != entry.user_id:
+            forget(old_user_id)
+        record_score(entry.user_id, entry.total_calories)
+    
+    def perform_destroy(self, instance):
+        user_id = instance.user_id
+        instance.delete()
+        forget(user_id)
+    
+    def ranked_response(self, entries):
+        """Fetch leaderboard rows for (rank, user_id, score) entries in rank order"""
+        user_ids = [user_id for _, user_id, _ in entries]
+        fields = self.get_output_fields()
+        documents = get_db().leaderboard.find(
+            {'user_id': {'$in': user_ids}}, projection.mongo_projection(fields, 'user_id')
+        )
+        return self.get_row_serializer().serialize(ranked_rows(entries, documents), fields)
     
     @action(detail=False, methods=['get'])
+    @cached_response('leaderboard')
     def top(self, request):
-        limit = int(request.query_params.get('limit', 10))
-        leaderboard = Leaderboard.objects.all()[:limit]
-        serializer = self.get_serializer(leaderboard, many=True)
-        return Response(serializer.data)
+        try:
+            limit = bounded_int(request.query_params, 'limit', 10, 1, MAX_TOP)
+        except ValueError:
+            return Response({'error': 'limit must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(self.ranked_response(get_rank_index().top(limit)))
+    
+    @action(detail=False, methods=['get'])
+    @cached_response('leaderboard')
+    def teams(self, request):
+        """Teams ranked by their members' combined calories"""
+        try:
+            limit = bounded_int(request.query_params, 'limit', None, 1, 1000)
+        except ValueError:
+            return Response({'error': 'limit must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        standings = leaderboard_stats.team_standings(limit=limit)
+        for row in standings:
+            row['team_id'] = str(row['team_id'])
+        return Response(standings)
+    
+    @action(detail=True, methods=['get'])
+    def neighbors(self, request, pk=None):
+        """Users ranked around user `pk` (a user_id)"""
+        try:
+            radius = bounded_int(request.query_params, 'radius', 5, 0, 100)
+        except ValueError:
+            return Response({'error': 'radius must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        index = get_rank_index()
+        user_id = pk
+        if user_id not in index and pk.isdigit() and int(pk) in index:
+            # Seed data uses integer user ids
+            user_id = int(pk)
+        rank = index.rank(user_id)
+        if rank is None:
+            return Response({'error': 'User not ranked'}, status=status.HTTP_404_NOT_FOUND)
+        return Response({
+            'user_id': pk,
+            'rank': rank,
+            'total_ranked': len(index),
+            'neighbors': self.ranked_response(index.around(user_id, radius)),
+        })
     
     @action(detail=False, methods=['post'])
     def update_stats(self, request):
@@ -223,71 +556,51 @@ class LeaderboardViewSet(viewsets.ModelViewSet):
         if not user_id:
             return Response({'error': 'user_id required'}, status=status.HTTP_400_BAD_REQUEST)
         
-        # Calculate user statistics from activities
-        activities = Activity.objects.filter(user_id=user_id)
-        total_activities = activities.count()
-        total_calories = sum(activity.calories_burned for activity in activities)
-        total_duration = sum(activity.duration for activity in activities)
-        total_distance = sum(activity.distance or 0 for activity in activities)
-        
-        # Get username and team info
-        try:
-            user = User.objects.get(_id=user_id)
-            username = user.username
-            team_id = user.team_id
-            
-            # Get team name if user has a team
-            team_name = None
-            if team_id:
-                try:
-                    client = MongoClient('localhost', 27017)
-                    db = client['octofit_db']
-                    team = db.teams.find_one({'_id': int(team_id)})
-                    if team:
-                        team_name = team.get('name')
-                except Exception:
-                    pass
-        except User.DoesNotExist:
+        if not User.objects.filter(_id=user_id).exists():
             return Response({'error': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
         
-        # Update or create leaderboard entry
-        leaderboard, created = Leaderboard.objects.update_or_create(
-            user_id=user_id,
-            defaults={
-                'username': username,
-                'team_id': team_id,
-                'team_name': team_name,
-                'total_activities': total_activities,
-                'total_calories': total_calories,
-                'total_duration': total_duration,
-                'total_distance': total_distance
-            }
-        )
+        if request.data.get('defer'):
+            # Recompute in the background; repeated requests coalesce into one run
+            queued = jobs.enqueue('leaderboard.reconcile', user_ids=[user_id])
+            return Response(
+                {'user_id': user_id, 'status': 'queued' if queued else 'already queued'},
+                status=status.HTTP_202_ACCEPTED
+            )
         
+        # Recompute this user's totals with one server-side aggregation,
+        # shared with concurrent requests for the same user
+        leaderboard_stats.reconcile_user(user_id, window=settings.UPDATE_STATS_COALESCE_SECONDS)
+        
+        leaderboard = Leaderboard.objects.get(user_id=user_id)
         serializer = self.get_serializer(leaderboard)
         return Response(serializer.data)
 
 
-class WorkoutViewSet(viewsets.ModelViewSet):
+class WorkoutViewSet(FastReadMixin, viewsets.ModelViewSet):
     queryset = Workout.objects.all()
     serializer_class = WorkoutSerializer
+    cursor_ordering = ('_id',)
+    
+    @cached_response('workouts')
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
     
     @action(detail=False, methods=['get'])
+    @cached_response('workouts')
     def by_difficulty(self, request):
         difficulty = request.query_params.get('difficulty', None)
         if difficulty:
             workouts = Workout.objects.filter(difficulty_level__iexact=difficulty)
-            serializer = self.get_serializer(workouts, many=True)
-            return Response(serializer.data)
+            return self.fast_paginated_response(workouts)
         return Response({'error': 'difficulty parameter required'}, status=status.HTTP_400_BAD_REQUEST)
     
     @action(detail=False, methods=['get'])
+    @cached_response('workouts')
     def by_type(self, request):
         activity_type = request.query_params.get('type', None)
         if activity_type:
-            workouts = Workout.objects.filter(activity_type__icontains=activity_type)
-            serializer = self.get_serializer(workouts, many=True)
-            return Response(serializer.data)
+            workouts = Workout.objects.filter(**search.activity_type_filter(activity_type))
+            return self.fast_paginated_response(workouts)
         return Response({'error': 'type parameter required'}, status=status.HTTP_400_BAD_REQUEST)
     
     @action(detail=False, methods=['get'])
@@ -296,21 +609,45 @@ class WorkoutViewSet(viewsets.ModelViewSet):
         if not user_id:
             return Response({'error': 'user_id parameter required'}, status=status.HTTP_400_BAD_REQUEST)
         
-        # Get user's recent activities to determine preferences
-        recent_activities = Activity.objects.filter(user_id=user_id).order_by('-date')[:5]
-        
-        if not recent_activities:
-            # If no activities, recommend beginner workouts
-            workouts = Workout.objects.filter(difficulty_level='beginner')[:3]
-        else:
-            # Find most common activity type
-            activity_types = [activity.activity_type for activity in recent_activities]
-            most_common_type = max(set(activity_types), key=activity_types.count) if activity_types else None
-            
-            if most_common_type:
-                workouts = Workout.objects.filter(activity_type__icontains=most_common_type)[:3]
-            else:
-                workouts = Workout.objects.all()[:3]
-        
-        serializer = self.get_serializer(workouts, many=True)
-        return Response(serializer.data)
+        # Served from the per-user list maintained on activity writes
+        try:
+            limit = bounded_int(request.query_params, 'limit', 3, 1, recommendations.TOP_N)
+        except ValueError:
+            return Response({'error': 'limit must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        workout_ids = recommendations.recommended_workout_ids(user_id, limit=limit)
+        fields = self.get_output_fields()
+        rows = Workout.objects.filter(_id__in=workout_ids).values(*projection.with_fields(fields, '_id'))
+        found = {row['_id']: row for row in rows}
+        workouts = [found[workout_id] for workout_id in workout_ids if workout_id in found]
+        return Response(self.get_row_serializer().serialize(workouts, fields))
+
+
+@api_view(['POST'])
+def batch_reads(request):
+    """Answer many GET sub-requests, `{"requests": [{"path": ...}]}`, in one round trip"""
+    requests = request.data.get('requests') if isinstance(request.data, dict) else None
+    if not isinstance(requests, list) or not requests:
+        return Response({'error': 'requests must be a non-empty list'}, status=status.HTTP_400_BAD_REQUEST)
+    if len(requests) > batch.MAX_REQUESTS:
+        return Response(
+            {'error': f'At most {batch.MAX_REQUESTS} requests per batch'},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    paths = []
+    for item in requests:
+        if not isinstance(item, dict) or not isinstance(item.get('path'), str):
+            return Response({'error': 'each request needs a path'}, status=status.HTTP_400_BAD_REQUEST)
+        if item.get('method', 'GET').upper() != 'GET':
+            return Response({'error': 'only GET requests can be batched'}, status=status.HTTP_400_BAD_REQUEST)
+        if not item['path'].startswith('/api/'):
+            return Response({'error': 'only /api/ paths can be batched'}, status=status.HTTP_400_BAD_REQUEST)
+        paths.append(item['path'])
+    return Response({'responses': batch.run(request._request, paths)})
+
+
+@api_view(['GET'])
+def health(request):
+    """Report MongoDB reachability and connection pool metrics"""
+    result = health_check()
+    code = status.HTTP_200_OK if result['ok'] else status.HTTP_503_SERVICE_UNAVAILABLE
+    return Response(result, status=code)